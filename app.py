@@ -3,13 +3,16 @@ from flask_login import LoginManager, UserMixin, login_required, login_user, log
 from werkzeug.utils import secure_filename
 import json
 import os
+import re
 import sys
 import shutil
 from datetime import datetime, timedelta, date
 import uuid
 from config import TELEGRAM_BOT_TOKEN, ADMIN_TELEGRAM_ID, SECRET_KEY
-from database import get_db_manager, init_db
-from rating_system import calculate_user_rating_manual
+from database import get_db_manager, init_db, availability
+from database.db import RATING_BASE
+from rating_system import calculate_user_rating_manual, get_rating_engine, get_status_benefits
+from rating_simulator import get_rating_simulator
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
@@ -20,33 +23,32 @@ login_manager.login_view = 'login'
 
 PASSPORT_DIR = 'passport'
 
+# Поля консоли, которые редактируются в админ-панели
+CONSOLE_EDITABLE_FIELDS = ('name', 'model', 'games', 'rental_price', 'sale_price', 'show_photo_in_bot', 'photo_path')
+
+# Размер страницы для таблиц админ-панели
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 # Получаем менеджер БД
 db = get_db_manager()
+rating_engine = get_rating_engine()
 
 def load_json_file(collection_name):
     """Загрузка данных из MongoDB по названию коллекции"""
     try:
-        # Определяем метод доступа в зависимости от названия коллекции
-        if 'console' in collection_name.lower():
-            return db.get_consoles()
-        elif 'user' in collection_name.lower():
-            return db.get_users()
-        elif 'rental' in collection_name.lower() and 'request' not in collection_name.lower():
-            return db.get_rentals()
-        elif 'admin' in collection_name.lower():
-            return db.get_admins()
-        elif 'request' in collection_name.lower():
-            return db.get_rental_requests()
-        elif 'discount' in collection_name.lower():
-            return db.get_discounts()
-        elif 'calendar' in collection_name.lower() or 'blocked' in collection_name.lower():
+        name = collection_name.lower()
+        # Документы-одиночки хранятся целиком
+        if 'calendar' in name or 'blocked' in name:
             return db.get_calendar()
-        elif 'settings' in collection_name.lower():
+        elif 'settings' in name:
             return db.get_admin_settings()
-        elif 'rating' in collection_name.lower():
-            return db.get_ratings()
-        else:
-            return {}
+        
+        # Остальные коллекции загружаются с отслеживанием изменений
+        tracked_collection = db.resolve_collection(name)
+        if tracked_collection:
+            return db.load_tracked(tracked_collection)
+        return {}
     except Exception as e:
         print(f"❌ Ошибка загрузки из {collection_name}: {e}")
         return {}
@@ -54,41 +56,48 @@ def load_json_file(collection_name):
 def save_json_file(collection_name, data):
     """Сохранение данных в MongoDB по названию коллекции"""
     try:
-        # Определяем метод сохранения в зависимости от названия коллекции
-        if 'console' in collection_name.lower():
-            for console_id, console in data.items():
-                console['_id'] = console_id
-                db.save_console(console)
-        elif 'user' in collection_name.lower():
-            for user_id, user in data.items():
-                user['_id'] = user_id
-                db.save_user(user)
-        elif 'rental' in collection_name.lower() and 'request' not in collection_name.lower():
-            for rental_id, rental in data.items():
-                rental['_id'] = rental_id
-                db.save_rental(rental)
-        elif 'admin' in collection_name.lower():
-            for admin_id, admin in data.items():
-                admin['_id'] = admin_id
-                db.save_admin(admin)
-        elif 'request' in collection_name.lower():
-            for request_id, req in data.items():
-                req['_id'] = request_id
-                db.save_rental_request(req)
-        elif 'discount' in collection_name.lower():
-            for discount_id, discount in data.items():
-                discount['_id'] = discount_id
-                db.save_discount(discount)
-        elif 'calendar' in collection_name.lower() or 'blocked' in collection_name.lower():
-            db.save_calendar(data)
-        elif 'settings' in collection_name.lower():
-            db.save_admin_settings(data)
-        elif 'rating' in collection_name.lower():
-            for rating_id, rating in data.items():
-                rating['_id'] = rating_id
-                db.save_rating(rating)
+        name = collection_name.lower()
+        if 'calendar' in name or 'blocked' in name:
+            return db.save_calendar(data)
+        elif 'settings' in name:
+            return db.save_admin_settings(data)
+        
+        # Отправляем только вставленные, измененные и удаленные документы
+        tracked_collection = db.resolve_collection(name)
+        if tracked_collection:
+            return db.save_changes(tracked_collection, data)
+        return False
     except Exception as e:
         print(f"❌ Ошибка сохранения в {collection_name}: {e}")
+        return False
+
+def get_page_params(sort_fields, default_sort):
+    """Параметры страницы из query string: limit, cursor, sort, order"""
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    sort_field = request.args.get('sort', default_sort)
+    if sort_field not in sort_fields:
+        sort_field = default_sort
+    descending = request.args.get('order', 'desc') != 'asc'
+    return limit, request.args.get('cursor'), sort_field, descending
+
+def get_list_filter(fields, date_field):
+    """Фильтр списка по полям и диапазону дат (date_from, date_to)"""
+    query = {}
+    for field in fields:
+        value = request.args.get(field)
+        if value:
+            query[field] = value
+    
+    # Даты хранятся ISO-строками, поэтому сравниваются как строки
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    if date_from or date_to:
+        query[date_field] = {}
+        if date_from:
+            query[date_field]['$gte'] = date_from
+        if date_to:
+            query[date_field]['$lte'] = date_to if 'T' in date_to else f"{date_to}T23:59:59.999999"
+    return query
 
 def get_console_photo_path(console_id):
     """Получить путь к фото консоли если существует"""
@@ -112,8 +121,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    admins = load_json_file('admins')
-    if user_id in admins:
+    if db.get_admin(user_id):
         return User(user_id)
     return None
 
@@ -127,8 +135,8 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        admins = load_json_file('admins')
-        if username in admins and admins[username]['password'] == password:
+        admin_data = db.get_admin(username)
+        if admin_data and admin_data['password'] == password:
             user = User(username)
             login_user(user)
             return redirect(url_for('admin'))
@@ -145,11 +153,23 @@ def logout():
 @login_required
 def admin():
     consoles = load_json_file('consoles')
-    users = load_json_file('users')
-    rentals = load_json_file('rentals')
-    rental_requests = load_json_file('rental_requests')
+    # Активные аренды и заявки ограничены числом консолей, историю и пользователей
+    # отдаем первой страницей, остальное таблицы догружают через API
+    rentals = db.find_rentals({'status': 'active'})
+    completed_rentals, rentals_cursor = db.find_page('rentals', {'status': 'completed'}, 'start_time',
+                                                     limit=PAGE_SIZE, projection={'return_info': 0})
+    rentals.update(completed_rentals)
+    rental_requests = db.find_rental_requests({'status': 'pending_approval'})
+    users_page, users_cursor = db.find_page('users', sort_field='joined_at', limit=PAGE_SIZE)
     admin_settings = load_json_file('admin_settings')
     
+    # Пользователи для строк аренд и заявок
+    users = dict(users_page)
+    related_ids = {item.get('user_id') for item in list(rentals.values()) + list(rental_requests.values())}
+    missing_ids = [user_id for user_id in related_ids if user_id and user_id not in users]
+    if missing_ids:
+        users.update(db.find_users({'_id': {'$in': missing_ids}}))
+    
     # Добавляем пути к фото для каждой консоли
     for console_id, console in consoles.items():
         photo_path = get_console_photo_path(console_id)
@@ -157,15 +177,94 @@ def admin():
             console['photo_path'] = photo_path
     
     discounts = load_json_file('discounts')
+    dashboard_stats = db.get_dashboard_stats()
     
     return render_template('admin.html', 
                          consoles=consoles, 
                          users=users, 
+                         users_page=users_page,
+                         users_count=dashboard_stats.get('users_count', 0),
+                         users_cursor=users_cursor,
                          rentals=rentals,
+                         rentals_cursor=rentals_cursor,
                          rental_requests=rental_requests,
                          admin_settings=admin_settings,
                          discounts=discounts)
 
+@app.route('/api/dashboard-stats', methods=['GET'])
+@login_required
+def get_dashboard_stats():
+    """Счетчики панели: выручка, средний чек, доход сегодня и активный доход в час"""
+    stats = db.get_dashboard_stats()
+    revenue_total = stats.get('revenue_total', 0)
+    revenue_rentals = stats.get('revenue_rentals', 0)
+    
+    # Активный доход считаем по арендованным консолям (консоли читаются из кэша)
+    active_income = sum(console.get('rental_price', 0) for console in load_json_file('consoles').values()
+                        if console.get('status') == 'rented')
+    
+    return jsonify({
+        'success': True,
+        'stats': stats,
+        'total_revenue': revenue_total,
+        'today_revenue': stats.get('revenue_by_day', {}).get(datetime.now().strftime('%Y-%m-%d'), 0),
+        'avg_rental': round(revenue_total / revenue_rentals) if revenue_rentals else 0,
+        'active_income': active_income
+    })
+
+@app.route('/api/analytics', methods=['GET'])
+@login_required
+def get_analytics():
+    """Выручка и загрузка консолей по часам или дням из готовых агрегатов"""
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ('day', 'hour'):
+            return jsonify({'success': False, 'error': 'granularity: day или hour'}), 400
+        
+        # По умолчанию - последние 30 дней
+        date_to = request.args.get('date_to') or datetime.now().strftime('%Y-%m-%d')
+        date_from = request.args.get('date_from') or (
+            datetime.strptime(date_to[:10], '%Y-%m-%d') - timedelta(days=29)).strftime('%Y-%m-%d')
+        console_id = request.args.get('console_id')
+        
+        buckets = db.rollups.query(granularity, date_from, date_to, console_id)
+        
+        # Ряд по всем консолям и итоги по каждой консоли
+        series = {}
+        per_console = {}
+        for bucket in buckets:
+            for target in (series.setdefault(bucket['bucket'], {'bucket': bucket['bucket']}),
+                           per_console.setdefault(bucket['console_id'], {})):
+                for field in ('rented_hours', 'revenue', 'rentals'):
+                    target[field] = target.get(field, 0) + bucket.get(field, 0)
+        
+        range_hours = ((datetime.strptime(date_to[:10], '%Y-%m-%d') -
+                        datetime.strptime(date_from[:10], '%Y-%m-%d')).days + 1) * 24
+        consoles = load_json_file('consoles')
+        for item_id, totals in per_console.items():
+            totals['name'] = consoles.get(item_id, {}).get('name', item_id)
+            totals['rented_hours'] = round(totals.get('rented_hours', 0), 2)
+            totals['utilization'] = round(totals['rented_hours'] / range_hours, 4) if range_hours > 0 else 0
+        
+        totals = {field: sum(item.get(field, 0) for item in per_console.values())
+                  for field in ('rented_hours', 'revenue', 'rentals')}
+        for item in series.values():
+            item['rented_hours'] = round(item.get('rented_hours', 0), 2)
+        
+        return jsonify({
+            'success': True,
+            'granularity': granularity,
+            'date_from': date_from,
+            'date_to': date_to,
+            'series': list(series.values()),
+            'consoles': per_console,
+            'totals': totals
+        })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Даты в формате YYYY-MM-DD'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/admin/ratings')
 @login_required
 def admin_ratings():
@@ -175,12 +274,10 @@ def admin_ratings():
 @app.route('/api/consoles', methods=['GET', 'POST', 'PUT', 'DELETE'])
 @login_required
 def manage_consoles():
-    consoles = load_json_file('consoles')
-    
     if request.method == 'POST':
         data = request.json
         console_id = str(uuid.uuid4())
-        consoles[console_id] = {
+        console = {
             'id': console_id,
             'name': data['name'],
             'model': data['model'],
@@ -191,8 +288,8 @@ def manage_consoles():
             'status': 'available',
             'created_at': datetime.now().isoformat()
         }
-        save_json_file('consoles', consoles)
-        return jsonify({'status': 'success', 'console': consoles[console_id]})
+        db.save_console(console)
+        return jsonify({'status': 'success', 'console': console})
     
     elif request.method == 'PUT':
         data = request.json
@@ -201,50 +298,34 @@ def manage_consoles():
         if not console_id:
             return jsonify({'status': 'error', 'message': 'ID консоли не указан'})
         
-        if console_id not in consoles:
+        # Меняем только редактируемые поля: status, version и current_rental_id
+        # пишет движок бронирования, полная перезапись откатила бы его переходы
+        fields = {field: data[field] for field in CONSOLE_EDITABLE_FIELDS if field in data}
+        fields['updated_at'] = datetime.now().isoformat()
+        if not db.update_console(console_id, fields):
             return jsonify({'status': 'error', 'message': 'Консоль не найдена'})
         
-        # Обновляем данные консоли
-        console = consoles[console_id]
-        console['name'] = data.get('name', console['name'])
-        console['model'] = data.get('model', console['model'])
-        console['games'] = data.get('games', console.get('games', []))
-        console['rental_price'] = data.get('rental_price', console['rental_price'])
-        console['sale_price'] = data.get('sale_price', console.get('sale_price', 0))
-        console['show_photo_in_bot'] = data.get('show_photo_in_bot', console.get('show_photo_in_bot', True))
-        console['updated_at'] = datetime.now().isoformat()
-        
-        # Обновляем путь к фото если передан
-        if 'photo_path' in data:
-            console['photo_path'] = data['photo_path']
-        
-        save_json_file('consoles', consoles)
-        return jsonify({'status': 'success', 'console': console})
+        return jsonify({'status': 'success', 'console': db.get_console(console_id)})
     
     elif request.method == 'DELETE':
         console_id = request.json.get('console_id')
-        if console_id in consoles:
-            del consoles[console_id]
-            save_json_file('consoles', consoles)
+        if console_id and db.delete_console(console_id):
             return jsonify({'status': 'success'})
     
-    return jsonify(consoles)
+    return jsonify(load_json_file('consoles'))
 
 @app.route('/api/users', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def manage_users():
-    users = load_json_file('users')
-    
     if request.method == 'POST':
         action = request.json.get('action')
         user_id = request.json.get('user_id')
         
-        if user_id in users:
+        if user_id:
             if action == 'ban':
-                users[user_id]['is_banned'] = True
+                db.update_user(user_id, {'is_banned': True})
             elif action == 'unban':
-                users[user_id]['is_banned'] = False
-            save_json_file('users', users)
+                db.update_user(user_id, {'is_banned': False})
         
         return jsonify({'status': 'success'})
     
@@ -254,36 +335,21 @@ def manage_users():
         if not user_id:
             return jsonify({'status': 'error', 'message': 'ID пользователя не указан'})
         
-        if user_id not in users:
+        deleted_user = db.get_user(user_id)
+        if not deleted_user:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
         
         try:
             # Сохраняем данные пользователя до удаления для удаления документов
-            deleted_user = users[user_id]
             user_full_name = deleted_user.get('full_name', deleted_user.get('first_name', f'user_{user_id}'))
             
             # Удаляем пользователя из базы
-            del users[user_id]
-            save_json_file('users', users)
-            
-            # Удаляем связанные данные пользователя
-            rentals = load_json_file('rentals')
-            rental_requests = load_json_file('rental_requests')
-            
-            # Удаляем аренды пользователя
-            rentals_to_delete = [rental_id for rental_id, rental in rentals.items() if rental.get('user_id') == user_id]
-            for rental_id in rentals_to_delete:
-                del rentals[rental_id]
-            
-            # Удаляем заявки пользователя
-            requests_to_delete = [req_id for req_id, req in rental_requests.items() if req.get('user_id') == user_id]
-            for req_id in requests_to_delete:
-                del rental_requests[req_id]
-            
-            # Сохраняем обновленные данные
-            save_json_file('rentals', rentals)
-            save_json_file('rental_requests', rental_requests)
+            db.delete_user(user_id)
             
+            # Удаляем аренды и заявки пользователя
+            deleted_rentals = db.delete_user_rentals(user_id)
+            deleted_requests = db.delete_user_rental_requests(user_id)
+
             # Пытаемся удалить папку с документами пользователя
             import shutil
             safe_name = "".join(c for c in user_full_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
@@ -294,8 +360,8 @@ def manage_users():
             return jsonify({
                 'status': 'success', 
                 'message': 'Пользователь и все связанные данные удалены',
-                'deleted_rentals': len(rentals_to_delete),
-                'deleted_requests': len(requests_to_delete)
+                'deleted_rentals': deleted_rentals,
+                'deleted_requests': deleted_requests
             })
             
         except Exception as e:
@@ -305,25 +371,54 @@ def manage_users():
                 'message': f'Ошибка при удалении: {str(e)}'
             })
     
-    return jsonify({'success': True, 'users': users})
+    # Без параметров - первая страница: список пользователей не отдается целиком
+    limit, cursor, sort_field, descending = get_page_params(['joined_at', '_id'], 'joined_at')
+    query = get_list_filter([], 'joined_at')
+    if request.args.get('banned') in ('true', 'false'):
+        query['is_banned'] = True if request.args['banned'] == 'true' else {'$ne': True}
+    search = request.args.get('search', '').strip()
+    if search:
+        # Поиск для выбора пользователя: ID целиком или часть имени / ника
+        pattern = {'$regex': re.escape(search), '$options': 'i'}
+        query['$or'] = [{'_id': search}] + [{field: pattern} for field in ('first_name', 'full_name', 'username')]
+    
+    users, next_cursor = db.find_page('users', query, sort_field, descending, cursor, limit)
+    return jsonify({
+        'success': True,
+        'users': users,
+        'next_cursor': next_cursor,
+        'total': db.count_users(query)
+    })
 
 @app.route('/api/rentals', methods=['GET', 'POST'])
 @login_required
 def manage_rentals():
-    rentals = load_json_file('rentals')
-    
     if request.method == 'GET':
-        return jsonify(rentals)
+        # Без параметров - первая страница по убыванию start_time
+        limit, cursor, sort_field, descending = get_page_params(['start_time', '_id'], 'start_time')
+        query = get_list_filter(['status', 'user_id', 'console_id'], 'start_time')
+        rentals, next_cursor = db.find_page('rentals', query, sort_field, descending, cursor, limit,
+                                            projection={'return_info': 0})
+        
+        # Имена пользователей для строк таблицы
+        user_ids = list({rental.get('user_id') for rental in rentals.values()})
+        users = db.find_users({'_id': {'$in': user_ids}},
+                              projection={'full_name': 1, 'first_name': 1, 'username': 1})
+        
+        return jsonify({
+            'success': True,
+            'rentals': rentals,
+            'users': users,
+            'next_cursor': next_cursor,
+            'total': db.count_rentals(query)
+        })
     
     action = request.json.get('action')
     rental_id = request.json.get('rental_id')
     
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+    rental = db.get_rental(rental_id) if action == 'end' and rental_id else None
     
-    if action == 'end' and rental_id in rentals:
-        rental = rentals[rental_id]
-        
+    if rental:
         if rental['status'] == 'active':
             # Рассчитываем стоимость
             start_time = datetime.fromisoformat(rental['start_time'])
@@ -331,27 +426,20 @@ def manage_rentals():
             duration = end_time - start_time
             hours = max(1, int(duration.total_seconds() / 3600))
             
-            console = consoles[rental['console_id']]
+            console = db.get_console(rental['console_id'])
             total_cost = hours * console['rental_price']
             
-            # Завершаем аренду
-            rental['end_time'] = end_time.isoformat()
-            rental['status'] = 'completed'
-            rental['total_cost'] = total_cost
-            
-            # Освобождаем консоль
-            console['status'] = 'available'
+            # Завершаем аренду и освобождаем консоль (если ее не завершили параллельно)
+            if not db.booking.end_rental(rental_id, {
+                'end_time': end_time.isoformat(),
+                'total_cost': total_cost
+            }):
+                return jsonify({'status': 'error', 'message': 'Аренда не найдена или уже завершена'})
             
             # Обновляем статистику пользователя
             user_id = rental['user_id']
-            if user_id in users:
-                users[user_id]['total_spent'] = users[user_id].get('total_spent', 0) + total_cost
-            
-            # Сохраняем изменения
-            save_json_file('rentals', rentals)
-            save_json_file('consoles', consoles)
-            save_json_file('users', users)
-            
+            db.add_user_spent(user_id, total_cost)
+
             # Отправляем уведомление пользователю о завершении аренды
             try:
                 from bot import bot, notify_user_about_rental_end
@@ -395,32 +483,27 @@ def manage_admin_settings():
     
     return jsonify(settings)
 
+@app.route('/api/admin/cache-stats')
+@login_required
+def get_cache_stats():
+    """Попадания и промахи кэша чтения"""
+    return jsonify(db.get_cache_stats())
+
 @app.route('/api/rental-requests', methods=['GET', 'POST'])
 @login_required
 def manage_rental_requests():
-    rental_requests = load_json_file('rental_requests')
-    
     if request.method == 'POST':
         action = request.json.get('action')
         request_id = request.json.get('request_id')
+        request_data = db.get_rental_request(request_id) if request_id else None
         
-        if action == 'approve' and request_id in rental_requests:
-            request_data = rental_requests[request_id]
-            
+        if action == 'approve' and request_data:
             if request_data['status'] == 'pending_approval':
-                # Проверяем доступность консоли
-                consoles = load_json_file('consoles')
                 console_id = request_data['console_id']
+                console = db.get_console(console_id)
                 
-                if console_id in consoles and consoles[console_id]['status'] == 'available':
-                    # Одобряем заявку и создаем аренду
-                    request_data['status'] = 'approved'
-                    save_json_file('rental_requests', rental_requests)
-                    
+                if console:
                     # Создаем аренду (логика из бота)
-                    rentals = load_json_file('rentals')
-                    users = load_json_file('users')
-                    
                     rental_id = str(uuid.uuid4())
                     # Получаем данные о выбранном времени из заявки
                     selected_hours = request_data.get('selected_hours')
@@ -443,11 +526,10 @@ def manage_rental_requests():
                         'total_cost': 0
                     }
                     
-                    rentals[rental_id] = rental
-                    consoles[console_id]['status'] = 'rented'
-                    
-                    save_json_file('rentals', rentals)
-                    save_json_file('consoles', consoles)
+                    # Консоль занимается атомарно: из двух одобрений пройдет одно
+                    if not db.booking.start_rental(rental):
+                        return jsonify({'status': 'error', 'message': 'Консоль недоступна'})
+                    db.update_rental_request(request_id, {'status': 'approved'})
                     
                     # Отправляем уведомление пользователю в Telegram
                     try:
@@ -460,10 +542,8 @@ def manage_rental_requests():
                 else:
                     return jsonify({'status': 'error', 'message': 'Консоль недоступна'})
         
-        elif action == 'reject' and request_id in rental_requests:
-            request_data = rental_requests[request_id]
-            rental_requests[request_id]['status'] = 'rejected'
-            save_json_file('rental_requests', rental_requests)
+        elif action == 'reject' and request_data:
+            db.update_rental_request(request_id, {'status': 'rejected'})
             
             # Отправляем уведомление пользователю о отклонении
             try:
@@ -474,7 +554,16 @@ def manage_rental_requests():
             
             return jsonify({'status': 'success'})
     
-    return jsonify(rental_requests)
+    # Без параметров - первая страница по убыванию request_time
+    limit, cursor, sort_field, descending = get_page_params(['request_time', '_id'], 'request_time')
+    query = get_list_filter(['status', 'user_id', 'console_id'], 'request_time')
+    rental_requests, next_cursor = db.find_page('rental_requests', query, sort_field, descending, cursor, limit)
+    return jsonify({
+        'success': True,
+        'requests': rental_requests,
+        'next_cursor': next_cursor,
+        'total': db.count_rental_requests(query)
+    })
 
 @app.route('/api/location-request', methods=['POST'])
 @login_required
@@ -487,16 +576,14 @@ def request_user_location():
         if not user_id:
             return jsonify({'status': 'error', 'message': 'Не указан ID пользователя'})
         
-        users = load_json_file('users')
-        if user_id not in users:
+        user = db.get_user(user_id)
+        if not user:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
         
         # Импортируем бот и отправляем запрос геолокации
         from bot import bot
         from telebot import types
         
-        user = users[user_id]
-        
         # Создаем кнопку для отправки геолокации
         location_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
         location_button = types.KeyboardButton('📍 Отправить мою геолокацию', request_location=True)
@@ -522,11 +609,10 @@ def request_user_location():
 def get_user_documents(user_id):
     """Получить документы пользователя"""
     try:
-        users = load_json_file('users')
-        if user_id not in users:
+        user = db.get_user(user_id)
+        if not user:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
         
-        user = users[user_id]
         user_full_name = user.get('full_name', user.get('first_name', f'user_{user_id}'))
         
         # Импортируем функцию из бота
@@ -551,11 +637,10 @@ def get_user_documents(user_id):
 def view_document(user_id, document_type):
     """Просмотр конкретного документа пользователя"""
     try:
-        users = load_json_file('users')
-        if user_id not in users:
+        user = db.get_user(user_id)
+        if not user:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
         
-        user = users[user_id]
         user_full_name = user.get('full_name', user.get('first_name', f'user_{user_id}'))
         safe_name = "".join(c for c in user_full_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
         
@@ -601,20 +686,18 @@ def request_user_documents():
         if not user_id:
             return jsonify({'status': 'error', 'message': 'Не указан ID пользователя'})
         
-        users = load_json_file('users')
-        if user_id not in users:
+        user = db.get_user(user_id)
+        if not user:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
         
         # Импортируем бот и отправляем запрос документов
         from bot import bot
         from telebot import types
         
-        user = users[user_id]
         user_full_name = user.get('full_name', user.get('first_name', f'user_{user_id}'))
         
         # Обновляем статус пользователя для процесса верификации
-        users[user_id]['verification_step'] = 'passport_front'
-        save_json_file('users', users)
+        db.update_user(user_id, {'verification_step': 'passport_front'})
         
         user_message = f"📄 **Запрос повторной загрузки документов**\n\n"
         user_message += f"Администратор запросил повторную загрузку ваших документов.\n\n"
@@ -642,8 +725,6 @@ def request_user_documents():
 @app.route('/api/admins', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def manage_admins():
-    admins = load_json_file('admins')
-    
     if request.method == 'POST':
         data = request.json
         username = data.get('username')
@@ -656,20 +737,19 @@ def manage_admins():
         if len(password) < 6:
             return jsonify({'status': 'error', 'message': 'Пароль должен быть минимум 6 символов'})
         
-        if username in admins:
+        if db.get_admin(username):
             return jsonify({'status': 'error', 'message': 'Администратор с таким логином уже существует'})
         
         # Добавляем нового админа
-        admins[username] = {
+        db.save_admin({
             'username': username,
             'password': password,
             'role': 'admin',
             'chat_id': chat_id,
             'created_at': datetime.now().isoformat(),
             'created_by': current_user.id
-        }
+        })
         
-        save_json_file('admins', admins)
         return jsonify({'status': 'success', 'message': 'Администратор добавлен'})
     
     elif request.method == 'DELETE':
@@ -681,14 +761,13 @@ def manage_admins():
         if username == current_user.id:
             return jsonify({'status': 'error', 'message': 'Нельзя удалить себя'})
         
-        if username not in admins:
+        if not db.delete_admin(username):
             return jsonify({'status': 'error', 'message': 'Администратор не найден'})
         
-        del admins[username]
-        save_json_file('admins', admins)
         return jsonify({'status': 'success', 'message': 'Администратор удален'})
     
     # GET - возвращаем список админов (без паролей)
+    admins = load_json_file('admins')
     admins_safe = {}
     for username, admin_data in admins.items():
         admins_safe[username] = {
@@ -706,10 +785,11 @@ def manage_admins():
 def reset_all_data():
     """Сброс всех данных системы (консоли, аренды, заявки)"""
     try:
-        # Очищаем файлы данных, оставляя только пустые объекты
-        save_json_file('consoles', {})
-        save_json_file('rentals', {})
-        save_json_file('rental_requests', {})
+        # Очищаем коллекции: удаление документов фиксируется и сохраняется одним bulk_write
+        for collection_name in ['consoles', 'rentals', 'rental_requests']:
+            data = load_json_file(collection_name)
+            data.clear()
+            save_json_file(collection_name, data)
         
         return jsonify({
             'status': 'success', 
@@ -783,9 +863,9 @@ def upload_console_photo():
 def delete_console_photo(console_id):
     """Удаление фото консоли из локальной папки"""
     try:
-        consoles = load_json_file('consoles')
+        console = db.get_console(console_id)
         
-        if console_id not in consoles:
+        if not console:
             return jsonify({'status': 'error', 'message': 'Консоль не найдена'})
         
         # Удаляем файл фото если существует
@@ -800,13 +880,8 @@ def delete_console_photo(console_id):
                 deleted = True
                 print(f"Удален файл фото: {file_path}")
         
-        # Удаляем photo_path из данных консоли
-        if 'photo_path' in consoles[console_id]:
-            del consoles[console_id]['photo_path']
-        if 'photo_id' in consoles[console_id]:  # Для совместимости со старой системой
-            del consoles[console_id]['photo_id']
-        
-        save_json_file('consoles', consoles)
+        # Удаляем photo_path (и photo_id старой системы) только из этих полей консоли
+        db.update_console(console_id, {'updated_at': datetime.now().isoformat()}, unset=['photo_path', 'photo_id'])
         
         message = 'Фото успешно удалено' if deleted else 'Фото не найдено, но запись очищена'
         return jsonify({
@@ -863,8 +938,7 @@ def manage_discounts():
             return jsonify({'status': 'error', 'message': 'Фиксированная скидка должна быть больше 0'})
         
         # Проверка существования консоли
-        consoles = load_json_file('consoles')
-        if data['console_id'] not in consoles:
+        if not db.get_console(data['console_id']):
             return jsonify({'status': 'error', 'message': 'Консоль не найдена'})
         
         # Создание скидки
@@ -882,9 +956,7 @@ def manage_discounts():
             'created_at': datetime.now().isoformat()
         }
         
-        discounts = load_json_file('discounts')
-        discounts[discount_id] = discount
-        save_json_file('discounts', discounts)
+        db.save_discount(discount)
         
         return jsonify({
             'status': 'success',
@@ -896,15 +968,14 @@ def manage_discounts():
 @login_required
 def manage_discount(discount_id):
     """Управление конкретной скидкой"""
-    discounts = load_json_file('discounts')
+    discount = db.get_discount(discount_id)
     
-    if discount_id not in discounts:
+    if not discount:
         return jsonify({'status': 'error', 'message': 'Скидка не найдена'})
     
     if request.method == 'PUT':
         data = request.get_json()
-        discount = discounts[discount_id]
-        
+
         # Обновляем поля если они переданы
         updatable_fields = ['type', 'value', 'start_date', 'end_date', 'min_hours', 'description', 'active']
         for field in updatable_fields:
@@ -912,7 +983,7 @@ def manage_discount(discount_id):
                 discount[field] = data[field]
         
         discount['updated_at'] = datetime.now().isoformat()
-        save_json_file('discounts', discounts)
+        db.save_discount(discount)
         
         return jsonify({
             'status': 'success',
@@ -921,8 +992,7 @@ def manage_discount(discount_id):
         })
     
     elif request.method == 'DELETE':
-        del discounts[discount_id]
-        save_json_file('discounts', discounts)
+        db.delete_discount(discount_id)
         
         return jsonify({
             'status': 'success',
@@ -930,12 +1000,40 @@ def manage_discount(discount_id):
         })
 
 # API для управления заблокированными датами
+def get_month_bounds(year, month):
+    """Первый и последний день месяца (YYYY-MM-DD)"""
+    import calendar
+    
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, 1).isoformat(), date(year, month, last_day).isoformat()
+
+def get_date_range_args():
+    """Диапазон дат из параметров запроса: from/to или year/month"""
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    if year and month:
+        date_from, date_to = get_month_bounds(year, month)
+    return date_from, date_to
+
+def get_blocked_dates_data(console_id=None, date_from=None, date_to=None):
+    """Заблокированные даты в формате {system_blocked_dates, console_blocked_dates}"""
+    blocked_dates = {'system_blocked_dates': [], 'console_blocked_dates': {}}
+    for blocked in db.get_blocked_dates(console_id, date_from, date_to):
+        if blocked.get('console_id'):
+            blocked_dates['console_blocked_dates'].setdefault(blocked['console_id'], []).append(blocked['date'])
+        else:
+            blocked_dates['system_blocked_dates'].append(blocked['date'])
+    return blocked_dates
+
 @app.route('/api/blocked-dates', methods=['GET'])
 @login_required
 def get_blocked_dates():
     """Получить все заблокированные даты"""
     try:
-        blocked_dates = load_json_file('blocked_dates')
+        date_from, date_to = get_date_range_args()
+        blocked_dates = get_blocked_dates_data(request.args.get('console_id'), date_from, date_to)
         return jsonify({
             'success': True,
             'data': blocked_dates
@@ -954,16 +1052,8 @@ def add_system_blocked_date():
         if not date_str:
             return jsonify({'success': False, 'error': 'Дата не указана'})
         
-        blocked_dates = load_json_file('blocked_dates')
-        
-        if date_str not in blocked_dates['system_blocked_dates']:
-            blocked_dates['system_blocked_dates'].append(date_str)
-            blocked_dates['system_blocked_dates'].sort()
-            
-            if save_json_file('blocked_dates', blocked_dates):
-                return jsonify({'success': True, 'message': f'Дата {date_str} заблокирована для всех консолей'})
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения'})
+        if db.add_blocked_date(date_str):
+            return jsonify({'success': True, 'message': f'Дата {date_str} заблокирована для всех консолей'})
         else:
             return jsonify({'success': False, 'error': 'Дата уже заблокирована'})
             
@@ -975,15 +1065,8 @@ def add_system_blocked_date():
 def remove_system_blocked_date(date_str):
     """Удалить системную заблокированную дату"""
     try:
-        blocked_dates = load_json_file('blocked_dates')
-        
-        if date_str in blocked_dates['system_blocked_dates']:
-            blocked_dates['system_blocked_dates'].remove(date_str)
-            
-            if save_json_file('blocked_dates', blocked_dates):
-                return jsonify({'success': True, 'message': f'Дата {date_str} разблокирована'})
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения'})
+        if db.remove_blocked_date(date_str):
+            return jsonify({'success': True, 'message': f'Дата {date_str} разблокирована'})
         else:
             return jsonify({'success': False, 'error': 'Дата не найдена'})
             
@@ -1002,23 +1085,11 @@ def add_console_blocked_date():
         if not console_id or not date_str:
             return jsonify({'success': False, 'error': 'Консоль или дата не указаны'})
         
-        blocked_dates = load_json_file('blocked_dates')
-        
-        if console_id not in blocked_dates['console_blocked_dates']:
-            blocked_dates['console_blocked_dates'][console_id] = []
-        
-        if date_str not in blocked_dates['console_blocked_dates'][console_id]:
-            blocked_dates['console_blocked_dates'][console_id].append(date_str)
-            blocked_dates['console_blocked_dates'][console_id].sort()
-            
+        if db.add_blocked_date(date_str, console_id):
             # Получаем название консоли для сообщения
-            consoles = load_json_file('consoles')
-            console_name = consoles.get(console_id, {}).get('name', 'Неизвестная консоль')
-            
-            if save_json_file('blocked_dates', blocked_dates):
-                return jsonify({'success': True, 'message': f'Дата {date_str} заблокирована для {console_name}'})
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения'})
+            console = db.get_console(console_id) or {}
+            console_name = console.get('name', 'Неизвестная консоль')
+            return jsonify({'success': True, 'message': f'Дата {date_str} заблокирована для {console_name}'})
         else:
             return jsonify({'success': False, 'error': 'Дата уже заблокирована для этой консоли'})
             
@@ -1030,23 +1101,11 @@ def add_console_blocked_date():
 def remove_console_blocked_date(console_id, date_str):
     """Удалить заблокированную дату для консоли"""
     try:
-        blocked_dates = load_json_file('blocked_dates')
-        
-        if console_id in blocked_dates['console_blocked_dates'] and date_str in blocked_dates['console_blocked_dates'][console_id]:
-            blocked_dates['console_blocked_dates'][console_id].remove(date_str)
-            
-            # Удаляем пустой массив если дат больше нет
-            if not blocked_dates['console_blocked_dates'][console_id]:
-                del blocked_dates['console_blocked_dates'][console_id]
-            
+        if db.remove_blocked_date(date_str, console_id):
             # Получаем название консоли для сообщения
-            consoles = load_json_file('consoles')
-            console_name = consoles.get(console_id, {}).get('name', 'Неизвестная консоль')
-            
-            if save_json_file('blocked_dates', blocked_dates):
-                return jsonify({'success': True, 'message': f'Дата {date_str} разблокирована для {console_name}'})
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения'})
+            console = db.get_console(console_id) or {}
+            console_name = console.get('name', 'Неизвестная консоль')
+            return jsonify({'success': True, 'message': f'Дата {date_str} разблокирована для {console_name}'})
         else:
             return jsonify({'success': False, 'error': 'Дата не найдена'})
             
@@ -1063,44 +1122,12 @@ def get_calendar_preview(console_id, year, month):
         year = int(year)
         month = int(month)
         
-        # Получаем данные календаря
-        calendar_data_file = load_json_file('calendar')
-        
-        # Получаем настройки календаря
-        working_days = calendar_data_file.get('working_days', [1, 2, 3, 4, 5, 6, 7])
-        holidays = calendar_data_file.get('holidays', [])
-        system_blocked = calendar_data_file.get('system_blocked_dates', [])
-        console_blocked = calendar_data_file.get('console_blocked_dates', {}).get(console_id, [])
-        reservations = calendar_data_file.get('reservations', {})
-        
-        # Получаем занятые даты (из активных аренд)
-        rentals = load_json_file('rentals')
-        occupied_rental_dates = set()
-        
-        for rental in rentals.values():
-            if rental['console_id'] == console_id and rental['status'] == 'active':
-                start_date = datetime.fromisoformat(rental['start_time']).date()
-                # Проверяем наличие estimated_end_time или end_time
-                end_time_str = rental.get('estimated_end_time') or rental.get('end_time')
-                if end_time_str:
-                    end_date = datetime.fromisoformat(end_time_str).date()
-                else:
-                    # Если нет времени окончания, считаем только день начала
-                    end_date = start_date
-                
-                current_date = start_date
-                while current_date <= end_date:
-                    occupied_rental_dates.add(current_date.isoformat())
-                    current_date += timedelta(days=1)
-        
-        # Получаем занятые слоты из резерваций
-        occupied_reservation_dates = set()
-        for date_key, res_list in reservations.items():
-            if date_key.endswith(f"_{console_id}"):
-                date_part = date_key.split('_')[0]
-                if res_list:  # Если есть резервации на эту дату
-                    occupied_reservation_dates.add(date_part)
-        
+        # Маски дней месяца (общий кэш с календарем бота)
+        month_data = db.availability.get_month(console_id, year, month)
+        month_days = month_data['days']
+        holiday_dates = month_data['holidays']
+        reservations_count = month_data['reservations']
+
         # Создаем календарь
         cal = calendar.monthcalendar(year, month)
         month_name = calendar.month_name[month]
@@ -1123,12 +1150,7 @@ def get_calendar_preview(console_id, year, month):
                 'past_date': 'Прошедшая дата'
             }
         }
-        
-        # Создаем словарь праздников для быстрого поиска
-        holiday_dates = {}
-        for holiday in holidays:
-            holiday_dates[holiday['date']] = holiday
-        
+
         for week in cal:
             week_data = []
             for day in week:
@@ -1138,25 +1160,24 @@ def get_calendar_preview(console_id, year, month):
                     current_date = date(year, month, day)
                     date_str = current_date.isoformat()
                     weekday = current_date.weekday() + 1  # 1 = понедельник, 7 = воскресенье
+                    flags = month_days[date_str]
                     
                     # Определяем статус даты по приоритету
                     if current_date < today:
                         status = 'past_date'
-                    elif date_str in system_blocked:
+                    elif flags & availability.SYSTEM_BLOCKED:
                         status = 'system_blocked'
-                    elif date_str in console_blocked:
+                    elif flags & availability.CONSOLE_BLOCKED:
                         status = 'console_blocked'
-                    elif date_str in occupied_rental_dates:
+                    elif flags & availability.OCCUPIED:
                         status = 'occupied'
-                    elif date_str in occupied_reservation_dates:
+                    elif flags & availability.RESERVED:
                         status = 'reserved'
-                    elif date_str in holiday_dates:
-                        # Проверяем, рабочий ли это праздник
-                        if holiday_dates[date_str].get('working', False):
-                            status = 'available'
-                        else:
-                            status = 'holiday'
-                    elif weekday not in working_days:
+                    elif flags & availability.WORKING_HOLIDAY:
+                        status = 'available'
+                    elif flags & availability.HOLIDAY:
+                        status = 'holiday'
+                    elif flags & availability.NON_WORKING:
                         status = 'non_working_day'
                     else:
                         status = 'available'
@@ -1165,16 +1186,16 @@ def get_calendar_preview(console_id, year, month):
                         'day': day,
                         'date': date_str,
                         'status': status,
-                        'weekday': weekday
+                        'weekday': weekday,
+                        'has_discount': bool(flags & availability.DISCOUNT)
                     }
                     
                     # Добавляем дополнительную информацию
                     if date_str in holiday_dates:
                         day_info['holiday_name'] = holiday_dates[date_str]['name']
                     
-                    if date_str in occupied_reservation_dates:
-                        date_key = f"{date_str}_{console_id}"
-                        day_info['reservations_count'] = len(reservations.get(date_key, []))
+                    if date_str in reservations_count:
+                        day_info['reservations_count'] = reservations_count[date_str]
                     
                     week_data.append(day_info)
             
@@ -1196,6 +1217,11 @@ def get_calendar_data():
     """Получить все данные календаря"""
     try:
         calendar_data = load_json_file('calendar')
+        date_from, date_to = get_date_range_args()
+        
+        # Блокировки и праздники хранятся в отдельных коллекциях
+        calendar_data.update(get_blocked_dates_data(date_from=date_from, date_to=date_to))
+        calendar_data['holidays'] = db.get_holidays(date_from, date_to)
         return jsonify({
             'success': True,
             'data': calendar_data
@@ -1244,8 +1270,6 @@ def manage_calendar_settings():
 def manage_calendar_blocked_dates():
     """Управление заблокированными датами"""
     try:
-        calendar_data = load_json_file('calendar')
-        
         if request.method == 'POST':
             data = request.get_json()
             date_str = data.get('date')
@@ -1254,32 +1278,18 @@ def manage_calendar_blocked_dates():
             if not date_str:
                 return jsonify({'success': False, 'error': 'Дата не указана'})
             
+            if not db.add_blocked_date(date_str, console_id):
+                return jsonify({'success': False, 'error': 'Дата уже заблокирована'})
+            
             if console_id:
-                # Блокировка для конкретной консоли
-                if console_id not in calendar_data['console_blocked_dates']:
-                    calendar_data['console_blocked_dates'][console_id] = []
-                
-                if date_str not in calendar_data['console_blocked_dates'][console_id]:
-                    calendar_data['console_blocked_dates'][console_id].append(date_str)
-                    calendar_data['console_blocked_dates'][console_id].sort()
-                    message = f'Дата {date_str} заблокирована для консоли'
-                else:
-                    return jsonify({'success': False, 'error': 'Дата уже заблокирована'})
+                message = f'Дата {date_str} заблокирована для консоли'
             else:
-                # Системная блокировка
-                if date_str not in calendar_data['system_blocked_dates']:
-                    calendar_data['system_blocked_dates'].append(date_str)
-                    calendar_data['system_blocked_dates'].sort()
-                    message = f'Дата {date_str} заблокирована системно'
-                else:
-                    return jsonify({'success': False, 'error': 'Дата уже заблокирована'})
-            
-            save_json_file('calendar', calendar_data)
+                message = f'Дата {date_str} заблокирована системно'
             
             return jsonify({
                 'success': True,
                 'message': message,
-                'data': calendar_data
+                'data': get_blocked_dates_data()
             })
         
         elif request.method == 'DELETE':
@@ -1290,39 +1300,25 @@ def manage_calendar_blocked_dates():
             if not date_str:
                 return jsonify({'success': False, 'error': 'Дата не указана'})
             
+            if not db.remove_blocked_date(date_str, console_id):
+                return jsonify({'success': False, 'error': 'Дата не найдена'})
+            
             if console_id:
-                # Разблокировка для консоли
-                if (console_id in calendar_data['console_blocked_dates'] and 
-                    date_str in calendar_data['console_blocked_dates'][console_id]):
-                    calendar_data['console_blocked_dates'][console_id].remove(date_str)
-                    if not calendar_data['console_blocked_dates'][console_id]:
-                        del calendar_data['console_blocked_dates'][console_id]
-                    message = f'Дата {date_str} разблокирована для консоли'
-                else:
-                    return jsonify({'success': False, 'error': 'Дата не найдена'})
+                message = f'Дата {date_str} разблокирована для консоли'
             else:
-                # Системная разблокировка
-                if date_str in calendar_data['system_blocked_dates']:
-                    calendar_data['system_blocked_dates'].remove(date_str)
-                    message = f'Дата {date_str} разблокирована системно'
-                else:
-                    return jsonify({'success': False, 'error': 'Дата не найдена'})
-            
-            save_json_file('calendar', calendar_data)
+                message = f'Дата {date_str} разблокирована системно'
             
             return jsonify({
                 'success': True,
                 'message': message,
-                'data': calendar_data
+                'data': get_blocked_dates_data()
             })
         
         # GET
+        date_from, date_to = get_date_range_args()
         return jsonify({
             'success': True,
-            'data': {
-                'system_blocked_dates': calendar_data.get('system_blocked_dates', []),
-                'console_blocked_dates': calendar_data.get('console_blocked_dates', {})
-            }
+            'data': get_blocked_dates_data(request.args.get('console_id'), date_from, date_to)
         })
         
     except Exception as e:
@@ -1333,8 +1329,6 @@ def manage_calendar_blocked_dates():
 def manage_calendar_reservations():
     """Управление резервациями календаря"""
     try:
-        calendar_data = load_json_file('calendar')
-        
         if request.method == 'POST':
             data = request.get_json()
             
@@ -1344,28 +1338,20 @@ def manage_calendar_reservations():
                 'user_id': data.get('user_id'),
                 'date': data.get('date'),
                 'time_slot': data.get('time_slot'),
-                'duration_hours': data.get('duration_hours', 1),
+                'duration_hours': int(data.get('duration_hours', 1)),
                 'status': 'reserved',
                 'created_at': datetime.now().isoformat(),
                 'notes': data.get('notes', '')
             }
             
-            # Проверка доступности
-            date_key = f"{reservation['date']}_{reservation['console_id']}"
-            if date_key not in calendar_data['reservations']:
-                calendar_data['reservations'][date_key] = []
-            
-            # Проверка конфликтов времени
-            for existing in calendar_data['reservations'][date_key]:
-                if existing['time_slot'] == reservation['time_slot']:
-                    return jsonify({
-                        'success': False, 
-                        'error': 'Время уже занято'
-                    })
-            
-            calendar_data['reservations'][date_key].append(reservation)
-            save_json_file('calendar', calendar_data)
+            # Пересечение с другими резервациями отсекают почасовые маски дня консоли
+            if not db.add_calendar_reservation(reservation):
+                return jsonify({
+                    'success': False, 
+                    'error': 'Время уже занято'
+                })
             
+            reservation.pop('_id', None)
             return jsonify({
                 'success': True,
                 'message': 'Резервация создана',
@@ -1376,41 +1362,46 @@ def manage_calendar_reservations():
             data = request.get_json()
             reservation_id = data.get('reservation_id')
             
-            # Поиск и удаление резервации
-            for date_key, reservations in calendar_data['reservations'].items():
-                for i, reservation in enumerate(reservations):
-                    if reservation['id'] == reservation_id:
-                        del calendar_data['reservations'][date_key][i]
-                        if not calendar_data['reservations'][date_key]:
-                            del calendar_data['reservations'][date_key]
-                        
-                        save_json_file('calendar', calendar_data)
-                        
-                        return jsonify({
-                            'success': True,
-                            'message': 'Резервация удалена'
-                        })
+            if db.delete_calendar_reservation(reservation_id):
+                return jsonify({
+                    'success': True,
+                    'message': 'Резервация удалена'
+                })
             
             return jsonify({'success': False, 'error': 'Резервация не найдена'})
         
-        # GET - получить все резервации
+        # GET - резервации, сгруппированные по "{дата}_{консоль}"
+        date_from, date_to = get_date_range_args()
+        reservations = {}
+        for reservation in db.get_calendar_reservations(request.args.get('console_id'), date_from, date_to):
+            reservation.pop('_id', None)
+            date_key = f"{reservation['date']}_{reservation['console_id']}"
+            reservations.setdefault(date_key, []).append(reservation)
+        
         return jsonify({
             'success': True,
-            'data': calendar_data.get('reservations', {})
+            'data': reservations
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/calendar/availability/<console_id>/<date>')
+@app.route('/api/calendar/availability/<console_id>/<date_str>')
 @login_required
 def check_calendar_availability(console_id, date_str):
     """Проверить доступность консоли на дату"""
     try:
         calendar_data = load_json_file('calendar')
         
-        # Проверка системных блокировок
-        if date_str in calendar_data.get('system_blocked_dates', []):
+        # Проверка блокировок (системных и консоли) на эту дату
+        for blocked in db.get_blocked_dates(console_id, date_str, date_str):
+            if blocked.get('console_id'):
+                return jsonify({
+                    'success': True,
+                    'available': False,
+                    'reason': 'console_blocked',
+                    'message': 'Дата заблокирована для этой консоли'
+                })
             return jsonify({
                 'success': True,
                 'available': False,
@@ -1418,30 +1409,25 @@ def check_calendar_availability(console_id, date_str):
                 'message': 'Дата заблокирована системно'
             })
         
-        # Проверка блокировок консоли
-        console_blocked = calendar_data.get('console_blocked_dates', {}).get(console_id, [])
-        if date_str in console_blocked:
-            return jsonify({
-                'success': True,
-                'available': False,
-                'reason': 'console_blocked',
-                'message': 'Дата заблокирована для этой консоли'
-            })
-        
         # Проверка резерваций
-        date_key = f"{date_str}_{console_id}"
-        reservations = calendar_data.get('reservations', {}).get(date_key, [])
+        reservations = db.get_calendar_reservations(console_id, date_str, date_str)
+        for reservation in reservations:
+            reservation.pop('_id', None)
         
-        # Получаем доступные временные слоты
+        # Слоты, с которых можно занять duration_hours часов подряд
         all_slots = calendar_data.get('settings', {}).get('time_slots', [])
-        occupied_slots = [r['time_slot'] for r in reservations if r['status'] == 'reserved']
-        available_slots = [slot for slot in all_slots if slot not in occupied_slots]
+        duration_hours = request.args.get('duration_hours', 1, type=int)
+        available_slots = db.slots.free_slots(console_id, date_str, all_slots, duration_hours)
+        occupied_slots = [slot for slot in all_slots if slot not in available_slots]
+        longest_hours, longest_start = db.slots.longest_free(console_id, date_str)
         
         return jsonify({
             'success': True,
             'available': len(available_slots) > 0,
             'available_slots': available_slots,
             'occupied_slots': occupied_slots,
+            'longest_free_hours': longest_hours,
+            'longest_free_start': f"{longest_start:02d}:00" if longest_start is not None else None,
             'reservations': reservations
         })
         
@@ -1453,8 +1439,6 @@ def check_calendar_availability(console_id, date_str):
 def manage_calendar_holidays():
     """Управление праздничными днями"""
     try:
-        calendar_data = load_json_file('calendar')
-        
         if request.method == 'POST':
             data = request.get_json()
             holiday = {
@@ -1463,16 +1447,9 @@ def manage_calendar_holidays():
                 'working': data.get('working', False)  # Рабочий ли праздник
             }
             
-            if 'holidays' not in calendar_data:
-                calendar_data['holidays'] = []
-            
-            # Проверка на дубликаты
-            for existing in calendar_data['holidays']:
-                if existing['date'] == holiday['date']:
-                    return jsonify({'success': False, 'error': 'Праздник уже существует'})
-            
-            calendar_data['holidays'].append(holiday)
-            save_json_file('calendar', calendar_data)
+            # Проверка на дубликаты - по _id = дата
+            if not db.add_holiday(holiday):
+                return jsonify({'success': False, 'error': 'Праздник уже существует'})
             
             return jsonify({
                 'success': True,
@@ -1484,12 +1461,7 @@ def manage_calendar_holidays():
             data = request.get_json()
             date_str = data.get('date')
             
-            calendar_data['holidays'] = [
-                h for h in calendar_data.get('holidays', []) 
-                if h['date'] != date_str
-            ]
-            
-            save_json_file('calendar', calendar_data)
+            db.delete_holiday(date_str)
             
             return jsonify({
                 'success': True,
@@ -1497,9 +1469,10 @@ def manage_calendar_holidays():
             })
         
         # GET
+        date_from, date_to = get_date_range_args()
         return jsonify({
             'success': True,
-            'data': calendar_data.get('holidays', [])
+            'data': db.get_holidays(date_from, date_to)
         })
         
     except Exception as e:
@@ -1507,170 +1480,27 @@ def manage_calendar_holidays():
 
 # ===== СИСТЕМА РЕЙТИНГА КЛИЕНТОВ =====
 
-def calculate_discipline_score(transactions):
-    """Рассчитать дисциплину на основе последних транзакций"""
-    if not transactions:
-        return 50  # Базовый рейтинг для новых клиентов
-    
-    ratings_data = load_json_file('ratings')
-    discipline_rules = ratings_data.get('settings', {}).get('discipline_rules', {})
-    window = ratings_data.get('settings', {}).get('transactions_window', 5)
-    
-    # Берем последние N транзакций
-    recent_transactions = transactions[-window:]
-    scores = []
-    
-    for transaction in recent_transactions:
-        score = 100  # Базовый балл
-        
-        # Возврат вовремя
-        return_timing = transaction.get('return_timing', 'on_time')
-        timing_bonus = discipline_rules.get('return_timing', {}).get(return_timing, 0)
-        score += timing_bonus
-        
-        # Состояние имущества
-        item_condition = transaction.get('item_condition', 'perfect')
-        condition_bonus = discipline_rules.get('item_condition', {}).get(item_condition, 0)
-        score += condition_bonus
-        
-        # Соблюдение правил
-        rule_compliance = transaction.get('rule_compliance', 'no_violations')
-        compliance_bonus = discipline_rules.get('rule_compliance', {}).get(rule_compliance, 0)
-        score += compliance_bonus
-        
-        # Ограничиваем диапазон 0-100
-        score = max(0, min(100, score))
-        scores.append(score)
-    
-    # Возвращаем среднее значение
-    return round(sum(scores) / len(scores))
-
-def calculate_loyalty_score(user_id, user_data):
-    """Рассчитать лояльность клиента"""
-    ratings_data = load_json_file('ratings')
-    loyalty_rules = ratings_data.get('settings', {}).get('loyalty_rules', {})
-    
-    score = 0
-    
-    # Повторные аренды
-    rental_count = len(user_data.get('rentals', []))
-    repeat_bonus = min(rental_count * loyalty_rules.get('repeat_rentals', {}).get('bonus_per_rental', 5),
-                      loyalty_rules.get('repeat_rentals', {}).get('max_bonus', 30))
-    score += repeat_bonus
-    
-    # Участие в акциях (из профиля пользователя)
-    if user_data.get('promotion_participation', False):
-        score += loyalty_rules.get('promotion_participation', 10)
-    
-    # Срок сотрудничества
-    if 'joined_at' in user_data:
-        join_date = datetime.fromisoformat(user_data['joined_at'])
-        tenure_days = (datetime.now() - join_date).days
-        
-        tenure_bonus = 0
-        if tenure_days >= 365:  # 12+ месяцев
-            tenure_bonus = loyalty_rules.get('tenure_bonus', {}).get('12_months', 20)
-        elif tenure_days >= 180:  # 6+ месяцев
-            tenure_bonus = loyalty_rules.get('tenure_bonus', {}).get('6_months', 10)
-        
-        score += tenure_bonus
-    
-    # Дополнительные бонусы из профиля
-    score += user_data.get('loyalty_bonus', 0)
-    
-    # Ограничиваем диапазон 0-100
-    return max(0, min(100, score))
+# Названия статусов в админ-панели (бот показывает STATUS_NAMES с эмодзи)
+ADMIN_STATUS_NAMES = {'premium': 'Premium', 'regular': 'Обычный', 'risk': 'Риск'}
 
-def calculate_final_rating(user_id):
-    """Рассчитать итоговый рейтинг клиента"""
-    ratings_data = load_json_file('ratings')
-    settings = ratings_data.get('settings', {})
-    
-    # Загружаем данные пользователя
-    users = load_json_file('users')
-    if user_id not in users:
-        return None
-    
-    user_data = users[user_id]
-    
-    # Получаем транзакции пользователя
-    user_transactions = ratings_data.get('transactions', {}).get(user_id, [])
-    
-    # Рассчитываем компоненты
-    discipline = calculate_discipline_score(user_transactions)
-    loyalty = calculate_loyalty_score(user_id, user_data)
-    
-    # Итоговый рейтинг
-    discipline_weight = settings.get('discipline_weight', 0.6)
-    loyalty_weight = settings.get('loyalty_weight', 0.4)
-    
-    final_score = round(discipline * discipline_weight + loyalty * loyalty_weight)
-    final_score = max(0, min(100, final_score))
-    
-    # Определяем статус
-    thresholds = settings.get('status_thresholds', {})
-    if final_score >= thresholds.get('premium', 80):
-        status = 'premium'
-        status_name = 'Premium'
-    elif final_score >= thresholds.get('regular', 50):
-        status = 'regular'
-        status_name = 'Обычный'
-    else:
-        status = 'risk'
-        status_name = 'Риск'
-    
-    return {
-        'user_id': user_id,
-        'final_score': final_score,
-        'discipline': discipline,
-        'loyalty': loyalty,
-        'status': status,
-        'status_name': status_name,
-        'calculated_at': datetime.now().isoformat()
-    }
-
-def get_status_benefits(status):
-    """Получить льготы по статусу"""
-    benefits = {
-        'premium': {
-            'discount_percent': 10,
-            'deposit_multiplier': 0.8,
-            'priority_support': True,
-            'advance_booking_days': 45
-        },
-        'regular': {
-            'discount_percent': 0,
-            'deposit_multiplier': 1.0,
-            'priority_support': False,
-            'advance_booking_days': 30
-        },
-        'risk': {
-            'discount_percent': 0,
-            'deposit_multiplier': 1.5,
-            'priority_support': False,
-            'advance_booking_days': 7
-        }
-    }
-    return benefits.get(status, benefits['regular'])
+def admin_rating(rating):
+    """Копия рейтинга с названием статуса для админ-панели"""
+    if not rating:
+        return rating
+    return dict(rating, status_name=ADMIN_STATUS_NAMES.get(rating['status'], rating.get('status_name')))
 
 @app.route('/api/ratings', methods=['GET'])
 @login_required
 def get_all_ratings():
     """Получить рейтинги всех пользователей"""
     try:
-        users = load_json_file('users')
-        ratings = []
-        
-        for user_id in users.keys():
-            rating = calculate_final_rating(user_id)
-            if rating:
-                rating['user_name'] = users[user_id].get('first_name', 'Неизвестный')
-                rating['username'] = users[user_id].get('username', '')
-                ratings.append(rating)
-        
-        # Сортируем по рейтингу (по убыванию)
-        ratings.sort(key=lambda x: x['final_score'], reverse=True)
-        
+        # Лидерборд уже отсортирован по индексу final_score
+        ratings = [admin_rating(rating) for rating in rating_engine.get_top()]
+        for rating in ratings:
+            rating.pop('full_name', None)
+            rating['user_name'] = rating.pop('first_name', None) or 'Неизвестный'
+            rating['username'] = rating.get('username') or ''
+
         return jsonify({
             'success': True,
             'ratings': ratings
@@ -1684,21 +1514,19 @@ def get_all_ratings():
 def get_user_rating(user_id):
     """Получить рейтинг конкретного пользователя"""
     try:
-        rating = calculate_final_rating(user_id)
+        # Копия: рейтинг из кэша движка дополняется полями ответа
+        rating = admin_rating(rating_engine.get_rating(user_id))
         if not rating:
             return jsonify({'success': False, 'error': 'Пользователь не найден'})
         
         # Получаем дополнительную информацию
-        users = load_json_file('users')
-        user_data = users.get(user_id, {})
-        ratings_data = load_json_file('ratings')
-        transactions = ratings_data.get('transactions', {}).get(user_id, [])
+        user_data = db.get_user(user_id) or {}
         
         rating['user_name'] = user_data.get('first_name', 'Неизвестный')
         rating['username'] = user_data.get('username', '')
         rating['benefits'] = get_status_benefits(rating['status'])
-        rating['transactions_count'] = len(transactions)
-        rating['recent_transactions'] = transactions[-5:]  # Последние 5 транзакций
+        rating['transactions_count'] = db.count_rating_transactions(user_id)
+        rating['recent_transactions'] = rating_engine.get_transactions(user_id, limit=5)  # Последние 5 транзакций
         
         return jsonify({
             'success': True,
@@ -1732,16 +1560,12 @@ def add_rating_transaction():
             'created_by': current_user.id
         }
         
-        # Сохраняем транзакцию
-        ratings_data = load_json_file('ratings')
-        if user_id not in ratings_data['transactions']:
-            ratings_data['transactions'][user_id] = []
-        
-        ratings_data['transactions'][user_id].append(transaction)
-        save_json_file('ratings', ratings_data)
+        # Сохраняем транзакцию (одна вставка в журнал) и сдвигаем окно дисциплины
+        if not rating_engine.record_transaction(transaction):
+            return jsonify({'success': False, 'error': 'Ошибка сохранения транзакции'})
         
         # Пересчитываем рейтинг
-        new_rating = calculate_final_rating(user_id)
+        new_rating = admin_rating(rating_engine.get_rating(user_id))
         
         # Сохраняем в историю рейтингов
         ratings_data = load_json_file('ratings')
@@ -1781,7 +1605,10 @@ def manage_rating_settings():
             if 'settings' in data:
                 ratings_data['settings'].update(data['settings'])
                 save_json_file('ratings', ratings_data)
-                
+                # Окна дисциплины и лидерборд посчитаны для старых настроек
+                rating_engine.rebuild_windows()
+                rating_engine.rebuild_leaderboard()
+
                 return jsonify({
                     'success': True,
                     'message': 'Настройки рейтинговой системы обновлены'
@@ -1791,7 +1618,23 @@ def manage_rating_settings():
             'success': True,
             'settings': ratings_data.get('settings', {})
         })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/ratings/simulate', methods=['POST'])
+@login_required
+def simulate_rating_settings():
+    """Предпросмотр настроек рейтинга: распределение баллов и переходы между статусами"""
+    try:
+        data = request.get_json() or {}
+        simulation = get_rating_simulator().simulate(data.get('settings', {}))
         
+        return jsonify({
+            'success': True,
+            'simulation': simulation
+        })
+    
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1809,16 +1652,16 @@ def add_loyalty_bonus():
             return jsonify({'success': False, 'error': 'ID пользователя не указан'})
         
         # Обновляем бонус лояльности в профиле пользователя
-        users = load_json_file('users')
-        if user_id not in users:
+        user = db.get_user(user_id)
+        if not user:
             return jsonify({'success': False, 'error': 'Пользователь не найден'})
         
-        current_bonus = users[user_id].get('loyalty_bonus', 0)
-        users[user_id]['loyalty_bonus'] = max(0, min(100, current_bonus + bonus))
-        save_json_file('users', users)
+        current_bonus = user.get('loyalty_bonus', 0)
+        db.update_user(user_id, {'loyalty_bonus': max(0, min(100, current_bonus + bonus))})
         
-        # Пересчитываем рейтинг
-        new_rating = calculate_final_rating(user_id)
+        # Пересчитываем рейтинг и запись в лидерборде
+        rating_engine.refresh_ratings([user_id])
+        new_rating = admin_rating(rating_engine.get_rating(user_id))
         
         # Сохраняем в историю
         ratings_data = load_json_file('ratings')
@@ -1852,27 +1695,29 @@ def add_loyalty_bonus():
 def get_user_rentals(user_id):
     """Получить аренды конкретного пользователя"""
     try:
-        rentals = load_json_file('rentals')
-        consoles = load_json_file('consoles')
+        # Тяжелые поля (return_info, документы) не нужны для списка
+        rentals = db.get_user_rentals(user_id, projection=[
+            'console_id', 'status', 'start_time', 'end_time', 'total_cost', 'rating_score', 'location'
+        ])
+        consoles = db.get_consoles()
         
-        # Фильтруем аренды пользователя
+        # Формируем список аренд пользователя
         user_rentals = []
         for rental_id, rental in rentals.items():
-            if rental.get('user_id') == user_id:
-                # Добавляем информацию о консоли
-                console_info = consoles.get(rental.get('console_id'), {})
-                rental_info = {
-                    'id': rental_id,
-                    'console_id': rental.get('console_id'),
-                    'console_name': console_info.get('name', 'Неизвестная консоль'),
-                    'status': rental.get('status'),
-                    'start_time': rental.get('start_time'),
-                    'end_time': rental.get('end_time'),
-                    'total_cost': rental.get('total_cost', 0),
-                    'rating_score': rental.get('rating_score', None),
-                    'location': rental.get('location', None)  # Добавляем геолокацию
-                }
-                user_rentals.append(rental_info)
+            # Добавляем информацию о консоли
+            console_info = consoles.get(rental.get('console_id'), {})
+            rental_info = {
+                'id': rental_id,
+                'console_id': rental.get('console_id'),
+                'console_name': console_info.get('name', 'Неизвестная консоль'),
+                'status': rental.get('status'),
+                'start_time': rental.get('start_time'),
+                'end_time': rental.get('end_time'),
+                'total_cost': rental.get('total_cost', 0),
+                'rating_score': rental.get('rating_score', None),
+                'location': rental.get('location', None)  # Добавляем геолокацию
+            }
+            user_rentals.append(rental_info)
         
         # Сортируем по дате начала (новые первыми)
         user_rentals.sort(key=lambda x: x.get('start_time', ''), reverse=True)
@@ -1888,47 +1733,48 @@ def get_user_rentals(user_id):
 @app.route('/api/ratings/history', methods=['GET'])
 @login_required
 def get_rating_history():
-    """Получить историю всех транзакций рейтингов"""
+    """Страница истории транзакций рейтингов (новые первыми)"""
     try:
-        users = load_json_file('users')
-        ratings_data = load_json_file('ratings')
+        limit, cursor, sort_field, descending = get_page_params(['date', '_id'], 'date')
+        query = get_list_filter(['user_id', 'return_timing', 'item_condition', 'rule_compliance'], 'date')
+        # Только полные транзакции (с оценкой возврата)
+        query.setdefault('return_timing', {'$exists': True})
         
-        history_data = []
+        transactions, next_cursor = db.find_page('rating_transactions', query, sort_field, descending,
+                                                 cursor, limit)
         
-        for user_id in users.keys():
-            user = users[user_id]
-            user_transactions = ratings_data.get('transactions', {}).get(user_id, [])
-            
-            for transaction in user_transactions:
-                if 'return_timing' in transaction:  # Это полная транзакция
-                    # Получаем описание рейтинга
-                    rating_desc = get_rating_description(
-                        transaction.get('return_timing'),
-                        transaction.get('item_condition'),
-                        transaction.get('rule_compliance')
-                    )
-                    
-                    history_data.append({
-                        'user_id': user_id,
-                        'user_name': user.get('first_name', 'Неизвестный'),
-                        'username': user.get('username', ''),
-                        'full_name': user.get('full_name', ''),
-                        'date': transaction.get('created_at', '')[:10],
-                        'return_timing': transaction.get('return_timing'),
-                        'item_condition': transaction.get('item_condition'),
-                        'rule_compliance': transaction.get('rule_compliance'),
-                        'notes': transaction.get('notes', ''),
-                        'description': rating_desc,
-                        'rental_id': transaction.get('rental_id', ''),
-                        'transaction_id': transaction.get('id', '')
-                    })
-        
-        # Сортируем по дате (новые первыми)
-        history_data.sort(key=lambda x: x['date'], reverse=True)
+        # Имена только для пользователей текущей страницы
+        user_ids = list({transaction['user_id'] for transaction in transactions.values()})
+        users = db.find_users({'_id': {'$in': user_ids}},
+                              projection={'first_name': 1, 'username': 1, 'full_name': 1})
+        
+        history_data = []
+        for transaction in transactions.values():
+            user = users.get(transaction['user_id'], {})
+            history_data.append({
+                'user_id': transaction['user_id'],
+                'user_name': user.get('first_name', 'Неизвестный'),
+                'username': user.get('username', ''),
+                'full_name': user.get('full_name', ''),
+                'date': transaction.get('date', '')[:10],
+                'created_at': transaction.get('created_at', transaction.get('date', '')),
+                'return_timing': transaction.get('return_timing'),
+                'item_condition': transaction.get('item_condition'),
+                'rule_compliance': transaction.get('rule_compliance'),
+                'notes': transaction.get('notes', ''),
+                'description': get_rating_description(
+                    transaction.get('return_timing'),
+                    transaction.get('item_condition'),
+                    transaction.get('rule_compliance')
+                ),
+                'rental_id': transaction.get('rental_id', ''),
+                'transaction_id': transaction.get('id', '')
+            })
         
         return jsonify({
             'success': True,
-            'history': history_data
+            'history': history_data,
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
@@ -2006,42 +1852,55 @@ def api_add_manual_rating():
 def api_get_all_user_ratings():
     """Получить рейтинги всех пользователей"""
     db = get_db_manager()
-    users = db.get_all_users()
+    # Рейтинги считаются одной агрегацией по коллекции ratings
+    user_ratings = db.get_all_user_ratings()
     ratings = []
     
-    for user in users:
-        user_id = user.get('user_id')
-        rating_data = db.get_user_rating(user_id)
-        if rating_data:
-            ratings.append({
-                'user_id': user_id,
-                'username': user.get('first_name', ''),
-                'rating': rating_data.get('rating', 0),
-                'transaction_count': len(rating_data.get('transactions', []))
-            })
+    for user in db.iter_users(projection={'first_name': 1}):
+        user_id = str(user['_id'])
+        rating_data = user_ratings.get(user_id, {})
+        ratings.append({
+            'user_id': user_id,
+            'username': user.get('first_name', ''),
+            'rating': rating_data.get('rating', RATING_BASE),
+            'transaction_count': rating_data.get('transaction_count', 0)
+        })
     
     return jsonify({'success': True, 'ratings': ratings}), 200
 
 @app.route('/api/user-rating-history/<user_id>', methods=['GET'])
 @login_required
 def api_get_user_rating_history(user_id):
-    """Получить историю рейтинга пользователя со всеми транзакциями"""
+    """Страница истории рейтинга пользователя (новые сверху, по индексу user_timestamp)"""
     db = get_db_manager()
-    rating_data = db.get_user_rating(user_id)
+    summary = db.get_rating_summary(user_id)
     
-    if not rating_data:
+    if not summary:
         return jsonify({'success': False, 'message': 'Рейтинг пользователя не найден'}), 404
     
-    transactions = rating_data.get('transactions', [])
-    # Сортируем по дате (новые сверху)
-    transactions.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+    limit, cursor, _, descending = get_page_params(['timestamp'], 'timestamp')
+    query = get_list_filter(['console_condition', 'rule_compliance', 'return_timing'], 'timestamp')
+    query.update({'user_id': user_id, 'rental_id': {'$exists': True}})
+    ratings, next_cursor = db.find_page('ratings', query, 'timestamp', descending, cursor, limit)
+    
+    transactions = [{
+        'rating_id': rating_id,
+        'rental_id': doc.get('rental_id'),
+        'console_condition': doc.get('console_condition'),
+        'rule_compliance': doc.get('rule_compliance'),
+        'return_timing': doc.get('return_timing'),
+        'admin_id': doc.get('admin_id'),
+        'admin_notes': doc.get('admin_notes', ''),
+        'timestamp': doc.get('timestamp')
+    } for rating_id, doc in ratings.items()]
     
     return jsonify({
         'success': True,
         'user_id': user_id,
-        'current_rating': rating_data.get('rating', 0),
-        'total_transactions': len(transactions),
-        'transactions': transactions
+        'current_rating': summary.get('rating', 0),
+        'total_transactions': summary.get('transaction_count', 0),
+        'transactions': transactions,
+        'next_cursor': next_cursor
     }), 200
 
 # ==================== СТАРАЯ СИСТЕМА РЕЙТИНГА (оставляем для обратной совместимости) ====================
@@ -2085,11 +1944,10 @@ def return_form_page():
 def get_rental_info(rental_id):
     """Получить информацию об аренде для формы возврата"""
     try:
-        rentals = load_json_file('rentals')
-        if rental_id not in rentals:
+        rental = db.get_rental(rental_id)
+        if not rental:
             return jsonify({'success': False, 'message': 'Аренда не найдена'}), 404
-        
-        rental = rentals[rental_id]
+
         return jsonify({
             'success': True,
             'rental': {
@@ -2152,13 +2010,6 @@ def process_return_rental():
         result = db.save_return_info(rental_id, return_data)
         
         if result:
-            # Обновляем аренду в JSON для совместимости
-            rentals = load_json_file('rentals')
-            if rental_id in rentals:
-                rentals[rental_id]['return_info'] = return_data
-                rentals[rental_id]['status'] = 'returned'
-                save_json_file('rentals', rentals)
-            
             return jsonify({
                 'success': True,
                 'message': 'Информация о возврате успешно зарегистрирована',
@@ -2266,6 +2117,11 @@ if __name__ == '__main__':
     else:
         print("⚠️ Не удалось подключиться к MongoDB!")
     
+    # Сбрасываем кэши при записях из бота и других процессов
+    db.start_change_feed()
+    # Лидерборд пересчитывается в фоне, а не на запросах панели
+    rating_engine.start_reconcile()
+    
     # Импортируем новую систему рейтинга
     from rating_system import (
         get_completed_rentals_for_rating,
@@ -7,7 +7,8 @@ import calendar
 from datetime import datetime, timedelta, date
 import uuid
 from config import TELEGRAM_BOT_TOKEN, ADMIN_TELEGRAM_ID
-from database import get_db_manager
+from database import get_db_manager, availability
+from rating_system import get_rating_engine, get_status_benefits
 
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
 
@@ -15,6 +16,7 @@ PASSPORT_DIR = 'passport'
 
 # Получаем менеджер БД
 db = get_db_manager()
+rating_engine = get_rating_engine()
 
 # Создаем папку для паспортов если её нет
 if not os.path.exists(PASSPORT_DIR):
@@ -23,29 +25,18 @@ if not os.path.exists(PASSPORT_DIR):
 def load_json_file(collection_name):
     """Загрузка данных из MongoDB по названию коллекции"""
     try:
-        # Определяем метод доступа в зависимости от названия коллекции
-        if 'console' in collection_name.lower():
-            return db.get_consoles()
-        elif 'user' in collection_name.lower():
-            return db.get_users()
-        elif 'rental' in collection_name.lower() and 'request' not in collection_name.lower():
-            return db.get_rentals()
-        elif 'admin' in collection_name.lower():
-            return db.get_admins()
-        elif 'request' in collection_name.lower():
-            return db.get_rental_requests()
-        elif 'discount' in collection_name.lower():
-            return db.get_discounts()
-        elif 'calendar' in collection_name.lower() or 'blocked' in collection_name.lower():
+        name = collection_name.lower()
+        # Документы-одиночки хранятся целиком
+        if 'calendar' in name or 'blocked' in name:
             return db.get_calendar()
-        elif 'settings' in collection_name.lower():
+        elif 'settings' in name:
             return db.get_admin_settings()
-        elif 'rating' in collection_name.lower():
-            return db.get_ratings()
-        elif 'temp' in collection_name.lower():
-            return db.get_temp_reservations()
-        else:
-            return {}
+        
+        # Остальные коллекции загружаются с отслеживанием изменений
+        tracked_collection = db.resolve_collection(name)
+        if tracked_collection:
+            return db.load_tracked(tracked_collection)
+        return {}
     except Exception as e:
         print(f"❌ Ошибка загрузки из {collection_name}: {e}")
         return {}
@@ -53,58 +44,33 @@ def load_json_file(collection_name):
 def save_json_file(collection_name, data):
     """Сохранение данных в MongoDB по названию коллекции"""
     try:
-        # Определяем метод сохранения в зависимости от названия коллекции
-        if 'console' in collection_name.lower():
-            for console_id, console in data.items():
-                console['_id'] = console_id
-                db.save_console(console)
-        elif 'user' in collection_name.lower():
-            for user_id, user in data.items():
-                user['_id'] = user_id
-                db.save_user(user)
-        elif 'rental' in collection_name.lower() and 'request' not in collection_name.lower():
-            for rental_id, rental in data.items():
-                rental['_id'] = rental_id
-                db.save_rental(rental)
-        elif 'admin' in collection_name.lower():
-            for admin_id, admin in data.items():
-                admin['_id'] = admin_id
-                db.save_admin(admin)
-        elif 'request' in collection_name.lower():
-            for request_id, req in data.items():
-                req['_id'] = request_id
-                db.save_rental_request(req)
-        elif 'discount' in collection_name.lower():
-            for discount_id, discount in data.items():
-                discount['_id'] = discount_id
-                db.save_discount(discount)
-        elif 'calendar' in collection_name.lower() or 'blocked' in collection_name.lower():
-            db.save_calendar(data)
-        elif 'settings' in collection_name.lower():
-            db.save_admin_settings(data)
-        elif 'rating' in collection_name.lower():
-            for rating_id, rating in data.items():
-                rating['_id'] = rating_id
-                db.save_rating(rating)
-        elif 'temp' in collection_name.lower():
-            for temp_id, temp_data in data.items():
-                temp_data['_id'] = temp_id
-                db.save_temp_reservation(temp_data)
+        name = collection_name.lower()
+        if 'calendar' in name or 'blocked' in name:
+            return db.save_calendar(data)
+        elif 'settings' in name:
+            return db.save_admin_settings(data)
+        
+        # Отправляем только вставленные, измененные и удаленные документы
+        tracked_collection = db.resolve_collection(name)
+        if tracked_collection:
+            return db.save_changes(tracked_collection, data)
+        return False
     except Exception as e:
         print(f"❌ Ошибка сохранения в {collection_name}: {e}")
+        return False
 
 def is_user_banned(user_id):
-    users = load_json_file('users')
-    return users.get(str(user_id), {}).get('is_banned', False)
+    user = db.get_user(user_id) or {}
+    return user.get('is_banned', False)
 
 def mark_user_as_unavailable(user_id):
     """Помечаем пользователя как недоступного для уведомлений"""
     try:
-        users = load_json_file('users')
-        if user_id in users:
-            users[user_id]['bot_blocked'] = True
-            users[user_id]['bot_blocked_at'] = datetime.now().isoformat()
-            save_json_file('users', users)
+        updated = db.update_user(user_id, {
+            'bot_blocked': True,
+            'bot_blocked_at': datetime.now().isoformat()
+        })
+        if updated:
             print(f"📝 Пользователь {user_id} помечен как заблокировавший бота")
     except Exception as e:
         print(f"Ошибка при обновлении статуса пользователя {user_id}: {e}")
@@ -152,355 +118,93 @@ def get_admin_chat_id():
     settings = load_json_file('admin_settings')
     return settings.get('admin_chat_id', ADMIN_TELEGRAM_ID)
 
-def get_discount_for_console(console_id):
-    """Получить активную скидку для консоли"""
-    discounts = load_json_file('discounts')
-    
-    for discount_id, discount in discounts.items():
-        if (discount['console_id'] == console_id and 
-            discount['active'] and 
-            datetime.now() >= datetime.fromisoformat(discount['start_date']) and
-            datetime.now() <= datetime.fromisoformat(discount['end_date'])):
-            return discount
-    
-    return None
-
-def check_date_has_discount(console_id, target_date):
-    """Проверить, есть ли скидка на консоль в конкретную дату"""
-    discounts = load_json_file('discounts')
-    
-    for discount_id, discount in discounts.items():
-        if (discount['console_id'] == console_id and 
-            discount['active'] and 
-            datetime.fromisoformat(discount['start_date']).date() <= target_date and
-            datetime.fromisoformat(discount['end_date']).date() >= target_date):
-            return True
-    
-    return False
 
 # ===== ФУНКЦИИ ДЛЯ РАБОТЫ С РЕЙТИНГАМИ =====
 
-def calculate_discipline_score(transactions):
-    """Рассчитать дисциплину на основе последних транзакций"""
-    if not transactions:
-        return 50  # Базовый рейтинг для новых клиентов
-    
-    try:
-        ratings_data = load_json_file('ratings')
-        discipline_rules = ratings_data.get('settings', {}).get('discipline_rules', {})
-        window = ratings_data.get('settings', {}).get('transactions_window', 5)
-        
-        # Берем последние N транзакций
-        recent_transactions = transactions[-window:]
-        scores = []
-        
-        for transaction in recent_transactions:
-            score = 100  # Базовый балл
-            
-            # Возврат вовремя
-            return_timing = transaction.get('return_timing', 'on_time')
-            timing_bonus = discipline_rules.get('return_timing', {}).get(return_timing, 0)
-            score += timing_bonus
-            
-            # Состояние имущества
-            item_condition = transaction.get('item_condition', 'perfect')
-            condition_bonus = discipline_rules.get('item_condition', {}).get(item_condition, 0)
-            score += condition_bonus
-            
-            # Соблюдение правил
-            rule_compliance = transaction.get('rule_compliance', 'no_violations')
-            compliance_bonus = discipline_rules.get('rule_compliance', {}).get(rule_compliance, 0)
-            score += compliance_bonus
-            
-            # Ограничиваем диапазон 0-100
-            score = max(0, min(100, score))
-            scores.append(score)
-        
-        # Возвращаем среднее значение
-        return round(sum(scores) / len(scores))
-    except Exception as e:
-        print(f"Ошибка расчета дисциплины: {e}")
-        return 50
-
-def calculate_loyalty_score(user_id, user_data):
-    """Рассчитать лояльность клиента"""
-    try:
-        ratings_data = load_json_file('ratings')
-        loyalty_rules = ratings_data.get('settings', {}).get('loyalty_rules', {})
-        
-        score = 0
-        
-        # Повторные аренды
-        rentals = load_json_file('rentals')
-        user_rentals = [r for r in rentals.values() if r.get('user_id') == user_id]
-        rental_count = len(user_rentals)
-        
-        repeat_bonus = min(rental_count * loyalty_rules.get('repeat_rentals', {}).get('bonus_per_rental', 5),
-                          loyalty_rules.get('repeat_rentals', {}).get('max_bonus', 30))
-        score += repeat_bonus
-        
-        # Участие в акциях (из профиля пользователя)
-        if user_data.get('promotion_participation', False):
-            score += loyalty_rules.get('promotion_participation', 10)
-        
-        # Срок сотрудничества
-        if 'joined_at' in user_data:
-            join_date = datetime.fromisoformat(user_data['joined_at'])
-            tenure_days = (datetime.now() - join_date).days
-            
-            tenure_bonus = 0
-            if tenure_days >= 365:  # 12+ месяцев
-                tenure_bonus = loyalty_rules.get('tenure_bonus', {}).get('12_months', 20)
-            elif tenure_days >= 180:  # 6+ месяцев
-                tenure_bonus = loyalty_rules.get('tenure_bonus', {}).get('6_months', 10)
-            
-            score += tenure_bonus
-        
-        # Дополнительные бонусы из профиля
-        score += user_data.get('loyalty_bonus', 0)
-        
-        # Ограничиваем диапазон 0-100
-        return max(0, min(100, score))
-    except Exception as e:
-        print(f"Ошибка расчета лояльности: {e}")
-        return 0
+def build_rating_transaction(user_id, transaction_type, points, comment, admin_id=None):
+    """Создать запись транзакции рейтинга"""
+    transaction = {
+        'user_id': str(user_id),
+        'type': transaction_type,
+        'points': points,
+        'comment': comment,
+        'date': datetime.now().isoformat()
+    }
+    if admin_id:
+        transaction['admin_id'] = admin_id
+    else:
+        transaction['auto_generated'] = True
+    return transaction
 
-def add_rating_transaction(user_id, transaction_type, points, comment):
-    """Добавляет транзакцию рейтинга для пользователя"""
-    import json
-    import datetime
-    
-    try:
-        ratings_data = load_json_file('ratings')
-        
-        if 'transactions' not in ratings_data:
-            ratings_data['transactions'] = {}
-        if user_id not in ratings_data['transactions']:
-            ratings_data['transactions'][user_id] = []
-        
-        transaction = {
-            'type': transaction_type,
-            'points': points,
-            'comment': comment,
-            'date': datetime.datetime.now().isoformat(),
-            'auto_generated': True
-        }
-        
-        ratings_data['transactions'][user_id].append(transaction)
-        
-        with open('ratings', 'w', encoding='utf-8') as f:
-            json.dump(ratings_data, f, ensure_ascii=False, indent=2)
-        
-        return True
-    except Exception as e:
-        print(f"Ошибка добавления рейтинг транзакции: {e}")
-        return False
+def add_rating_transaction(user_id, transaction_type, points, comment, admin_id=None):
+    """Добавляет транзакцию рейтинга для пользователя (одна вставка в журнал)"""
+    return rating_engine.record_transaction(build_rating_transaction(user_id, transaction_type, points, comment, admin_id))
 
 def update_rating_on_rental_completion(user_id, rental_data, return_condition='perfect', on_time=True):
     """Обновляет рейтинг при завершении аренды"""
+    transactions = []
     
     # Добавляем баллы дисциплины в зависимости от условий возврата
     if on_time:
-        add_rating_transaction(user_id, 'return_timing', 10, 'Возврат вовремя')
+        transactions.append(build_rating_transaction(user_id, 'return_timing', 10, 'Возврат вовремя'))
     else:
         # Определяем размер штрафа в зависимости от задержки
         # Здесь можно добавить логику определения задержки
-        add_rating_transaction(user_id, 'return_timing', -20, 'Опоздание при возврате')
+        transactions.append(build_rating_transaction(user_id, 'return_timing', -20, 'Опоздание при возврате'))
     
     # Баллы за состояние предмета
     if return_condition == 'perfect':
-        add_rating_transaction(user_id, 'item_condition', 10, 'Отличное состояние')
+        transactions.append(build_rating_transaction(user_id, 'item_condition', 10, 'Отличное состояние'))
     elif return_condition == 'minor_defects':
-        add_rating_transaction(user_id, 'item_condition', -15, 'Незначительные повреждения')
+        transactions.append(build_rating_transaction(user_id, 'item_condition', -15, 'Незначительные повреждения'))
     elif return_condition == 'major_defects':
-        add_rating_transaction(user_id, 'item_condition', -30, 'Значительные повреждения')
+        transactions.append(build_rating_transaction(user_id, 'item_condition', -30, 'Значительные повреждения'))
     
     # Бонус лояльности за повторную аренду
     try:
-        rentals = load_json_file('rentals')
-        user_rentals = [r for r in rentals.values() if r['user_id'] == user_id and r['status'] == 'completed']
+        completed_count = db.count_rentals({'user_id': user_id, 'status': 'completed'})
         
-        if len(user_rentals) >= 2:  # Не первая аренда
-            add_rating_transaction(user_id, 'repeat_rental', 5, f'Повторная аренда #{len(user_rentals)}')
+        if completed_count >= 2:  # Не первая аренда
+            transactions.append(build_rating_transaction(user_id, 'repeat_rental', 5, f'Повторная аренда #{completed_count}'))
     except:
         pass
-
-def calculate_user_final_rating(user_id):
-    """Рассчитать итоговый рейтинг пользователя"""
-    try:
-        ratings_data = load_json_file('ratings')
-        settings = ratings_data.get('settings', {})
-        
-        # Загружаем данные пользователя
-        users = load_json_file('users')
-        if user_id not in users:
-            return None
-        
-        user_data = users[user_id]
-        
-        # Получаем транзакции пользователя
-        user_transactions = ratings_data.get('transactions', {}).get(user_id, [])
-        
-        # Рассчитываем компоненты
-        discipline = calculate_discipline_score(user_transactions)
-        loyalty = calculate_loyalty_score(user_id, user_data)
-        
-        # Итоговый рейтинг
-        discipline_weight = settings.get('discipline_weight', 0.6)
-        loyalty_weight = settings.get('loyalty_weight', 0.4)
-        
-        final_score = round(discipline * discipline_weight + loyalty * loyalty_weight)
-        final_score = max(0, min(100, final_score))
-        
-        # Определяем статус
-        thresholds = settings.get('status_thresholds', {})
-        if final_score >= thresholds.get('premium', 80):
-            status = 'premium'
-            status_name = 'Premium ⭐'
-        elif final_score >= thresholds.get('regular', 50):
-            status = 'regular'
-            status_name = 'Обычный 👤'
-        else:
-            status = 'risk'
-            status_name = 'Риск ⚠️'
-        
-        return {
-            'user_id': user_id,
-            'final_score': final_score,
-            'discipline': discipline,
-            'loyalty': loyalty,
-            'status': status,
-            'status_name': status_name,
-            'calculated_at': datetime.now().isoformat()
-        }
-    except Exception as e:
-        print(f"Ошибка расчета итогового рейтинга: {e}")
-        return None
+    
+    # Все транзакции завершения аренды - одной вставкой
+    rating_engine.record_transactions(transactions)
 
 def get_user_status_benefits(user_id):
     """Получить льготы пользователя по его статусу"""
     try:
-        rating = calculate_user_final_rating(user_id)
-        if not rating:
-            return {
-                'discount_percent': 0,
-                'deposit_multiplier': 1.0,
-                'priority_support': False,
-                'advance_booking_days': 30
-            }
-        
-        status = rating['status']
-        benefits = {
-            'premium': {
-                'discount_percent': 10,
-                'deposit_multiplier': 0.8,
-                'priority_support': True,
-                'advance_booking_days': 45
-            },
-            'regular': {
-                'discount_percent': 0,
-                'deposit_multiplier': 1.0,
-                'priority_support': False,
-                'advance_booking_days': 30
-            },
-            'risk': {
-                'discount_percent': 0,
-                'deposit_multiplier': 1.5,
-                'priority_support': False,
-                'advance_booking_days': 7
-            }
-        }
-        
-        return benefits.get(status, benefits['regular'])
+        return rating_engine.get_user_benefits(user_id)
     except Exception as e:
         print(f"Ошибка получения льгот пользователя: {e}")
-        return {
-            'discount_percent': 0,
-            'deposit_multiplier': 1.0,
-            'priority_support': False,
-            'advance_booking_days': 30
-        }
+        return get_status_benefits('regular')
 
 def create_temp_reservation(user_id, console_id, timeout_minutes=30):
-    """Создать временную резервацию консоли"""
-    reservations = load_json_file('temp_reservations')
-    reservation_id = str(uuid.uuid4())
-    
-    # Удаляем старые резервации этого пользователя
-    for res_id, res in list(reservations.items()):
-        if res['user_id'] == user_id:
-            del reservations[res_id]
-    
-    # Создаем новую резервацию
-    expiry_time = datetime.now() + timedelta(minutes=timeout_minutes)
-    reservations[reservation_id] = {
-        'user_id': user_id,
-        'console_id': console_id,
-        'created_at': datetime.now().isoformat(),
-        'expires_at': expiry_time.isoformat(),
-        'status': 'active'
-    }
-    
-    save_json_file('temp_reservations', reservations)
-    return reservation_id
+    """Создать временную резервацию консоли (None, если консоль занята другим)"""
+    # Удержание хранится только в TTL-резервации под id консоли: статус консоли не меняется,
+    # поэтому истекшее удержание не оставляет ее в reserved. Двойную аренду исключает
+    # compare-and-set в booking.start_rental
+    if db.claim_temp_reservation(console_id, user_id, timeout_minutes):
+        return console_id
+    return None
 
 def remove_temp_reservation(user_id):
     """Удалить временную резервацию пользователя"""
-    reservations = load_json_file('temp_reservations')
-    for res_id, res in list(reservations.items()):
-        if res['user_id'] == user_id:
-            del reservations[res_id]
-    save_json_file('temp_reservations', reservations)
-
-def cleanup_expired_reservations():
-    """Удалить истёкшие резервации"""
-    reservations = load_json_file('temp_reservations')
-    now = datetime.now()
-    
-    for res_id, res in list(reservations.items()):
-        if datetime.fromisoformat(res['expires_at']) < now:
-            del reservations[res_id]
-    
-    save_json_file('temp_reservations', reservations)
+    db.release_user_temp_reservations(user_id)
 
 def is_console_temp_reserved(console_id, exclude_user_id=None):
     """Проверить, занята ли консоль временной резервацией"""
-    cleanup_expired_reservations()
-    reservations = load_json_file('temp_reservations')
+    reservation = db.get_temp_reservation(console_id)
     
-    for res_id, res in reservations.items():
-        if (res['console_id'] == console_id and 
-            res['status'] == 'active' and 
-            res['user_id'] != exclude_user_id):
-            return True, res['user_id']
+    if reservation and reservation['user_id'] != exclude_user_id:
+        return True, reservation['user_id']
     
     return False, None
 
-def calculate_discounted_price(console_id, original_price, duration_hours):
-    """Вычислить цену с учетом скидки"""
-    discount = get_discount_for_console(console_id)
-    
-    if not discount:
-        return original_price, 0, None
-    
-    # Проверяем минимальную продолжительность для скидки
-    if duration_hours < discount.get('min_hours', 0):
-        return original_price, 0, None
-    
-    if discount['type'] == 'percentage':
-        discount_amount = original_price * (discount['value'] / 100)
-        discounted_price = original_price - discount_amount
-    elif discount['type'] == 'fixed':
-        discount_amount = min(discount['value'], original_price)  # Скидка не больше самой цены
-        discounted_price = original_price - discount_amount
-    else:
-        return original_price, 0, None
-    
-    # Округляем до ближайших лей
-    discounted_price = max(0, round(discounted_price))
-    discount_amount = round(discount_amount)
-    
-    return discounted_price, discount_amount, discount
+def create_price_quote(user_id, console, hours_options, start_date=None):
+    """Посчитать цены всех вариантов аренды одним вызовом и закрепить их на время диалога"""
+    return db.quotes.create(user_id, console, hours_options, start_date, get_user_status_benefits(user_id))
 
 def get_console_photo_path_bot(console_id, console_data=None):
     """Получить локальный путь к фото консоли если существует"""
@@ -527,21 +231,19 @@ def is_approval_required():
 
 def get_console_rental_info(console_id):
     """Получить информацию об активной аренде консоли"""
-    rentals = load_json_file('rentals')
-    users = load_json_file('users')
+    rental = db.get_active_rental_for_console(console_id)
     
-    for rental_id, rental in rentals.items():
-        if rental['console_id'] == console_id and rental['status'] == 'active':
-            start_time = datetime.fromisoformat(rental['start_time'])
-            # Предполагаем аренду на 1 день (можно настроить)
-            estimated_end_time = start_time + timedelta(days=1)
-            user = users.get(rental['user_id'], {})
-            return {
-                'start_time': start_time,
-                'estimated_end_time': estimated_end_time,
-                'user_name': user.get('full_name', user.get('first_name', 'Неизвестный')),
-                'rental_id': rental_id
-            }
+    if rental:
+        start_time = datetime.fromisoformat(rental['start_time'])
+        # Предполагаем аренду на 1 день (можно настроить)
+        estimated_end_time = start_time + timedelta(days=1)
+        user = db.get_user(rental['user_id']) or {}
+        return {
+            'start_time': start_time,
+            'estimated_end_time': estimated_end_time,
+            'user_name': user.get('full_name', user.get('first_name', 'Неизвестный')),
+            'rental_id': str(rental['_id'])
+        }
     return None
 
 def notify_admin(message):
@@ -573,10 +275,8 @@ def notify_admin(message):
 def notify_user_about_approval(user_id, console_id, rental_id):
     """Уведомление пользователя об одобрении заявки через админ-панель"""
     try:
-        consoles = load_json_file('consoles')
-        rentals = load_json_file('rentals')
-        console = consoles.get(console_id, {})
-        rental = rentals.get(rental_id, {})
+        console = db.get_console(console_id) or {}
+        rental = db.get_rental(rental_id) or {}
         
         user_message = f"✅ **Ваша заявка одобрена администратором!**\n\n"
         user_message += f"🎮 Консоль: {console.get('name', 'Неизвестная консоль')}\n"
@@ -606,8 +306,7 @@ def notify_user_about_approval(user_id, console_id, rental_id):
 def notify_user_about_rejection(user_id, console_id):
     """Уведомление пользователя об отклонении заявки через админ-панель"""
     try:
-        consoles = load_json_file('consoles')
-        console = consoles.get(console_id, {})
+        console = db.get_console(console_id) or {}
         
         user_message = f"❌ **Ваша заявка отклонена администратором**\n\n"
         user_message += f"🎮 Консоль: {console.get('name', 'Неизвестная консоль')}\n"
@@ -621,8 +320,7 @@ def notify_user_about_rejection(user_id, console_id):
 def notify_user_about_rental_end(user_id, console_id, total_cost, hours):
     """Уведомление пользователя о завершении аренды администратором"""
     try:
-        consoles = load_json_file('consoles')
-        console = consoles.get(console_id, {})
+        console = db.get_console(console_id) or {}
         
         user_message = f"🏁 **Аренда завершена администратором**\n\n"
         user_message += f"🎮 Консоль: {console.get('name', 'Неизвестная консоль')}\n"
@@ -640,9 +338,6 @@ def notify_user_about_rental_end(user_id, console_id, total_cost, hours):
 
 def create_rental(user_id, console_id, call=None, location=None):
     """Создание новой аренды с поддержкой геолокации"""
-    rentals = load_json_file('rentals')
-    consoles = load_json_file('consoles')
-    
     rental_id = str(uuid.uuid4())
     rental = {
         'id': rental_id,
@@ -658,11 +353,9 @@ def create_rental(user_id, console_id, call=None, location=None):
     if location:
         rental['location'] = location
     
-    rentals[rental_id] = rental
-    consoles[console_id]['status'] = 'rented'
-    
-    save_json_file('rentals', rentals)
-    save_json_file('consoles', consoles)
+    # Консоль занимается атомарно: при гонке аренду получит только один
+    if not db.booking.start_rental(rental):
+        return None
     
     return rental_id
 
@@ -705,8 +398,7 @@ def is_user_admin(user_id):
     return str(user_id) == str(admin_id)
 
 def is_user_registered(user_id):
-    users = load_json_file('users')
-    user = users.get(str(user_id), {})
+    user = db.get_user(user_id) or {}
     return user.get('phone_number') and user.get('full_name')
 
 def get_keyboard_for_user(user_id):
@@ -786,16 +478,16 @@ def save_photo_document(file_id, user_full_name, document_type):
 @bot.message_handler(commands=['start'])
 def start_command(message):
     user_id = str(message.from_user.id)
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if is_user_banned(user_id):
+    if user and user.get('is_banned', False):
         bot.reply_to(message, "❌ Ваш аккаунт заблокирован. Обратитесь к администратору.")
         return
     
     # Если пользователь не существует или не завершил регистрацию
-    if user_id not in users or not is_user_registered(user_id):
-        if user_id not in users:
-            users[user_id] = {
+    if not user or not (user.get('phone_number') and user.get('full_name')):
+        if not user:
+            db.save_user({
                 'id': user_id,
                 'username': message.from_user.username,
                 'first_name': message.from_user.first_name,
@@ -807,8 +499,8 @@ def start_command(message):
                 'phone_number': None,
                 'full_name': None,
                 'registration_step': 'phone'
-            }
-            save_json_file('users', users)
+            })
+            rating_engine.refresh_ratings([user_id])
         
         # Запрос номера телефона
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
@@ -822,20 +514,21 @@ def start_command(message):
         return
     
     # Пользователь уже зарегистрирован
-    welcome_text = f"С возвращением, {users[user_id]['full_name']}!"
+    welcome_text = f"С возвращением, {user['full_name']}!"
     keyboard = get_keyboard_for_user(user_id)
     bot.reply_to(message, welcome_text + "\n\nВыберите действие:", reply_markup=keyboard)
 
 @bot.message_handler(content_types=['contact'])
 def handle_contact(message):
     user_id = str(message.from_user.id)
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id in users and message.contact.user_id == message.from_user.id:
+    if user and message.contact.user_id == message.from_user.id:
         # Сохраняем номер телефона
-        users[user_id]['phone_number'] = message.contact.phone_number
-        users[user_id]['registration_step'] = 'full_name'
-        save_json_file('users', users)
+        db.update_user(user_id, {
+            'phone_number': message.contact.phone_number,
+            'registration_step': 'full_name'
+        })
         
         # Запрашиваем ФИО
         markup = types.ReplyKeyboardRemove()
@@ -849,21 +542,15 @@ def handle_contact(message):
 @bot.message_handler(content_types=['location'])
 def handle_location(message):
     user_id = str(message.from_user.id)
-    users = load_json_file('users')
-    user = users.get(user_id, {})
+    user = db.get_user(user_id) or {}
     
     # Проверяем этап верификации пользователя
     verification_step = user.get('verification_step')
     
     # Ищем одобренную заявку этого пользователя
-    rental_requests = load_json_file('rental_requests')
-    approved_request = None
-    
-    for request_id, request in rental_requests.items():
-        if request['user_id'] == user_id and request['status'] == 'approved':
-            approved_request = request
-            break
-    
+    approved_requests = db.get_user_rental_requests(user_id, 'approved')
+    approved_request = next(iter(approved_requests.values()), None)
+
     # Если у пользователя есть одобренная заявка и он прошел верификацию документов
     if approved_request and verification_step == 'location_request':
         # Обрабатываем геолокацию для аренды
@@ -874,18 +561,22 @@ def handle_location(message):
         }
         rental_id = create_rental(user_id, console_id, location=location_data)
         
+        if not rental_id:
+            bot.reply_to(message, "❌ Консоль уже занята. Обратитесь к администратору.",
+                         reply_markup=get_keyboard_for_user(user_id))
+            return
+        
         # Обновляем статус заявки на завершенную
-        approved_request['status'] = 'completed'
-        approved_request['rental_id'] = rental_id
-        save_json_file('rental_requests', rental_requests)
+        db.update_rental_request(approved_request['_id'], {
+            'status': 'completed',
+            'rental_id': rental_id
+        })
         
         # Очищаем статус верификации пользователя и удаляем резервацию
-        users[user_id]['verification_step'] = 'completed'
+        db.update_user(user_id, {'verification_step': 'completed'})
         remove_temp_reservation(user_id)
-        save_json_file('users', users)
         
-        consoles = load_json_file('consoles')
-        console = consoles[console_id]
+        console = db.get_console(console_id)
         
         # Отправляем подтверждение пользователю
         response = f"✅ **Аренда началась!**\n\n"
@@ -937,13 +628,12 @@ def handle_location(message):
 @bot.message_handler(content_types=['photo'])
 def handle_photo_document(message):
     user_id = str(message.from_user.id)
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id not in users:
+    if not user:
         bot.reply_to(message, "❌ Пользователь не найден. Выполните /start")
         return
     
-    user = users[user_id]
     verification_step = user.get('verification_step')
     
     if not verification_step or verification_step not in ['passport_front', 'passport_back', 'selfie_with_passport']:
@@ -980,8 +670,10 @@ def handle_photo_document(message):
     
     # Обновляем статус пользователя
     if verification_step == 'passport_front':
-        users[user_id]['verification_step'] = 'passport_back'
-        users[user_id]['passport_front_file'] = result['filename']
+        db.update_user(user_id, {
+            'verification_step': 'passport_back',
+            'passport_front_file': result['filename']
+        })
         
         response = f"✅ **Фото передней стороны паспорта сохранено!**\n\n"
         response += f"**Шаг 2 из 3:** Теперь отправьте фото **ЗАДНЕЙ стороны паспорта**\n\n"
@@ -992,8 +684,10 @@ def handle_photo_document(message):
         response += f"📷 Отправьте фото как обычное изображение"
         
     elif verification_step == 'passport_back':
-        users[user_id]['verification_step'] = 'selfie_with_passport'
-        users[user_id]['passport_back_file'] = result['filename']
+        db.update_user(user_id, {
+            'verification_step': 'selfie_with_passport',
+            'passport_back_file': result['filename']
+        })
         
         response = f"✅ **Фото задней стороны паспорта сохранено!**\n\n"
         response += f"**Шаг 3 из 3:** Теперь отправьте **СЕЛФИ с паспортом**\n\n"
@@ -1005,8 +699,10 @@ def handle_photo_document(message):
         response += f"📷 Отправьте селфи как обычное изображение"
         
     elif verification_step == 'selfie_with_passport':
-        users[user_id]['verification_step'] = 'location_request'
-        users[user_id]['selfie_file'] = result['filename']
+        db.update_user(user_id, {
+            'verification_step': 'location_request',
+            'selfie_file': result['filename']
+        })
         
         response = f"✅ **Селфи с паспортом сохранено!**\n\n"
         response += f"🎉 **Верификация документов завершена!**\n\n"
@@ -1020,7 +716,6 @@ def handle_photo_document(message):
         location_markup.add(location_button)
         
         bot.reply_to(message, response, parse_mode='Markdown', reply_markup=location_markup)
-        save_json_file('users', users)
         
         # Уведомляем администратора о завершении верификации
         admin_message = f"📄 **Верификация документов завершена**\n\n"
@@ -1028,15 +723,14 @@ def handle_photo_document(message):
         admin_message += f"📱 {user.get('phone_number', 'Не указан')}\n"
         admin_message += f"🆔 ID: `{user_id}`\n\n"
         admin_message += f"📁 **Сохраненные документы:**\n"
-        admin_message += f"• Паспорт (лицо): {users[user_id].get('passport_front_file', 'Не найден')}\n"
-        admin_message += f"• Паспорт (оборот): {users[user_id].get('passport_back_file', 'Не найден')}\n"
+        admin_message += f"• Паспорт (лицо): {user.get('passport_front_file', 'Не найден')}\n"
+        admin_message += f"• Паспорт (оборот): {user.get('passport_back_file', 'Не найден')}\n"
         admin_message += f"• Селфи с паспортом: {result['filename']}\n\n"
         admin_message += f"⏳ Ожидает отправки геолокации для начала аренды"
         
         notify_admin(admin_message)
         return
     
-    save_json_file('users', users)
     bot.reply_to(message, response, parse_mode='Markdown')
     
     # Уведомляем администратора о получении документа
@@ -1058,13 +752,12 @@ def handle_photo_document(message):
 
 @bot.message_handler(func=lambda message: message.content_type == 'text' and 
                      message.from_user.id and 
-                     str(message.from_user.id) in load_json_file('users') and 
-                     load_json_file('users')[str(message.from_user.id)].get('registration_step') == 'full_name')
+                     (db.get_user(message.from_user.id) or {}).get('registration_step') == 'full_name')
 def handle_full_name(message):
     user_id = str(message.from_user.id)
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id in users:
+    if user:
         full_name = message.text.strip()
         
         if len(full_name) < 2:
@@ -1072,16 +765,17 @@ def handle_full_name(message):
             return
         
         # Завершаем регистрацию
-        users[user_id]['full_name'] = full_name
-        users[user_id]['registration_step'] = 'completed'
-        save_json_file('users', users)
+        db.update_user(user_id, {
+            'full_name': full_name,
+            'registration_step': 'completed'
+        })
         
         # Показываем главное меню
         keyboard = get_keyboard_for_user(user_id)
         bot.reply_to(message, 
                     f"✅ Регистрация завершена!\n\n"
                     f"👤 ФИО: {full_name}\n"
-                    f"📱 Телефон: {users[user_id]['phone_number']}\n\n"
+                    f"📱 Телефон: {user['phone_number']}\n\n"
                     f"Добро пожаловать в систему аренды PlayStation консолей!\n"
                     f"Выберите действие:",
                     reply_markup=keyboard)
@@ -1178,15 +872,13 @@ def user_profile(message):
         bot.reply_to(message, "❌ Пожалуйста, завершите регистрацию с помощью команды /start")
         return
     
-    users = load_json_file('users')
-    rentals = load_json_file('rentals')
+    user = db.get_user(user_id)
     
-    if user_id not in users:
+    if not user:
         bot.reply_to(message, "❌ Пользователь не найден. Выполните /start")
         return
     
-    user = users[user_id]
-    user_rentals = [r for r in rentals.values() if r['user_id'] == user_id]
+    user_rentals = list(db.get_user_rentals(user_id, projection=['id', 'status', 'console_id', 'start_time']).values())
     active_rentals = [r for r in user_rentals if r['status'] == 'active']
     
     response = f"👤 **Ваш профиль:**\n\n"
@@ -1206,13 +898,12 @@ def user_profile(message):
     
     if active_rentals:
         response += "\n**Активные аренды:**\n"
-        consoles = load_json_file('consoles')
         
         # Создаем инлайн-клавиатуру для завершения аренд
         markup = types.InlineKeyboardMarkup()
         
         for rental in active_rentals:
-            console = consoles.get(rental['console_id'], {})
+            console = db.get_console(rental['console_id']) or {}
             console_name = console.get('name', 'Неизвестная консоль')
             start_time = datetime.fromisoformat(rental['start_time'])
             duration = datetime.now() - start_time
@@ -1247,8 +938,7 @@ def buy_console(message):
         bot.reply_to(message, "❌ Пожалуйста, завершите регистрацию с помощью команды /start")
         return
     
-    consoles = load_json_file('consoles')
-    for_sale = {k: v for k, v in consoles.items() if v.get('sale_price', 0) > 0 and v['status'] == 'available'}
+    for_sale = db.find_consoles({'sale_price': {'$gt': 0}, 'status': 'available'})
     
     if not for_sale:
         bot.reply_to(message, "😔 Сейчас нет консолей для продажи.", reply_markup=get_keyboard_for_user(user_id))
@@ -1268,40 +958,44 @@ def buy_console(message):
 def handle_confirm_rent_callback(call):
     user_id = str(call.from_user.id)
     data_parts = call.data.split('_')
-    console_id = data_parts[2]
-    selected_hours = int(data_parts[3]) if len(data_parts) > 3 else None
+    quote_id = data_parts[2]
+    selected_hours = int(data_parts[3])
     
     if is_user_banned(user_id):
         bot.answer_callback_query(call.id, "❌ Ваш аккаунт заблокирован.")
         return
     
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+    # Стоимость берется из закрепленного предложения, а не пересчитывается
+    quote, price = db.quotes.get_option(quote_id, user_id, selected_hours)
+    if not quote:
+        bot.answer_callback_query(call.id, "❌ Предложение устарело, выберите время заново")
+        return
+    
+    console_id = quote['console_id']
+    console = db.get_console(console_id)
     
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if not console or console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль недоступна")
         return
     
-    console = consoles[console_id]
-    user = users.get(user_id, {})
+    user = db.get_user(user_id) or {}
     
     if is_approval_required():
         # Создаем заявку на аренду
         request_id = str(uuid.uuid4())
-        rental_requests = load_json_file('rental_requests')
-        
+
         rental_request = {
             'id': request_id,
             'user_id': user_id,
             'console_id': console_id,
             'selected_hours': selected_hours,
-            'expected_cost': selected_hours * console['rental_price'] if selected_hours else 0,
+            'expected_cost': price['total_cost'],
+            'quote_id': quote_id,
             'request_time': datetime.now().isoformat(),
             'status': 'pending'
         }
         
-        rental_requests[request_id] = rental_request
-        save_json_file('rental_requests', rental_requests)
+        db.save_rental_request(rental_request)
         
         # Уведомляем администратора
         def escape_markdown_text(text):
@@ -1334,7 +1028,7 @@ def handle_confirm_rent_callback(call):
                 admin_message += f"• Время аренды: {selected_days} дня\n"
             else:
                 admin_message += f"• Время аренды: {selected_days} дней\n"
-            admin_message += f"• К оплате: {selected_hours * console['rental_price']} лей\n"
+            admin_message += f"• К оплате: {price['total_cost']} лей\n"
         admin_message += f"• ID: {console_id}\n\n"
         admin_message += f"⏰ Время заявки: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
         
@@ -1363,28 +1057,27 @@ def handle_confirm_rent_callback(call):
                 response += f"⏰ Время: {selected_days} дня\n"
             else:
                 response += f"⏰ Время: {selected_days} дней\n"
-            response += f"💵 К оплате: {selected_hours * console['rental_price']} лей\n"
+            response += f"💵 К оплате: {price['total_cost']} лей\n"
         response += f"\n⏳ Ожидайте подтверждения от администратора.\n"
         response += f"🆔 ID заявки: `{request_id}`"
         
         bot.edit_message_text(response, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
     else:
         # Мгновенная аренда без подтверждения
-        create_rental(user_id, console_id, call, selected_hours=selected_hours)
+        create_rental(user_id, console_id, call, selected_hours=selected_hours, expected_cost=price['total_cost'])
 
-def create_rental(user_id, console_id, call=None, location=None, selected_hours=None):
-    """Создание аренды"""
-    rentals = load_json_file('rentals')
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+def create_rental(user_id, console_id, call=None, location=None, selected_hours=None, expected_cost=None):
+    """Создание аренды (expected_cost - закрепленная цена предложения)"""
+    console = db.get_console(console_id)
     
     rental_id = str(uuid.uuid4())
     # Рассчитываем время окончания аренды если выбрано время
     end_time = None
-    expected_cost = 0
     if selected_hours:
         end_time = (datetime.now() + timedelta(hours=selected_hours)).isoformat()
-        expected_cost = selected_hours * consoles[console_id]['rental_price']
+        if expected_cost is None:
+            expected_cost = selected_hours * console['rental_price']
+    expected_cost = expected_cost or 0
     
     rental = {
         'id': rental_id,
@@ -1403,15 +1096,15 @@ def create_rental(user_id, console_id, call=None, location=None, selected_hours=
     if location:
         rental['location'] = location
     
-    rentals[rental_id] = rental
-    consoles[console_id]['status'] = 'rented'
-    
-    save_json_file('rentals', rentals)
-    save_json_file('consoles', consoles)
+    # Консоль занимается атомарно: при гонке аренду получит только один
+    if not db.booking.start_rental(rental):
+        if call:
+            bot.answer_callback_query(call.id, "❌ Консоль уже занята")
+        return None
     
-    console_name = consoles[console_id]['name']
-    price_per_hour = consoles[console_id]['rental_price']
-    user = users.get(user_id, {})
+    console_name = console['name']
+    price_per_hour = console['rental_price']
+    user = db.get_user(user_id) or {}
     
     # Уведомляем администратора о начале аренды
     admin_message = f"✅ **Аренда началась**\n\n"
@@ -1464,14 +1157,12 @@ def handle_buy_callback(call):
         bot.answer_callback_query(call.id, "❌ Ваш аккаунт заблокирован.")
         return
     
-    consoles = load_json_file('consoles')
+    console = db.get_console(console_id)
     
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if not console or console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль недоступна")
         return
     
-    console = consoles[console_id]
-    
     response = f"💰 **Покупка консоли**\n\n"
     response += f"🎮 Консоль: {console['name']} ({console['model']})\n"
     response += f"💵 Цена: {console['sale_price']} лей\n\n"
@@ -1495,16 +1186,12 @@ def end_rental(message):
         return
     
     rental_id = args[1]
-    rentals = load_json_file('rentals')
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+    rental = db.get_rental(rental_id)
     
-    if rental_id not in rentals:
+    if not rental:
         bot.reply_to(message, "❌ Аренда не найдена")
         return
     
-    rental = rentals[rental_id]
-    
     if rental['user_id'] != user_id:
         bot.reply_to(message, "❌ Это не ваша аренда")
         return
@@ -1518,21 +1205,18 @@ def end_rental(message):
     duration = end_time - start_time
     hours = max(1, int(duration.total_seconds() / 3600))
     
-    console = consoles[rental['console_id']]
+    console = db.get_console(rental['console_id'])
     total_cost = hours * console['rental_price']
     
     rental['end_time'] = end_time.isoformat()
     rental['status'] = 'completed'
     rental['total_cost'] = total_cost
     
-    console['status'] = 'available'
-    
-    if user_id in users:
-        users[user_id]['total_spent'] = users[user_id].get('total_spent', 0) + total_cost
-    
-    save_json_file('rentals', rentals)
-    save_json_file('consoles', consoles)
-    save_json_file('users', users)
+    # Аренда завершается и консоль освобождается только один раз
+    if not db.booking.end_rental(rental_id, {'end_time': rental['end_time'], 'total_cost': total_cost}):
+        bot.reply_to(message, "❌ Аренда уже завершена")
+        return
+    db.add_user_spent(user_id, total_cost)
     
     # Обновляем рейтинг пользователя
     update_rating_on_rental_completion(user_id, rental)
@@ -1618,10 +1302,9 @@ def handle_console_selection(call):
         # Проверяем, если консоль недоступна
         if len(callback_parts) > 2 and callback_parts[1] == 'unavailable':
             console_id = callback_parts[2]
-            consoles = load_json_file('consoles')
+            console = db.get_console(console_id)
             
-            if console_id in consoles:
-                console = consoles[console_id]
+            if console:
                 rental_info = get_console_rental_info(console_id)
                 
                 if rental_info:
@@ -1650,15 +1333,13 @@ def handle_console_selection(call):
             return
         
         console_id = callback_parts[1]
-        consoles = load_json_file('consoles')
+        console = db.get_console(console_id)
         print(f"DEBUG: Looking for console_id: {console_id}")
-        print(f"DEBUG: Available consoles: {list(consoles.keys())}")
         
-        if console_id not in consoles:
+        if not console:
             bot.answer_callback_query(call.id, "❌ Консоль не найдена")
             return
         
-        console = consoles[console_id]
         print(f"DEBUG: Found console: {console['name']}")
         
         # Показываем подробную информацию о консоли
@@ -1745,75 +1426,17 @@ def handle_console_selection(call):
         print(f"ERROR in handle_console_selection: {e}")
         bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
 
-def get_occupied_dates(console_id):
-    """Получить список занятых дат для консоли"""
-    rentals = load_json_file('rentals')
-    occupied_dates = set()
-    
-    # Добавляем даты из активных аренд
-    for rental in rentals.values():
-        if rental['console_id'] == console_id and rental['status'] == 'active':
-            start_date = datetime.fromisoformat(rental['start_time'])
-            end_date = datetime.fromisoformat(rental['estimated_end_time'])
-            
-            # Добавляем все даты между началом и концом аренды
-            current_date = start_date.date()
-            end_date = end_date.date()
-            
-            while current_date <= end_date:
-                occupied_dates.add(current_date)
-                current_date += timedelta(days=1)
-    
-    # Добавляем заблокированные даты из календаря
+def get_occupied_dates(console_id, date_from, date_to):
+    """Занятые, заблокированные и праздничные даты консоли за период date_from..date_to"""
     try:
-        calendar_file = os.path.join('data', 'calendar.json')
-        calendar_data = load_json_file(calendar_file)
-        
-        # Системные заблокированные даты (для всех консолей)
-        system_blocked = calendar_data.get('system_blocked_dates', [])
-        for date_str in system_blocked:
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-            occupied_dates.add(date_obj)
-        
-        # Заблокированные даты для конкретной консоли
-        console_blocked = calendar_data.get('console_blocked_dates', {}).get(console_id, [])
-        for date_str in console_blocked:
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-            occupied_dates.add(date_obj)
-        
-        # Добавляем праздничные дни (нерабочие)
-        holidays = calendar_data.get('holidays', [])
-        for holiday in holidays:
-            if not holiday.get('working', False):  # Если не рабочий праздник
-                date_obj = datetime.strptime(holiday['date'], '%Y-%m-%d').date()
-                occupied_dates.add(date_obj)
-        
-        # Примечание: рабочие дни недели проверяются в create_calendar() для конкретного месяца
-        # Здесь мы не добавляем нерабочие дни, так как неизвестно для какого периода
-            
+        # Рабочие дни недели проверяются в create_calendar() для конкретного месяца
+        return db.availability.get_unavailable_dates(console_id, date_from, date_to)
     except Exception as e:
         print(f"Ошибка загрузки календарных данных: {e}")
-        # Fallback на старую систему
-        try:
-            blocked_dates_file = os.path.join('data', 'blocked_dates.json')
-            blocked_data = load_json_file(blocked_dates_file)
-            
-            system_blocked = blocked_data.get('system_blocked_dates', [])
-            for date_str in system_blocked:
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                occupied_dates.add(date_obj)
-            
-            console_blocked = blocked_data.get('console_blocked_dates', {}).get(console_id, [])
-            for date_str in console_blocked:
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                occupied_dates.add(date_obj)
-        except Exception as fallback_error:
-            print(f"Ошибка fallback загрузки дат: {fallback_error}")
-    
-    return occupied_dates
+        return set()
 
-def get_available_time_slots(console_id, date_str):
-    """Получить доступные временные слоты для даты"""
+def get_available_time_slots(console_id, date_str, duration_hours=1):
+    """Получить слоты даты, с которых консоль свободна duration_hours часов подряд"""
     try:
         calendar_file = os.path.join('data', 'calendar.json')
         calendar_data = load_json_file(calendar_file)
@@ -1824,13 +1447,9 @@ def get_available_time_slots(console_id, date_str):
             "15:00", "16:00", "17:00", "18:00", "19:00", "20:00", "21:00"
         ])
         
-        # Получаем занятые слоты из резерваций
-        date_key = f"{date_str}_{console_id}"
-        reservations = calendar_data.get('reservations', {}).get(date_key, [])
-        occupied_slots = [r['time_slot'] for r in reservations if r['status'] == 'reserved']
-        
-        # Фильтруем доступные слоты
-        available_slots = [slot for slot in all_slots if slot not in occupied_slots]
+        # Свободные слоты считаются по почасовой маске занятости дня
+        available_slots = db.slots.free_slots(console_id, date_str, all_slots, duration_hours)
+        occupied_slots = [slot for slot in all_slots if slot not in available_slots]
         
         return available_slots, occupied_slots
         
@@ -1852,17 +1471,9 @@ def get_calendar_settings():
 
 def create_calendar(console_id, year, month):
     """Создать календарь для выбора даты"""
-    occupied_dates = get_occupied_dates(console_id)
-    today = datetime.now().date()
-    
-    # Получаем настройки рабочих дней
-    try:
-        calendar_file = os.path.join('data', 'calendar.json')
-        calendar_data = load_json_file(calendar_file)
-        working_days = calendar_data.get('working_days', [1, 2, 3, 4, 5, 6, 7])
-    except:
-        working_days = [1, 2, 3, 4, 5, 6, 7]  # По умолчанию все дни рабочие
-    
+    # Маски дней месяца: занятость, блокировки, праздники, рабочие дни и скидки
+    month_days = db.availability.get_month(console_id, year, month)['days']
+
     # Создаем календарь
     cal = calendar.monthcalendar(year, month)
     month_name = calendar.month_name[month]
@@ -1886,17 +1497,16 @@ def create_calendar(console_id, year, month):
             if day == 0:
                 week_buttons.append(types.InlineKeyboardButton(" ", callback_data="ignore"))
             else:
-                current_date = datetime(year, month, day).date()
-                weekday = current_date.weekday() + 1  # 1 = понедельник, 7 = воскресенье
+                day_flags = month_days[f"{year}-{month:02d}-{day:02d}"]
                 
-                if current_date in occupied_dates or weekday not in working_days:
+                if day_flags & (availability.UNAVAILABLE | availability.NON_WORKING):
                     # Занятые дни - красные, передаем информацию о дате
                     short_console_id = console_id[:8]
                     callback_data = f"busy_{short_console_id}_{year}-{month:02d}-{day:02d}"
                     week_buttons.append(types.InlineKeyboardButton(f"🔴{day}", callback_data=callback_data))
                 else:
                     # Проверяем, есть ли скидка на этот день
-                    has_discount = check_date_has_discount(console_id, current_date)
+                    has_discount = day_flags & availability.DISCOUNT
                     short_console_id = console_id[:8]
                     callback_data = f"dt_{short_console_id}_{year}-{month:02d}-{day:02d}"
                     
@@ -1935,12 +1545,8 @@ def handle_calendar_navigation(call):
         date_str = parts[2]
         
         # Находим полный console_id по короткому ID
-        consoles = load_json_file('consoles')
-        console_id = None
-        for cid in consoles.keys():
-            if cid.startswith(short_console_id):
-                console_id = cid
-                break
+        console = db.get_console_by_prefix(short_console_id)
+        console_id = console['_id'] if console else None
         
         if not console_id:
             bot.answer_callback_query(call.id, "❌ Консоль не найдена")
@@ -1989,46 +1595,33 @@ def handle_busy_date_selection(call):
         selected_date = parts[2]  # YYYY-MM-DD
         
         # Находим полный console_id по короткому ID
-        consoles = load_json_file('consoles')
-        console_id = None
-        for cid in consoles.keys():
-            if cid.startswith(short_console_id):
-                console_id = cid
-                break
+        console = db.get_console_by_prefix(short_console_id)
+        console_id = console['_id'] if console else None
         
         if not console_id:
             bot.answer_callback_query(call.id, "❌ Консоль не найдена")
             return
         
-        # Находим информацию об аренде на эту дату
-        rentals = load_json_file('rentals')
-        users = load_json_file('users')
-        
+        # Находим аренду, пересекающую выбранный день, в индексе интервалов
         selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
-        rental_info = None
-        
-        for rental in rentals.values():
-            if rental['console_id'] == console_id and rental['status'] == 'active':
-                start_date = datetime.fromisoformat(rental['start_time']).date()
-                end_date = datetime.fromisoformat(rental['estimated_end_time']).date()
-                
-                # Проверяем, попадает ли выбранная дата в период аренды
-                if start_date <= selected_date_obj <= end_date:
-                    rental_info = rental
-                    break
+        day_start = datetime.combine(selected_date_obj, datetime.min.time())
+        overlapping = db.intervals.find_overlapping(console_id, day_start, day_start + timedelta(days=1))
+        rental_id = overlapping[0][2] if overlapping else None
+        rental_info = db.get_rental(rental_id) if rental_id else None
         
         if rental_info:
-            user = users.get(rental_info['user_id'], {})
+            user = db.get_user(rental_info['user_id']) or {}
             user_name = user.get('full_name', 'Неизвестный пользователь')
             
             start_date_formatted = datetime.fromisoformat(rental_info['start_time']).strftime('%d.%m.%Y')
-            end_date_formatted = datetime.fromisoformat(rental_info['estimated_end_time']).strftime('%d.%m.%Y')
+            # Конец берется из индекса: он учитывает и estimated_end_time, и expected_end_time
+            end_date_formatted = overlapping[0][1].strftime('%d.%m.%Y')
             
             message = f"🔴 **Дата занята**\n\n"
             message += f"📅 **Выбранная дата:** {selected_date_obj.strftime('%d.%m.%Y')}\n\n"
             message += f"**Период аренды:** {start_date_formatted} - {end_date_formatted}\n"
             message += f"**Арендатор:** {user_name}\n"
-            message += f"**ID аренды:** `{rental_info['id'][:8]}...`\n\n"
+            message += f"**ID аренды:** `{rental_id[:8]}...`\n\n"
             message += "Выберите другую свободную дату для аренды."
         else:
             message = f"🔴 **Дата занята**\n\n"
@@ -2051,12 +1644,8 @@ def handle_date_selection(call):
         selected_date = parts[2]
         
         # Находим полный console_id по короткому ID
-        consoles = load_json_file('consoles')
-        console_id = None
-        for cid in consoles.keys():
-            if cid.startswith(short_console_id):
-                console_id = cid
-                break
+        console = db.get_console_by_prefix(short_console_id)
+        console_id = console['_id'] if console else None
         
         if not console_id:
             bot.answer_callback_query(call.id, "❌ Консоль не найдена")
@@ -2073,8 +1662,6 @@ def handle_date_selection(call):
         }
         
         # Теперь показываем варианты продолжительности
-        consoles = load_json_file('consoles')
-        console = consoles[console_id]
         price_per_hour = console['rental_price']
         
         selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
@@ -2090,18 +1677,25 @@ def handle_date_selection(call):
         markup = types.InlineKeyboardMarkup()
         time_options = [24, 48, 72, 168, 336]  # 1, 2, 3, 7, 14 дней в часах
         day_labels = [1, 2, 3, 7, 14]  # соответствующие дни
+        occupied_dates = get_occupied_dates(console_id, selected_date_obj, selected_date_obj + timedelta(days=max(day_labels)))
+        
+        # Цены всех вариантов считаются одним вызовом и закрепляются до подтверждения
+        quote = create_price_quote(user_id, console, time_options, selected_date)
+        if not quote:
+            bot.answer_callback_query(call.id, "❌ Не удалось рассчитать стоимость")
+            return
         
         for i, hours in enumerate(time_options):
             days = day_labels[i]
             original_cost = hours * price_per_hour
             
-            # Применяем скидку если есть
-            discounted_cost, discount_amount, discount_info = calculate_discounted_price(console_id, original_cost, hours)
+            # Скидка консоли и льгота статуса уже учтены в предложении
+            discounted_cost = quote['options'][str(hours)]['total_cost']
+            discount_amount = original_cost - discounted_cost
             
             # Проверяем, не пересекается ли этот период с занятыми датами
             end_date = selected_date_obj + timedelta(days=days)
-            occupied_dates = get_occupied_dates(console_id)
-            
+
             is_available = True
             check_date = selected_date_obj
             while check_date < end_date:
@@ -2137,9 +1731,8 @@ def handle_date_selection(call):
                 response += " ❌ (пересекается с занятыми датами)"
                 callback_data = "ignore"
             else:
-                # Сокращаем для уменьшения размера callback_data
-                short_console_id = console_id[:8]
-                callback_data = f"rd_{short_console_id}_{selected_date}_{hours}"
+                # Консоль, дата и цены берутся из закрепленного предложения
+                callback_data = f"rd_{quote['_id']}_{hours}"
             
             response += "\n"
             markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
@@ -2177,13 +1770,12 @@ def handle_time_selection(call):
         bot.answer_callback_query(call.id, "❌ Ваш аккаунт заблокирован.")
         return
     
-    consoles = load_json_file('consoles')
+    console = db.get_console(console_id)
     
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if not console or console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль недоступна")
         return
     
-    console = consoles[console_id]
     price_per_hour = console['rental_price']
     
     response = f"⏰ **Выберите время аренды**\n\n"
@@ -2196,12 +1788,19 @@ def handle_time_selection(call):
     time_options = [24, 48, 72, 168, 336]  # 1, 2, 3, 7, 14 дней в часах
     day_labels = [1, 2, 3, 7, 14]  # соответствующие дни
     
+    # Цены всех вариантов считаются одним вызовом и закрепляются до подтверждения
+    quote = create_price_quote(user_id, console, time_options)
+    if not quote:
+        bot.answer_callback_query(call.id, "❌ Не удалось рассчитать стоимость")
+        return
+    
     for i, hours in enumerate(time_options):
         days = day_labels[i]
         original_cost = hours * price_per_hour
         
-        # Применяем скидку если есть
-        discounted_cost, discount_amount, discount_info = calculate_discounted_price(console_id, original_cost, hours)
+        # Скидка консоли и льгота статуса уже учтены в предложении
+        discounted_cost = quote['options'][str(hours)]['total_cost']
+        discount_amount = original_cost - discounted_cost
         
         # Формируем текст с учетом скидки
         if discount_amount > 0:
@@ -2225,7 +1824,7 @@ def handle_time_selection(call):
                 button_text = f"{days} дней - {original_cost} лей"
                 response += f"• {days} дней = {original_cost} лей\n"
         
-        markup.add(types.InlineKeyboardButton(button_text, callback_data=f"rent_{console_id}_{hours}"))
+        markup.add(types.InlineKeyboardButton(button_text, callback_data=f"rent_{quote['_id']}_{hours}"))
     
     markup.add(types.InlineKeyboardButton("⬅️ Назад к консоли", callback_data=f"console_{console_id}"))
     
@@ -2253,17 +1852,18 @@ def handle_confirm_rent_with_date(call):
     """Обработка подтверждения аренды с конкретной датой"""
     user_id = str(call.from_user.id)
     data_parts = call.data.split('_')
-    short_console_id = data_parts[1]  # Первые 8 символов
-    selected_date = data_parts[2]  # YYYY-MM-DD
-    selected_hours = int(data_parts[3])
+    quote_id = data_parts[1]
+    selected_hours = int(data_parts[2])
     
-    # Находим полный console_id по короткому ID
-    consoles = load_json_file('consoles')
-    console_id = None
-    for cid in consoles.keys():
-        if cid.startswith(short_console_id):
-            console_id = cid
-            break
+    # Консоль, дата и цена - из закрепленного предложения
+    quote, price = db.quotes.get_option(quote_id, user_id, selected_hours)
+    if not quote:
+        bot.answer_callback_query(call.id, "❌ Предложение устарело, выберите дату заново")
+        return
+    selected_date = quote['start_date']
+    
+    console = db.get_console(quote['console_id'])
+    console_id = console['_id'] if console else None
     
     if not console_id:
         bot.answer_callback_query(call.id, "❌ Консоль не найдена")
@@ -2277,7 +1877,13 @@ def handle_confirm_rent_with_date(call):
     selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
     end_date_obj = selected_date_obj + timedelta(days=selected_hours//24)
     
-    occupied_dates = get_occupied_dates(console_id)
+    # Пересечение с активными арендами по часам, блокировки и праздники - по дням
+    period_start = datetime.combine(selected_date_obj, datetime.min.time())
+    if not db.intervals.is_free(console_id, period_start, period_start + timedelta(hours=selected_hours)):
+        bot.answer_callback_query(call.id, "❌ Выбранные даты больше недоступны")
+        return
+    
+    occupied_dates = get_occupied_dates(console_id, selected_date_obj, end_date_obj)
     check_date = selected_date_obj
     while check_date < end_date_obj:
         if check_date in occupied_dates:
@@ -2285,17 +1891,13 @@ def handle_confirm_rent_with_date(call):
             return
         check_date += timedelta(days=1)
     
-    consoles = load_json_file('consoles')
-    
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль недоступна")
         return
     
-    console = consoles[console_id]
-    original_cost = selected_hours * console['rental_price']
-    
-    # Применяем скидку если есть
-    total_cost, discount_amount, discount_info = calculate_discounted_price(console_id, original_cost, selected_hours)
+    original_cost = price['original_cost']
+    total_cost = price['total_cost']
+    discount_amount = original_cost - total_cost
     
     # Форматируем даты для отображения
     start_date_formatted = selected_date_obj.strftime('%d.%m.%Y')
@@ -2322,9 +1924,7 @@ def handle_confirm_rent_with_date(call):
     response += "Подтвердить аренду?"
     
     markup = types.InlineKeyboardMarkup()
-    # Сокращаем console_id до первых 8 символов для уменьшения размера callback_data
-    short_console_id = console_id[:8]
-    confirm_callback = f"crd_{short_console_id}_{selected_date}_{selected_hours}"
+    confirm_callback = f"crd_{quote_id}_{selected_hours}"
     markup.add(types.InlineKeyboardButton("✅ Подтвердить", callback_data=confirm_callback))
     short_console_id = console_id[:8]
     markup.add(types.InlineKeyboardButton("⬅️ Выбрать другую дату", 
@@ -2351,17 +1951,18 @@ def handle_final_rent_confirmation(call):
     """Финальное подтверждение аренды с датой"""
     user_id = str(call.from_user.id)
     data_parts = call.data.split('_')
-    short_console_id = data_parts[1]  # Первые 8 символов
-    selected_date = data_parts[2]  # YYYY-MM-DD
-    selected_hours = int(data_parts[3])
+    quote_id = data_parts[1]
+    selected_hours = int(data_parts[2])
     
-    # Находим полный console_id по короткому ID
-    consoles = load_json_file('consoles')
-    console_id = None
-    for cid in consoles.keys():
-        if cid.startswith(short_console_id):
-            console_id = cid
-            break
+    # Аренда создается по цене, показанной пользователю
+    quote, price = db.quotes.get_option(quote_id, user_id, selected_hours)
+    if not quote:
+        bot.answer_callback_query(call.id, "❌ Предложение устарело, выберите дату заново")
+        return
+    selected_date = quote['start_date']
+    
+    console = db.get_console(quote['console_id'])
+    console_id = console['_id'] if console else None
     
     if not console_id:
         bot.answer_callback_query(call.id, "❌ Консоль не найдена")
@@ -2375,24 +1976,17 @@ def handle_final_rent_confirmation(call):
     selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d')
     end_date_obj = selected_date_obj + timedelta(hours=selected_hours)
     
-    consoles = load_json_file('consoles')
-    
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль уже недоступна")
         return
     
-    users = load_json_file('users')
-    user = users.get(user_id, {})
+    user = db.get_user(user_id) or {}
     
     if not user.get('phone_number') or not user.get('full_name'):
         bot.answer_callback_query(call.id, "❌ Необходимо завершить регистрацию")
         return
     
-    console = consoles[console_id]
-    original_cost = selected_hours * console['rental_price']
-    
-    # Применяем скидку если есть
-    total_cost, discount_amount, discount_info = calculate_discounted_price(console_id, original_cost, selected_hours)
+    total_cost = price['total_cost']
     
     # Создаем заявку на аренду
     rental_id = str(uuid.uuid4())
@@ -2405,6 +1999,7 @@ def handle_final_rent_confirmation(call):
         'estimated_end_time': end_date_obj.isoformat(),
         'duration_hours': selected_hours,
         'total_cost': total_cost,
+        'quote_id': quote_id,
         'status': 'pending_approval' if is_approval_required() else 'active',
         'created_at': datetime.now().isoformat()
     }
@@ -2412,9 +2007,7 @@ def handle_final_rent_confirmation(call):
     # Сохраняем аренду
     if is_approval_required():
         # Сохраняем как заявку на аренду
-        requests_data = load_json_file('rental_requests')
-        requests_data[rental_id] = rental_data
-        save_json_file('rental_requests', requests_data)
+        db.save_rental_request(rental_data)
         
         response = f"📋 **Заявка на аренду отправлена!**\n\n"
         response += f"🎮 **Консоль:** {console['name']}\n"
@@ -2458,16 +2051,12 @@ def handle_final_rent_confirmation(call):
             except Exception as e:
                 print(f"Ошибка отправки уведомления админу: {e}")
     else:
-        # Прямое подтверждение аренды
-        rentals_data = load_json_file('rentals')
+        # Прямое подтверждение аренды: консоль занимается атомарно
         rental_data['status'] = 'active'
-        rentals_data[rental_id] = rental_data
-        save_json_file('rentals', rentals_data)
-        
-        # Обновляем статус консоли
-        consoles[console_id]['status'] = 'rented'
-        save_json_file('consoles', consoles)
-        
+        if not db.booking.start_rental(rental_data):
+            bot.answer_callback_query(call.id, "❌ Консоль уже недоступна")
+            return
+
         response = f"✅ **Аренда подтверждена!**\n\n"
         response += f"🎮 **Консоль:** {console['name']}\n"
         response += f"📅 **Период:** {selected_date_obj.strftime('%d.%m.%Y')} - {end_date_obj.strftime('%d.%m.%Y')}\n"
@@ -2487,26 +2076,28 @@ def handle_final_rent_confirmation(call):
 def handle_confirm_rent_with_time(call):
     user_id = str(call.from_user.id)
     data_parts = call.data.split('_')
-    console_id = data_parts[1]
+    quote_id = data_parts[1]
     selected_hours = int(data_parts[2])
     
     if is_user_banned(user_id):
         bot.answer_callback_query(call.id, "❌ Ваш аккаунт заблокирован.")
         return
     
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+    quote, price = db.quotes.get_option(quote_id, user_id, selected_hours)
+    if not quote:
+        bot.answer_callback_query(call.id, "❌ Предложение устарело, выберите время заново")
+        return
+    
+    console_id = quote['console_id']
+    console = db.get_console(console_id)
     
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if not console or console['status'] != 'available':
         bot.answer_callback_query(call.id, "❌ Консоль недоступна")
         return
     
-    console = consoles[console_id]
-    user = users.get(user_id, {})
-    original_cost = selected_hours * console['rental_price']
-    
-    # Применяем скидку если есть
-    total_cost, discount_amount, discount_info = calculate_discounted_price(console_id, original_cost, selected_hours)
+    original_cost = price['original_cost']
+    total_cost = price['total_cost']
+    discount_amount = original_cost - total_cost
     
     # Показываем подтверждение аренды с выбранным временем
     selected_days = selected_hours // 24
@@ -2529,7 +2120,7 @@ def handle_confirm_rent_with_time(call):
     
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_rent_{console_id}_{selected_hours}"),
+        types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_rent_{quote_id}_{selected_hours}"),
         types.InlineKeyboardButton("❌ Отмена", callback_data=f"select_time_{console_id}")
     )
     
@@ -2598,29 +2189,27 @@ def admin_statistics(message):
         bot.reply_to(message, "❌ У вас нет доступа к статистике.")
         return
     
-    users = load_json_file('users')
-    consoles = load_json_file('consoles')
-    rentals = load_json_file('rentals')
-    
-    active_rentals = [r for r in rentals.values() if r['status'] == 'active']
-    completed_rentals = [r for r in rentals.values() if r['status'] == 'completed']
-    available_consoles = [c for c in consoles.values() if c['status'] == 'available']
-    
-    total_revenue = sum(r.get('total_cost', 0) for r in completed_rentals)
+    # Счетчики панели - один документ
+    stats = db.get_dashboard_stats()
+    consoles_by_status = stats.get('consoles_by_status', {})
+    rentals_by_status = stats.get('rentals_by_status', {})
     
     response = "📈 **Статистика системы**\n\n"
-    response += f"👥 Всего пользователей: {len(users)}\n"
-    response += f"🎮 Всего консолей: {len(consoles)}\n"
-    response += f"✅ Доступных консолей: {len(available_consoles)}\n"
-    response += f"🔄 Активных аренд: {len(active_rentals)}\n"
-    response += f"✅ Завершенных аренд: {len(completed_rentals)}\n"
-    response += f"💰 Общая выручка: {total_revenue} лей\n\n"
-    
+    response += f"👥 Всего пользователей: {stats.get('users_count', 0)}\n"
+    response += f"🎮 Всего консолей: {stats.get('consoles_count', 0)}\n"
+    response += f"✅ Доступных консолей: {consoles_by_status.get('available', 0)}\n"
+    response += f"🔄 Активных аренд: {rentals_by_status.get('active', 0)}\n"
+    response += f"✅ Завершенных аренд: {rentals_by_status.get('completed', 0)}\n"
+    response += f"💰 Общая выручка: {stats.get('revenue_total', 0)} лей\n\n"
+    
+    active_rentals = db.find_rentals({'status': 'active'}, limit=5,
+                                     projection={'console_id': 1, 'user_id': 1}) if rentals_by_status.get('active') else {}
     if active_rentals:
+        consoles = db.get_consoles()
         response += "**Активные аренды:**\n"
-        for rental in active_rentals[:5]:
+        for rental in active_rentals.values():
             console = consoles.get(rental['console_id'], {})
-            user = users.get(rental['user_id'], {})
+            user = db.get_user(rental['user_id']) or {}
             response += f"• {console.get('name', 'Неизвестная')} - {user.get('full_name', 'Неизвестный')}\n"
     
     bot.reply_to(message, response, parse_mode='Markdown')
@@ -2633,17 +2222,17 @@ def admin_users(message):
         bot.reply_to(message, "❌ У вас нет доступа к управлению пользователями.")
         return
     
-    users = load_json_file('users')
+    users_count = db.count_users()
     
     response = "👥 **Управление пользователями**\n\n"
-    response += f"Всего пользователей: {len(users)}\n\n"
+    response += f"Всего пользователей: {users_count}\n\n"
     response += "Выберите пользователя для управления:"
     
     # Показываем последних 10 пользователей
-    sorted_users = sorted(users.items(), key=lambda x: x[1].get('joined_at', ''), reverse=True)
+    recent_users = db.get_recent_users(10)
     
     markup = types.InlineKeyboardMarkup()
-    for uid, user in sorted_users[:10]:
+    for uid, user in recent_users.items():
         status = "🚫" if user.get('is_banned', False) else "✅"
         name = user.get('full_name', user.get('first_name', 'Неизвестный'))
         button_text = f"{status} {name[:20]}"
@@ -2659,18 +2248,15 @@ def admin_notifications(message):
         bot.reply_to(message, "❌ У вас нет доступа к уведомлениям.")
         return
     
-    rental_requests = load_json_file('rental_requests')
-    pending_requests = [r for r in rental_requests.values() if r['status'] == 'pending']
+    pending_requests = list(db.find_rental_requests({'status': 'pending'}).values())
     
     response = "🔔 **Уведомления**\n\n"
     
     if pending_requests:
         response += f"⏳ Ожидающих заявок: {len(pending_requests)}\n\n"
         for request in pending_requests[:5]:
-            users = load_json_file('users')
-            consoles = load_json_file('consoles')
-            user = users.get(request['user_id'], {})
-            console = consoles.get(request['console_id'], {})
+            user = db.get_user(request['user_id']) or {}
+            console = db.get_console(request['console_id']) or {}
             
             response += f"• {user.get('full_name', 'Неизвестный')} - {console.get('name', 'Неизвестная консоль')}\n"
         
@@ -2743,39 +2329,35 @@ def handle_approve_request(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    rental_requests = load_json_file('rental_requests')
+    request = db.get_rental_request(request_id)
     
-    if request_id not in rental_requests:
+    if not request:
         bot.answer_callback_query(call.id, "❌ Заявка не найдена")
         return
     
-    request = rental_requests[request_id]
-    
     if request['status'] not in ['pending', 'pending_approval']:
         bot.answer_callback_query(call.id, "❌ Заявка уже обработана")
         return
     
     # Проверяем доступность консоли
-    consoles = load_json_file('consoles')
     console_id = request['console_id']
+    console = db.get_console(console_id)
     
-    if console_id not in consoles or consoles[console_id]['status'] != 'available':
+    if not console:
         bot.answer_callback_query(call.id, "❌ Консоль больше недоступна")
-        request['status'] = 'rejected'
-        save_json_file('rental_requests', rental_requests)
+        db.update_rental_request(request_id, {'status': 'rejected'})
         return
     
-    # Одобряем заявку
-    request['status'] = 'approved'
-    save_json_file('rental_requests', rental_requests)
+    # Резервируем консоль на 30 минут (available -> reserved атомарно)
+    if not create_temp_reservation(request['user_id'], console_id, timeout_minutes=30):
+        bot.answer_callback_query(call.id, "⏳ Консоль занята или зарезервирована другим пользователем")
+        return
     
-    # Создаем временную резервацию консоли (на 30 минут)
-    create_temp_reservation(request['user_id'], console_id, timeout_minutes=30)
+    # Одобряем заявку
+    db.update_rental_request(request_id, {'status': 'approved'})
     
     # Получаем данные пользователя
-    users = load_json_file('users')
-    user = users.get(request['user_id'], {})
-    console = consoles[console_id]
+    user = db.get_user(request['user_id']) or {}
     user_full_name = user.get('full_name', user.get('first_name', f'user_{request["user_id"]}'))
     
     # Проверяем существующие документы
@@ -2784,9 +2366,10 @@ def handle_approve_request(call):
     
     if all_documents_exist:
         # Все документы уже загружены - сразу запрашиваем геолокацию
-        users[request['user_id']]['verification_step'] = 'location_request'
-        users[request['user_id']]['pending_rental_id'] = console_id
-        save_json_file('users', users)
+        db.update_user(request['user_id'], {
+            'verification_step': 'location_request',
+            'pending_rental_id': console_id
+        })
         
         user_message = f"✅ **Ваша заявка одобрена!**\n\n"
         user_message += f"🎮 Консоль: {console['name']}\n"
@@ -2803,9 +2386,10 @@ def handle_approve_request(call):
         markup.add(location_button)
     else:
         # Нужна верификация документов
-        users[request['user_id']]['verification_step'] = 'passport_front'
-        users[request['user_id']]['pending_rental_id'] = console_id
-        save_json_file('users', users)
+        db.update_user(request['user_id'], {
+            'verification_step': 'passport_front',
+            'pending_rental_id': console_id
+        })
         
         user_message = f"✅ **Ваша заявка одобрена!**\n\n"
         user_message += f"🎮 Консоль: {console['name']}\n"
@@ -2856,28 +2440,23 @@ def handle_reject_request(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    rental_requests = load_json_file('rental_requests')
+    request = db.get_rental_request(request_id)
     
-    if request_id not in rental_requests:
+    if not request:
         bot.answer_callback_query(call.id, "❌ Заявка не найдена")
         return
     
-    request = rental_requests[request_id]
-    
     if request['status'] not in ['pending', 'pending_approval']:
         bot.answer_callback_query(call.id, "❌ Заявка уже обработана")
         return
     
     # Отклоняем заявку и удаляем резервацию
-    request['status'] = 'rejected'
+    db.update_rental_request(request_id, {'status': 'rejected'})
     remove_temp_reservation(request['user_id'])
-    save_json_file('rental_requests', rental_requests)
     
     # Уведомляем пользователя
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
-    user = users.get(request['user_id'], {})
-    console = consoles.get(request['console_id'], {})
+    user = db.get_user(request['user_id']) or {}
+    console = db.get_console(request['console_id']) or {}
     
     user_message = f"❌ **Ваша заявка отклонена**\n\n"
     user_message += f"🎮 Консоль: {console.get('name', 'Неизвестная консоль')}\n"
@@ -2885,10 +2464,11 @@ def handle_reject_request(call):
     user_message += f"Попробуйте арендовать другую консоль или обратитесь к администратору."
     
     # Очищаем статусы пользователя
-    if request['user_id'] in users:
-        users[request['user_id']]['verification_step'] = None
-        users[request['user_id']]['pending_rental_id'] = None
-        save_json_file('users', users)
+    if user:
+        db.update_user(request['user_id'], {
+            'verification_step': None,
+            'pending_rental_id': None
+        })
     
     try:
         bot.send_message(request['user_id'], user_message, parse_mode='Markdown')
@@ -2941,15 +2521,11 @@ def handle_end_rental_callback(call):
 
 def end_rental_by_id(user_id, rental_id):
     """Завершение аренды по ID"""
-    rentals = load_json_file('rentals')
-    consoles = load_json_file('consoles')
-    users = load_json_file('users')
+    rental = db.get_rental(rental_id)
     
-    if rental_id not in rentals:
+    if not rental:
         return {'success': False, 'error': 'Аренда не найдена'}
-    
-    rental = rentals[rental_id]
-    
+
     if rental['user_id'] != user_id:
         return {'success': False, 'error': 'Это не ваша аренда'}
     
@@ -2962,30 +2538,23 @@ def end_rental_by_id(user_id, rental_id):
     duration = end_time - start_time
     hours = max(1, int(duration.total_seconds() / 3600))
     
-    console = consoles[rental['console_id']]
+    console = db.get_console(rental['console_id'])
     total_cost = hours * console['rental_price']
     
-    # Завершаем аренду
+    # Завершаем аренду и освобождаем консоль (только один раз при гонке)
     rental['end_time'] = end_time.isoformat()
     rental['status'] = 'completed'
     rental['total_cost'] = total_cost
-    
-    # Освобождаем консоль
-    console['status'] = 'available'
+    if not db.booking.end_rental(rental_id, {'end_time': rental['end_time'], 'total_cost': total_cost}):
+        return {'success': False, 'error': 'Аренда уже завершена'}
     
     # Обновляем статистику пользователя
-    if user_id in users:
-        users[user_id]['total_spent'] = users[user_id].get('total_spent', 0) + total_cost
-    
-    # Сохраняем изменения
-    save_json_file('rentals', rentals)
-    save_json_file('consoles', consoles)
-    save_json_file('users', users)
+    db.add_user_spent(user_id, total_cost)
     
     # Обновляем рейтинг пользователя
     update_rating_on_rental_completion(user_id, rental)
     
-    user = users.get(user_id, {})
+    user = db.get_user(user_id) or {}
     
     return {
         'success': True,
@@ -3026,22 +2595,18 @@ def handle_admin_requests(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    rental_requests = load_json_file('rental_requests')
-    pending_requests = [r for r in rental_requests.values() if r['status'] == 'pending']
+    pending_requests = list(db.find_rental_requests({'status': 'pending'}).values())
     
     response = "📊 **Заявки на аренду**\n\n"
     
     if pending_requests:
         response += f"⏳ Ожидающих заявок: {len(pending_requests)}\n\n"
         
-        users = load_json_file('users')
-        consoles = load_json_file('consoles')
-        
         markup = types.InlineKeyboardMarkup()
         
         for request in pending_requests[:5]:
-            user = users.get(request['user_id'], {})
-            console = consoles.get(request['console_id'], {})
+            user = db.get_user(request['user_id']) or {}
+            console = db.get_console(request['console_id']) or {}
             
             response += f"👤 **{user.get('full_name', 'Неизвестный')}**\n"
             response += f"🎮 {console.get('name', 'Неизвестная консоль')}\n"
@@ -3089,22 +2654,21 @@ def handle_admin_ratings(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    users = load_json_file('users')
-    ratings_data = load_json_file('ratings')
+    users_count = db.count_users()
     
     response = "⭐ **Управление рейтингами**\n\n"
-    response += f"Всего пользователей: {len(users)}\n"
-    response += f"Пользователей с рейтингом: {len(ratings_data.get('user_ratings', {}))}\n\n"
+    response += f"Всего пользователей: {users_count}\n"
+    response += f"Пользователей с рейтингом: {rating_engine.count_rated_users()}\n\n"
     response += "Выберите пользователя для управления рейтингом:"
     
     # Показываем пользователей с рейтингами
-    sorted_users = sorted(users.items(), key=lambda x: x[1].get('joined_at', ''), reverse=True)
+    recent_users = db.get_recent_users(10)
     
     markup = types.InlineKeyboardMarkup()
-    for uid, user in sorted_users[:10]:
+    for uid, user in recent_users.items():
         name = user.get('full_name', user.get('first_name', 'Неизвестный'))
         try:
-            rating = calculate_user_final_rating(uid)
+            rating = rating_engine.get_rating(uid)
             if rating:
                 button_text = f"⭐ {name[:15]} ({rating['final_score']})"
             else:
@@ -3127,15 +2691,15 @@ def handle_admin_users_callback(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    users = load_json_file('users')
+    users_count = db.count_users()
     
     response = "👥 **Управление пользователями**\n\n"
-    response += f"Всего пользователей: {len(users)}\n\n"
+    response += f"Всего пользователей: {users_count}\n\n"
     
-    sorted_users = sorted(users.items(), key=lambda x: x[1].get('joined_at', ''), reverse=True)
+    recent_users = db.get_recent_users(10)
     
     markup = types.InlineKeyboardMarkup()
-    for uid, user in sorted_users[:10]:
+    for uid, user in recent_users.items():
         status = "🚫" if user.get('is_banned', False) else "✅"
         name = user.get('full_name', user.get('first_name', 'Неизвестный'))
         button_text = f"{status} {name[:20]}"
@@ -3153,13 +2717,11 @@ def handle_user_manage(call):
         return
     
     user_id = call.data.split('_')[2]
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id not in users:
+    if not user:
         bot.answer_callback_query(call.id, "❌ Пользователь не найден")
         return
-    
-    user = users[user_id]
     is_banned = user.get('is_banned', False)
     
     response = f"👤 **Пользователь:** {user.get('full_name', 'Неизвестный')}\n\n"
@@ -3190,11 +2752,8 @@ def handle_ban_user(call):
         return
     
     user_id = call.data.split('_')[2]
-    users = load_json_file('users')
     
-    if user_id in users:
-        users[user_id]['is_banned'] = True
-        save_json_file('users', users)
+    if db.update_user(user_id, {'is_banned': True}):
         
         bot.answer_callback_query(call.id, "✅ Пользователь заблокирован")
         
@@ -3205,7 +2764,7 @@ def handle_ban_user(call):
             pass
         
         # Обновляем сообщение с новой информацией
-        user = users[user_id]
+        user = db.get_user(user_id)
         is_banned = user.get('is_banned', False)
         
         response = f"👤 **Пользователь:** {user.get('full_name', 'Неизвестный')}\n\n"
@@ -3239,11 +2798,8 @@ def handle_unban_user(call):
         return
     
     user_id = call.data.split('_')[2]
-    users = load_json_file('users')
     
-    if user_id in users:
-        users[user_id]['is_banned'] = False
-        save_json_file('users', users)
+    if db.update_user(user_id, {'is_banned': False}):
         
         bot.answer_callback_query(call.id, "✅ Пользователь разблокирован")
         
@@ -3254,7 +2810,7 @@ def handle_unban_user(call):
             pass
         
         # Обновляем сообщение с новой информацией
-        user = users[user_id]
+        user = db.get_user(user_id)
         is_banned = user.get('is_banned', False)
         
         response = f"👤 **Пользователь:** {user.get('full_name', 'Неизвестный')}\n\n"
@@ -3288,14 +2844,12 @@ def handle_request_location(call):
         return
     
     user_id = call.data.split('_')[2]
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id not in users:
+    if not user:
         bot.answer_callback_query(call.id, "❌ Пользователь не найден")
         return
     
-    user = users[user_id]
-    
     # Отправляем запрос геолокации пользователю
     try:
         location_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
@@ -3331,16 +2885,16 @@ def handle_back_to_users(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    users = load_json_file('users')
+    users_count = db.count_users()
     
     response = "👥 **Управление пользователями**\n\n"
-    response += f"Всего пользователей: {len(users)}\n\n"
+    response += f"Всего пользователей: {users_count}\n\n"
     response += "Выберите пользователя для управления:"
     
-    sorted_users = sorted(users.items(), key=lambda x: x[1].get('joined_at', ''), reverse=True)
+    recent_users = db.get_recent_users(10)
     
     markup = types.InlineKeyboardMarkup()
-    for uid, user in sorted_users[:10]:
+    for uid, user in recent_users.items():
         status = "🚫" if user.get('is_banned', False) else "✅"
         name = user.get('full_name', user.get('first_name', 'Неизвестный'))
         button_text = f"{status} {name[:20]}"
@@ -3358,16 +2912,14 @@ def handle_rating_manage(call):
         return
     
     user_id = call.data.split('_')[2]
-    users = load_json_file('users')
+    user = db.get_user(user_id)
     
-    if user_id not in users:
+    if not user:
         bot.answer_callback_query(call.id, "❌ Пользователь не найден")
         return
     
-    user = users[user_id]
-    
     try:
-        rating = calculate_user_final_rating(user_id)
+        rating = rating_engine.get_rating(user_id)
         if rating:
             response = f"⭐ **Рейтинг пользователя:** {user.get('full_name', 'Неизвестный')}\n\n"
             response += f"🏆 Общий балл: {rating['final_score']}/100\n"
@@ -3376,8 +2928,7 @@ def handle_rating_manage(call):
             response += f"🎖️ Статус: {rating['status_name']}\n\n"
             
             # Показываем последние транзакции
-            ratings_data = load_json_file('ratings')
-            user_transactions = ratings_data.get('transactions', {}).get(user_id, [])
+            user_transactions = rating_engine.get_transactions(user_id, limit=3)
             if user_transactions:
                 response += "📋 **Последние изменения:**\n"
                 for transaction in user_transactions[-3:]:
@@ -3411,34 +2962,17 @@ def handle_rating_stats(call):
         bot.answer_callback_query(call.id, "❌ У вас нет прав администратора")
         return
     
-    users = load_json_file('users')
-    ratings_data = load_json_file('ratings')
-    
-    # Подсчитываем статистику
-    total_users = len(users)
-    users_with_rating = len(ratings_data.get('user_ratings', {}))
+    # Счетчики статусов и топ читаются из лидерборда
+    stats = rating_engine.get_stats()
     
-    premium_count = 0
-    regular_count = 0
-    risk_count = 0
-    total_score = 0
+    total_users = stats['users_count']
+    users_with_rating = rating_engine.count_rated_users()
     
-    for user_id in users.keys():
-        try:
-            rating = calculate_user_final_rating(user_id)
-            if rating:
-                total_score += rating['final_score']
-                status = rating['status_name']
-                if status == 'Premium':
-                    premium_count += 1
-                elif status == 'Regular':
-                    regular_count += 1
-                else:
-                    risk_count += 1
-        except:
-            continue
+    premium_count = stats['counts']['premium']
+    regular_count = stats['counts']['regular']
+    risk_count = stats['counts']['risk']
     
-    avg_score = total_score / users_with_rating if users_with_rating > 0 else 0
+    avg_score = stats['average_score']
     
     response = "📊 **Статистика рейтингов**\n\n"
     response += f"👥 Всего пользователей: {total_users}\n"
@@ -3449,25 +2983,13 @@ def handle_rating_stats(call):
     response += f"⭐ Regular: {regular_count}\n"
     response += f"⚠️ Risk: {risk_count}\n\n"
     
-    # Показываем топ пользователей
-    top_users = []
-    for user_id in users.keys():
-        try:
-            rating = calculate_user_final_rating(user_id)
-            if rating:
-                user = users[user_id]
-                top_users.append({
-                    'name': user.get('full_name', 'Неизвестный'),
-                    'score': rating['final_score']
-                })
-        except:
-            continue
-    
-    top_users.sort(key=lambda x: x['score'], reverse=True)
+    # Показываем топ пользователей (индексированное чтение)
+    top_users = [{'name': rating.get('full_name') or 'Неизвестный', 'score': rating['final_score']}
+                 for rating in rating_engine.get_top(5)]
     
     if top_users:
         response += "🏆 **Топ-5 пользователей:**\n"
-        for i, user in enumerate(top_users[:5], 1):
+        for i, user in enumerate(top_users, 1):
             response += f"{i}. {user['name'][:20]} - {user['score']}/100\n"
     
     markup = types.InlineKeyboardMarkup()
@@ -3487,28 +3009,7 @@ def handle_add_discipline(call):
     user_id = call.data.split('_')[2]
     
     # Добавляем положительные баллы дисциплины
-    import json
-    import datetime
-    
-    ratings_data = load_json_file('ratings')
-    
-    if 'transactions' not in ratings_data:
-        ratings_data['transactions'] = {}
-    if user_id not in ratings_data['transactions']:
-        ratings_data['transactions'][user_id] = []
-    
-    transaction = {
-        'type': 'discipline_bonus',
-        'points': 10,
-        'comment': 'Ручное добавление администратором',
-        'date': datetime.datetime.now().isoformat(),
-        'admin_id': admin_id
-    }
-    
-    ratings_data['transactions'][user_id].append(transaction)
-    
-    with open('ratings', 'w', encoding='utf-8') as f:
-        json.dump(ratings_data, f, ensure_ascii=False, indent=2)
+    add_rating_transaction(user_id, 'discipline_bonus', 10, 'Ручное добавление администратором', admin_id=admin_id)
     
     bot.answer_callback_query(call.id, "✅ Добавлено +10 баллов дисциплины")
     
@@ -3527,28 +3028,7 @@ def handle_sub_discipline(call):
     user_id = call.data.split('_')[2]
     
     # Снимаем баллы дисциплины
-    import json
-    import datetime
-    
-    ratings_data = load_json_file('ratings')
-    
-    if 'transactions' not in ratings_data:
-        ratings_data['transactions'] = {}
-    if user_id not in ratings_data['transactions']:
-        ratings_data['transactions'][user_id] = []
-    
-    transaction = {
-        'type': 'discipline_penalty',
-        'points': -15,
-        'comment': 'Нарушение правил (ручное снятие)',
-        'date': datetime.datetime.now().isoformat(),
-        'admin_id': admin_id
-    }
-    
-    ratings_data['transactions'][user_id].append(transaction)
-    
-    with open('ratings', 'w', encoding='utf-8') as f:
-        json.dump(ratings_data, f, ensure_ascii=False, indent=2)
+    add_rating_transaction(user_id, 'discipline_penalty', -15, 'Нарушение правил (ручное снятие)', admin_id=admin_id)
     
     bot.answer_callback_query(call.id, "❌ Снято -15 баллов дисциплины")
     
@@ -3567,28 +3047,7 @@ def handle_add_loyalty(call):
     user_id = call.data.split('_')[2]
     
     # Добавляем баллы лояльности
-    import json
-    import datetime
-    
-    ratings_data = load_json_file('ratings')
-    
-    if 'transactions' not in ratings_data:
-        ratings_data['transactions'] = {}
-    if user_id not in ratings_data['transactions']:
-        ratings_data['transactions'][user_id] = []
-    
-    transaction = {
-        'type': 'loyalty_bonus',
-        'points': 5,
-        'comment': 'Повторная аренда (ручное добавление)',
-        'date': datetime.datetime.now().isoformat(),
-        'admin_id': admin_id
-    }
-    
-    ratings_data['transactions'][user_id].append(transaction)
-    
-    with open('ratings', 'w', encoding='utf-8') as f:
-        json.dump(ratings_data, f, ensure_ascii=False, indent=2)
+    add_rating_transaction(user_id, 'loyalty_bonus', 5, 'Повторная аренда (ручное добавление)', admin_id=admin_id)
     
     bot.answer_callback_query(call.id, "✅ Добавлено +5 баллов лояльности")
     
@@ -3607,28 +3066,7 @@ def handle_loyalty_bonus(call):
     user_id = call.data.split('_')[2]
     
     # Добавляем специальный бонус лояльности
-    import json
-    import datetime
-    
-    ratings_data = load_json_file('ratings')
-    
-    if 'transactions' not in ratings_data:
-        ratings_data['transactions'] = {}
-    if user_id not in ratings_data['transactions']:
-        ratings_data['transactions'][user_id] = []
-    
-    transaction = {
-        'type': 'special_loyalty_bonus',
-        'points': 15,
-        'comment': 'Специальный бонус от администрации',
-        'date': datetime.datetime.now().isoformat(),
-        'admin_id': admin_id
-    }
-    
-    ratings_data['transactions'][user_id].append(transaction)
-    
-    with open('ratings', 'w', encoding='utf-8') as f:
-        json.dump(ratings_data, f, ensure_ascii=False, indent=2)
+    add_rating_transaction(user_id, 'special_loyalty_bonus', 15, 'Специальный бонус от администрации', admin_id=admin_id)
     
     bot.answer_callback_query(call.id, "🎁 Добавлен специальный бонус +15 баллов")
     
@@ -3644,4 +3082,7 @@ def debug_all_callbacks(call):
 
 if __name__ == '__main__':
     print("🤖 Telegram бот запущен...")
+    # Сбрасываем кэши при записях из админ-панели и других процессов
+    db.start_change_feed()
+    rating_engine.start_reconcile()
     bot.polling(none_stop=True)
\ No newline at end of file
@@ -2,6 +2,17 @@
 Database package for MongoDB operations
 """
 
-from .db import MongoDBManager, get_db_manager, init_db
+from .db import MongoDBManager, TrackedCollection, get_db_manager, init_db
+from .cache import ReadThroughCache
+from .change_feed import ChangeFeed
+from .booking import BookingEngine
+from .rollups import RentalRollups
+from .intervals import RentalIntervalIndex
+from .slots import ReservationSlots
+from .discounts import DiscountIndex
+from .quotes import PriceQuotes
+from .availability import AvailabilityService
 
-__all__ = ['MongoDBManager', 'get_db_manager', 'init_db']
+__all__ = ['MongoDBManager', 'TrackedCollection', 'ReadThroughCache', 'ChangeFeed', 'BookingEngine',
+           'RentalRollups', 'RentalIntervalIndex', 'ReservationSlots', 'DiscountIndex', 'PriceQuotes',
+           'AvailabilityService', 'get_db_manager', 'init_db']
@@ -0,0 +1,214 @@
+"""
+Доступность консоли по дням месяца
+Статус дня - битовая маска флагов, месяц собирается одним проходом из диапазонных запросов
+"""
+
+from datetime import date, datetime, timedelta
+import calendar
+import threading
+from .cache import ReadThroughCache
+from .discounts import parse_period
+
+# Флаги дня
+OCCUPIED = 1           # Активная аренда
+SYSTEM_BLOCKED = 2     # Системная блокировка
+CONSOLE_BLOCKED = 4    # Блокировка консоли
+HOLIDAY = 8            # Нерабочий праздник
+WORKING_HOLIDAY = 16   # Праздник, но рабочий день
+NON_WORKING = 32       # Нерабочий день недели
+DISCOUNT = 64          # Действует скидка на консоль
+RESERVED = 128         # Есть резервации слотов
+
+# День нельзя выбрать для начала аренды (дни недели проверяет только календарь)
+UNAVAILABLE = OCCUPIED | SYSTEM_BLOCKED | CONSOLE_BLOCKED | HOLIDAY
+
+# Записи в эти коллекции меняют доступность (статус консоли в маски не входит)
+AVAILABILITY_COLLECTIONS = {'rentals', 'calendar', 'calendar_blocked_dates', 'calendar_holidays',
+                            'calendar_reservations', 'discounts'}
+
+# Общие для всех консолей настройки: запись сбрасывает весь кэш
+GLOBAL_COLLECTIONS = {'calendar', 'calendar_holidays'}
+
+AVAILABILITY_CACHE_TTL_SECONDS = 60
+AVAILABILITY_CACHE_MAX_ENTRIES = 512
+
+class AvailabilityService:
+    """Месячные маски доступности консолей с кэшем по (консоль, месяц)"""
+    
+    def __init__(self, manager, ttl_seconds=AVAILABILITY_CACHE_TTL_SECONDS,
+                 max_entries=AVAILABILITY_CACHE_MAX_ENTRIES):
+        self.manager = manager
+        self.cache = ReadThroughCache(ttl_seconds, max_entries)
+        # Посчитанные месяцы консолей, документы, попавшие в каждый из них, и месяцы в расчете
+        self._months = {}
+        self._sources = {}
+        self._computing = {}
+        self._lock = threading.Lock()
+        manager.add_write_listener(self._on_write)
+    
+    def _on_write(self, collection_name, doc_id):
+        """Сброс месяцев консоли, которых касается запись"""
+        if collection_name not in AVAILABILITY_COLLECTIONS:
+            return
+        if doc_id is None or collection_name in GLOBAL_COLLECTIONS:
+            self._invalidate_all()
+            return
+        
+        doc_id = str(doc_id)
+        if collection_name == 'calendar_blocked_dates':
+            # _id блокировки: "<console_id | system>_<YYYY-MM-DD>"
+            console_id, _, date_str = doc_id.rpartition('_')
+            if console_id == 'system':
+                self._invalidate_all()
+                return
+            months = self._months_of_day(console_id, date_str)
+        else:
+            months = self._months_of_doc(collection_name, doc_id)
+        
+        # Месяцы, в которые документ попадал до записи, месяцы его нового состояния
+        # и месяцы в расчете (документ мог быть прочитан до записи, а источник еще не записан)
+        with self._lock:
+            months |= self._sources.pop((collection_name, doc_id), set())
+            months |= set(self._computing)
+        for console_id, year, month in months:
+            self.cache.invalidate(('console', console_id, year, month))
+    
+    def _invalidate_all(self):
+        """Сбросить месяцы всех консолей"""
+        with self._lock:
+            self._months.clear()
+            self._sources.clear()
+        self.cache.invalidate()
+    
+    def _cached_months(self, console_id, start, end):
+        """Посчитанные месяцы консоли, пересекающие [start, end): {(console_id, год, месяц)}"""
+        with self._lock:
+            months = list(self._months.get(console_id, ()))
+        return {(console_id, year, month) for year, month in months
+                if (start.year, start.month) <= (year, month)
+                and (end - timedelta(microseconds=1)).timetuple()[:2] >= (year, month)}
+    
+    def _months_of_day(self, console_id, date_str):
+        """Месяц консоли, содержащий дату YYYY-MM-DD"""
+        try:
+            day = date.fromisoformat(str(date_str))
+        except ValueError:
+            return set()
+        return {(str(console_id), day.year, day.month)}
+    
+    def _months_of_doc(self, collection_name, doc_id):
+        """Посчитанные месяцы консоли, которых касается текущее состояние документа"""
+        doc = self.manager.db[collection_name].find_one({'_id': doc_id})
+        if not doc or not doc.get('console_id'):
+            return set()
+        console_id = str(doc['console_id'])
+        if collection_name == 'calendar_reservations':
+            return self._months_of_day(console_id, doc.get('date'))
+        
+        if collection_name == 'rentals':
+            period = self.manager.intervals._interval(doc)
+        else:
+            period = parse_period(doc) if doc.get('active', True) else None
+        return self._cached_months(console_id, *period) if period else set()
+    
+    def get_month(self, console_id, year, month):
+        """
+        Доступность консоли за месяц
+        
+        Returns:
+            dict: days {YYYY-MM-DD: флаги}, holidays {дата: праздник}, reservations {дата: количество}
+        """
+        console_id = str(console_id)
+        return self.cache.get(('console', console_id, year, month), 'days',
+                              lambda: self._compute_month(console_id, year, month))
+    
+    @staticmethod
+    def _mark_range(days, start, end, flag):
+        """Поставить флаг всем дням месяца в диапазоне start..end (даты)"""
+        current = start
+        while current <= end:
+            key = current.isoformat()
+            if key in days:
+                days[key] |= flag
+            current += timedelta(days=1)
+    
+    def _compute_month(self, console_id, year, month):
+        """Собрать маски дней месяца"""
+        key = (console_id, year, month)
+        with self._lock:
+            self._months.setdefault(console_id, set()).add((year, month))
+            self._computing[key] = self._computing.get(key, 0) + 1
+        try:
+            return self._collect_month(console_id, year, month)
+        finally:
+            with self._lock:
+                self._computing[key] -= 1
+                if not self._computing[key]:
+                    del self._computing[key]
+    
+    def _collect_month(self, console_id, year, month):
+        """Маски дней месяца и документы, из которых они собраны"""
+        first = date(year, month, 1)
+        last = first.replace(day=calendar.monthrange(year, month)[1])
+        date_from, date_to = first.isoformat(), last.isoformat()
+        
+        # Нерабочие дни недели (1 = понедельник, 7 = воскресенье)
+        working_days = self.manager.get_calendar().get('working_days', [1, 2, 3, 4, 5, 6, 7])
+        days = {}
+        for day in range(1, last.day + 1):
+            current = first.replace(day=day)
+            days[current.isoformat()] = 0 if current.weekday() + 1 in working_days else NON_WORKING
+        
+        # Активные аренды, пересекающие месяц, из индекса интервалов
+        month_start = datetime.combine(first, datetime.min.time())
+        month_end = month_start + timedelta(days=last.day)
+        sources = []
+        for start, end, rental_id in self.manager.intervals.find_overlapping(console_id, month_start, month_end):
+            sources.append(('rentals', str(rental_id)))
+            # Конец интервала не включается: аренда до 00:00 не занимает следующий день
+            last_day = (min(end, month_end) - timedelta(microseconds=1)).date()
+            self._mark_range(days, max(start, month_start).date(), last_day, OCCUPIED)
+        
+        for blocked in self.manager.get_blocked_dates(console_id, date_from, date_to):
+            if blocked['date'] in days:
+                days[blocked['date']] |= CONSOLE_BLOCKED if blocked.get('console_id') else SYSTEM_BLOCKED
+        
+        holidays = {}
+        for holiday in self.manager.get_holidays(date_from, date_to):
+            if holiday['date'] in days:
+                days[holiday['date']] |= WORKING_HOLIDAY if holiday.get('working', False) else HOLIDAY
+                holidays[holiday['date']] = holiday
+        
+        reservations = {}
+        for reservation in self.manager.get_calendar_reservations(console_id, date_from, date_to):
+            sources.append(('calendar_reservations', str(reservation['_id'])))
+            reservations[reservation['date']] = reservations.get(reservation['date'], 0) + 1
+            if reservation['date'] in days:
+                days[reservation['date']] |= RESERVED
+        
+        # Периоды скидок - из скомпилированного индекса скидок консоли
+        discounts = self.manager.discount_index.get(console_id)
+        sources.extend(('discounts', discount_id) for discount_id in discounts.discount_ids)
+        for start, end in discounts.periods():
+            if start < month_end and end > month_start:
+                last_day = (min(end, month_end) - timedelta(microseconds=1)).date()
+                self._mark_range(days, max(start, month_start).date(), last_day, DISCOUNT)
+        
+        with self._lock:
+            for source in sources:
+                self._sources.setdefault(source, set()).add((console_id, year, month))
+        
+        return {'days': days, 'holidays': holidays, 'reservations': reservations}
+    
+    def get_unavailable_dates(self, console_id, date_from, date_to):
+        """Даты периода, в которые нельзя начать аренду (маски берутся по месяцам)"""
+        unavailable = set()
+        year, month = date_from.year, date_from.month
+        while (year, month) <= (date_to.year, date_to.month):
+            for day_str, flags in self.get_month(console_id, year, month)['days'].items():
+                if flags & UNAVAILABLE:
+                    day = date.fromisoformat(day_str)
+                    if date_from <= day <= date_to:
+                        unavailable.add(day)
+            year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+        return unavailable
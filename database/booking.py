@@ -0,0 +1,149 @@
+"""
+Движок бронирования консолей
+Переходы состояний через find_one_and_update с условием на статус (compare-and-set)
+available -> reserved -> rented -> available
+"""
+
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+
+class BookingEngine:
+    """Атомарные переходы состояний консоли и аренды без блокировок"""
+    
+    def __init__(self, manager):
+        self.manager = manager
+    
+    def _transition(self, console_id, condition, fields, unset=None, expected_version=None):
+        """Перевести консоль в новое состояние, если выполняется условие"""
+        query = {'_id': str(console_id)}
+        query.update(condition)
+        if expected_version is not None:
+            query['version'] = expected_version
+        
+        update = {'$set': fields, '$inc': {'version': 1}}
+        if unset:
+            update['$unset'] = {field: '' for field in unset}
+        
+        # Прежний документ нужен для счетчиков панели, новый собираем из него
+        previous = self.manager.db['consoles'].find_one_and_update(
+            query, update, return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        
+        console = dict(previous, **fields)
+        console['version'] = previous.get('version', 0) + 1
+        for field in unset or []:
+            console.pop(field, None)
+        self.manager._invalidate('consoles', console_id)
+        self.manager._apply_stats_change('consoles', previous, console)
+        return console
+    
+    @staticmethod
+    def _free_condition(user_id=None):
+        """Консоль свободна: доступна, ее резервация истекла или принадлежит пользователю"""
+        free = [
+            {'status': 'available'},
+            {'status': 'reserved', 'reserved_until': {'$lte': datetime.now().isoformat()}}
+        ]
+        if user_id is not None:
+            free.append({'status': 'reserved', 'reserved_by': str(user_id)})
+        return {'$or': free}
+    
+    def reserve_console(self, console_id, user_id, timeout_minutes=30, expected_version=None):
+        """available -> reserved"""
+        try:
+            return self._transition(console_id, self._free_condition(user_id), {
+                'status': 'reserved',
+                'reserved_by': str(user_id),
+                'reserved_until': (datetime.now() + timedelta(minutes=timeout_minutes)).isoformat()
+            }, expected_version=expected_version)
+        except Exception as e:
+            print(f"❌ Ошибка резервации консоли {console_id}: {e}")
+            return None
+    
+    def release_console(self, console_id, user_id=None):
+        """reserved -> available"""
+        try:
+            condition = {'status': 'reserved'}
+            if user_id is not None:
+                condition['reserved_by'] = str(user_id)
+            return self._transition(console_id, condition, {'status': 'available'},
+                                    unset=['reserved_by', 'reserved_until'])
+        except Exception as e:
+            print(f"❌ Ошибка снятия резервации консоли {console_id}: {e}")
+            return None
+    
+    def release_user_reservations(self, user_id):
+        """Снять все резервации консолей пользователя"""
+        return self._release_many({'status': 'reserved', 'reserved_by': str(user_id)})
+    
+    def release_expired_reservations(self):
+        """Вернуть в доступные консоли с истекшей резервацией"""
+        return self._release_many({'status': 'reserved', 'reserved_until': {'$lte': datetime.now().isoformat()}})
+    
+    def _release_many(self, query):
+        """reserved -> available для всех консолей по фильтру"""
+        try:
+            result = self.manager.db['consoles'].update_many(query, {
+                '$set': {'status': 'available'},
+                '$unset': {'reserved_by': '', 'reserved_until': ''},
+                '$inc': {'version': 1}
+            })
+            if result.modified_count:
+                self.manager._invalidate('consoles')
+                self.manager._apply_stats_delta({
+                    'consoles_by_status.reserved': -result.modified_count,
+                    'consoles_by_status.available': result.modified_count
+                })
+            return result.modified_count
+        except Exception as e:
+            print(f"❌ Ошибка снятия резерваций: {e}")
+            return 0
+    
+    def start_rental(self, rental_data, expected_version=None):
+        """available/reserved -> rented и создание аренды; False, если консоль занята"""
+        console_id = rental_data['console_id']
+        rental_id = str(rental_data.get('_id', rental_data.get('id')))
+        try:
+            console = self._transition(console_id, self._free_condition(rental_data.get('user_id')), {
+                'status': 'rented',
+                'current_rental_id': rental_id
+            }, unset=['reserved_by', 'reserved_until'], expected_version=expected_version)
+        except Exception as e:
+            print(f"❌ Ошибка начала аренды консоли {console_id}: {e}")
+            return False
+        
+        if not console:
+            return False
+        
+        if not self.manager.save_rental(rental_data):
+            # Аренда не записалась - возвращаем консоль
+            self._transition(console_id, {'status': 'rented', 'current_rental_id': rental_id},
+                             {'status': 'available'}, unset=['current_rental_id'])
+            return False
+        return True
+    
+    def end_rental(self, rental_id, fields):
+        """active -> completed и rented -> available; None, если аренду уже завершили"""
+        try:
+            fields = dict(fields, status='completed')
+            rental = self.manager.db['rentals'].find_one_and_update(
+                {'_id': str(rental_id), 'status': 'active'},
+                {'$set': fields},
+                return_document=ReturnDocument.BEFORE
+            )
+            if not rental:
+                return None
+            self.manager._invalidate('rentals', rental_id)
+            self.manager._apply_stats_change('rentals', rental, dict(rental, **fields))
+            
+            # Аренды, начатые до движка, не хранят current_rental_id
+            self._transition(rental['console_id'], {
+                'status': 'rented',
+                '$or': [{'current_rental_id': str(rental_id)}, {'current_rental_id': {'$exists': False}}]
+            }, {'status': 'available'}, unset=['current_rental_id'])
+            return rental
+        except Exception as e:
+            print(f"❌ Ошибка завершения аренды {rental_id}: {e}")
+            return None
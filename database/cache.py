@@ -0,0 +1,84 @@
+"""
+Кэш чтения в памяти процесса
+Для маленьких редко меняющихся коллекций (консоли, скидки, настройки)
+"""
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+class ReadThroughCache:
+    """LRU-кэш с TTL и версиями пространств имен"""
+    
+    def __init__(self, ttl_seconds=30, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, namespace, key, loader):
+        """Вернуть значение из кэша или загрузить через loader и запомнить"""
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return loader()
+        
+        entry_key = (namespace, key)
+        with self._lock:
+            version = self._version(namespace)
+            entry = self._entries.get(entry_key)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return copy.deepcopy(entry[2])
+            self.misses += 1
+        
+        # Загружаем без блокировки; ошибки loader не кэшируются
+        value = loader()
+        
+        with self._lock:
+            # Если за время загрузки была запись, значение уже устарело
+            if self._version(namespace) == version:
+                self._entries[entry_key] = (version, time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+                self._entries.move_to_end(entry_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+    
+    def _version(self, namespace):
+        """Текущая версия пространства имен"""
+        return (self._generation, self._versions.get(namespace, 0))
+    
+    def invalidate(self, namespace=None):
+        """Сбросить пространство имен (или весь кэш)"""
+        with self._lock:
+            self.invalidations += 1
+            if namespace is None:
+                self._generation += 1
+                self._entries.clear()
+                return
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[entry_key]
+    
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'versions': dict(self._versions)
+            }
@@ -0,0 +1,111 @@
+"""
+Лента изменений между процессами
+Capped-коллекция + tailable cursor (работает и на одиночном mongod)
+"""
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from datetime import datetime
+import threading
+import time
+import uuid
+
+class ChangeFeed:
+    """Публикация и чтение событий записи {collection, doc_id}"""
+    
+    def __init__(self, db, collection_name='change_events', size_bytes=1024 * 1024):
+        self.db = db
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        # События своего процесса уже применены локально
+        self.origin = str(uuid.uuid4())
+        self._subscribers = []
+        self._reset_subscribers = []
+        self._thread = None
+        self._stop = threading.Event()
+    
+    def ensure_collection(self):
+        """Создать capped-коллекцию, если ее еще нет"""
+        try:
+            self.db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        collection = self.db[self.collection_name]
+        # На пустой capped-коллекции tailable cursor сразу закрывается
+        if collection.estimated_document_count() == 0:
+            collection.insert_one({'collection': None, 'doc_id': None, 'origin': None,
+                                   'created_at': datetime.utcnow()})
+        return collection
+    
+    def publish(self, collection_name, doc_id=None):
+        """Опубликовать событие записи"""
+        try:
+            self.db[self.collection_name].insert_one({
+                'collection': collection_name,
+                'doc_id': str(doc_id) if doc_id is not None else None,
+                'origin': self.origin,
+                'created_at': datetime.utcnow()
+            })
+        except Exception as e:
+            print(f"❌ Ошибка публикации события {collection_name}: {e}")
+    
+    def subscribe(self, callback):
+        """Подписаться на события других процессов: callback(collection, doc_id)"""
+        self._subscribers.append(callback)
+    
+    def subscribe_reset(self, callback):
+        """Подписаться на (пере)подключение к ленте: callback() - события до него могли быть пропущены"""
+        self._reset_subscribers.append(callback)
+    
+    def start(self):
+        """Запустить чтение ленты в фоновом потоке"""
+        if self._thread and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self):
+        """Остановить чтение ленты"""
+        self._stop.set()
+    
+    def _run(self):
+        """Цикл чтения с переподключением"""
+        while not self._stop.is_set():
+            try:
+                collection = self.ensure_collection()
+                # Каждое подключение читает с конца ленты в порядке вставки ($natural).
+                # _id разных процессов не упорядочены между собой, поэтому продолжить с последнего
+                # прочитанного _id нельзя - пропущенное за время переподключения сбрасывается целиком
+                position = collection.count_documents({})
+                self._reset()
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT, max_await_time_ms=1000,
+                                         skip=position)
+                while cursor.alive and not self._stop.is_set():
+                    for event in cursor:
+                        self._dispatch(event)
+                        if self._stop.is_set():
+                            break
+            except Exception as e:
+                print(f"❌ Ошибка ленты изменений: {e}")
+            if not self._stop.is_set():
+                time.sleep(1)
+    
+    def _reset(self):
+        """Сообщить подписчикам о (пере)подключении"""
+        for callback in list(self._reset_subscribers):
+            try:
+                callback()
+            except Exception as e:
+                print(f"❌ Ошибка сброса по ленте изменений: {e}")
+    
+    def _dispatch(self, event):
+        """Передать событие подписчикам"""
+        if not event.get('collection') or event.get('origin') == self.origin:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(event['collection'], event.get('doc_id'))
+            except Exception as e:
+                print(f"❌ Ошибка обработки события {event['collection']}: {e}")
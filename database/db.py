@@ -3,11 +3,24 @@ MongoDB Database Manager
 Замена JSON файлов на MongoDB
 """
 
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from datetime import datetime
+from pymongo import MongoClient, ReplaceOne, DeleteOne, IndexModel, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, DuplicateKeyError
+from bson import json_util
+from datetime import datetime, timedelta
+import base64
+import copy
 import os
+import re
 from dotenv import load_dotenv
+from .cache import ReadThroughCache
+from .change_feed import ChangeFeed
+from .booking import BookingEngine
+from .rollups import RentalRollups, ROLLUP_RENTAL_FIELDS
+from .intervals import RentalIntervalIndex
+from .slots import ReservationSlots
+from .discounts import DiscountIndex
+from .quotes import PriceQuotes
+from .availability import AvailabilityService
 
 load_dotenv()
 
@@ -15,6 +28,157 @@ load_dotenv()
 MONGO_URL = os.getenv('MONGO_URL', 'mongodb://localhost:27017/')
 DB_NAME = os.getenv('DB_NAME', 'ps4_rental')
 
+# Кэш чтения (0 в любом параметре отключает кэш)
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', '30'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '256'))
+
+# Маленькие редко меняющиеся коллекции, которые читаются через кэш
+CACHED_COLLECTIONS = {'consoles', 'discounts', 'calendar', 'admin_settings',
+                      'calendar_blocked_dates', 'calendar_holidays'}
+
+# Коллекции, о записи в которые сообщается другим процессам через ленту изменений
+# (user_rentals - событие о смене числа аренд пользователя, doc_id = user_id)
+PUBLISHED_COLLECTIONS = CACHED_COLLECTIONS | {'users', 'admins', 'ratings', 'rating_transactions',
+                                             'rentals', 'user_rentals', 'calendar_reservations'}
+
+# Коллекции, изменения которых сдвигают счетчики панели (dashboard_stats)
+DASHBOARD_COLLECTIONS = {'users', 'consoles', 'rentals'}
+
+# Статусы аренд, стоимость которых входит в выручку
+REVENUE_STATUSES = ('completed', 'returned')
+
+# Поля аренды, от которых зависят счетчики панели и агрегаты аренд
+DASHBOARD_RENTAL_FIELDS = dict(ROLLUP_RENTAL_FIELDS)
+
+# Счетчики панели пересчитываются с нуля не реже раза в час (исправление расхождений)
+DASHBOARD_RECONCILE_SECONDS = int(os.getenv('DASHBOARD_RECONCILE_SECONDS', '3600'))
+
+# Ручной рейтинг: начальное значение, веса категорий и баллы оценок
+RATING_BASE = 5.0
+RATING_MIN = 1.0
+RATING_MAX = 5.0
+RATING_WEIGHTS = {
+    'console_condition': 0.4,
+    'rule_compliance': 0.3,
+    'return_timing': 0.3
+}
+RATING_SCORES = {
+    'console_condition': {'perfect': 1.0, 'minor_damage': 0.5, 'major_damage': -0.5, 'lost': -1.5},
+    'rule_compliance': {'no_violations': 1.0, 'minor_violations': 0.3, 'major_violations': -0.7},
+    'return_timing': {'on_time': 1.0, 'late_hours': 0.3, 'late_days': -0.5}
+}
+
+# Коллекции, которые хранятся как набор документов {id: документ}
+# (порядок важен: 'rental_requests' содержит и 'rental', и 'request')
+TRACKED_COLLECTIONS = [
+    ('console', 'consoles'),
+    ('user', 'users'),
+    ('request', 'rental_requests'),
+    ('rental', 'rentals'),
+    ('admin', 'admins'),
+    ('discount', 'discounts'),
+    ('rating', 'ratings'),
+    ('temp', 'temp_reservations'),
+]
+
+# Индексы коллекций: {коллекция: [(имя индекса, ключи, опции)]}
+INDEX_SPECS = {
+    'rentals': [
+        ('console_status', [('console_id', ASCENDING), ('status', ASCENDING)], {}),
+        ('user_start_time', [('user_id', ASCENDING), ('start_time', DESCENDING)], {}),
+        ('status_rating', [('status', ASCENDING), ('rating_id', ASCENDING)], {}),
+        # Постраничный вывод в админ-панели: ключ (start_time, _id)
+        ('start_time_id', [('start_time', DESCENDING), ('_id', DESCENDING)], {}),
+        ('status_start_time_id', [('status', ASCENDING), ('start_time', DESCENDING), ('_id', DESCENDING)], {}),
+        ('console_start_time_id', [('console_id', ASCENDING), ('start_time', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'rental_requests': [
+        ('user_status', [('user_id', ASCENDING), ('status', ASCENDING)], {}),
+        ('status_request_time_id', [('status', ASCENDING), ('request_time', DESCENDING), ('_id', DESCENDING)], {}),
+        ('request_time_id', [('request_time', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'ratings': [
+        ('user_timestamp', [('user_id', ASCENDING), ('timestamp', DESCENDING)], {}),
+    ],
+    'discounts': [
+        ('console_active_start', [('console_id', ASCENDING), ('active', ASCENDING), ('start_date', ASCENDING)], {}),
+    ],
+    'users': [
+        ('joined_at_id', [('joined_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'calendar_reservations': [
+        # Один слот консоли на дату может быть занят только одной резервацией
+        ('console_date_slot', [('console_id', ASCENDING), ('date', ASCENDING), ('time_slot', ASCENDING)],
+         {'unique': True}),
+        ('date', [('date', ASCENDING)], {}),
+    ],
+    'calendar_blocked_dates': [
+        # console_id = None для системных блокировок
+        ('console_date', [('console_id', ASCENDING), ('date', ASCENDING)], {'unique': True}),
+        ('date', [('date', ASCENDING)], {}),
+    ],
+    'rating_transactions': [
+        ('user_date', [('user_id', ASCENDING), ('date', ASCENDING)], {}),
+        # История рейтингов: страницы по (date, _id), новые первыми
+        ('date_id', [('date', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'rating_leaderboard': [
+        ('final_score_id', [('final_score', DESCENDING), ('_id', ASCENDING)], {}),
+        ('status', [('status', ASCENDING)], {}),
+    ],
+    'rental_rollups': [
+        ('granularity_bucket', [('granularity', ASCENDING), ('bucket', ASCENDING), ('console_id', ASCENDING)], {}),
+        ('granularity_console_bucket', [('granularity', ASCENDING), ('console_id', ASCENDING), ('bucket', ASCENDING)], {}),
+    ],
+    'temp_reservations': [
+        # MongoDB сам удаляет резервацию, когда наступает expires_at
+        ('expires_at_ttl', [('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+        ('user_id', [('user_id', ASCENDING)], {}),
+    ],
+    'price_quotes': [
+        # Закрепленные цены диалога аренды живут до expires_at
+        ('expires_at_ttl', [('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+}
+
+def encode_page_cursor(value, doc_id):
+    """Курсор страницы: значение поля сортировки и _id последнего документа"""
+    # Extended JSON сохраняет типы ObjectId и datetime, иначе $lt/$gt сравнивали бы строку
+    raw = json_util.dumps([value, doc_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_page_cursor(cursor):
+    """Разобрать курсор страницы в (значение, _id)"""
+    value, doc_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    return value, doc_id
+
+class TrackedCollection(dict):
+    """Словарь документов коллекции со снимком состояния на момент загрузки"""
+    
+    def __init__(self, collection_name, documents=None):
+        super().__init__(documents or {})
+        self.collection_name = collection_name
+        self.mark_clean()
+    
+    def mark_clean(self):
+        """Запомнить текущее состояние как сохраненное"""
+        self._snapshot = {doc_id: copy.deepcopy(doc) for doc_id, doc in self.items()}
+    
+    def get_changes(self):
+        """Вернуть (вставленные, измененные, удаленные) id с момента загрузки"""
+        inserted, modified = [], []
+        for doc_id, doc in self.items():
+            if doc_id not in self._snapshot:
+                inserted.append(doc_id)
+            elif doc != self._snapshot[doc_id]:
+                modified.append(doc_id)
+        deleted = [doc_id for doc_id in self._snapshot if doc_id not in self]
+        return inserted, modified, deleted
+    
+    def get_saved(self, doc_id):
+        """Документ в том виде, в котором он был загружен или сохранен"""
+        return self._snapshot.get(doc_id)
+
 class MongoDBManager:
     """Менеджер для работы с MongoDB"""
     
@@ -23,7 +187,21 @@ class MongoDBManager:
         self.db_name = db_name
         self.client = None
         self.db = None
+        self.cache = ReadThroughCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+        self.change_feed = None
+        self.booking = BookingEngine(self)
+        self.rollups = RentalRollups(self)
+        self._write_listeners = []
+        self.slots = ReservationSlots(self)
+        self.discount_index = DiscountIndex(self)
+        self.quotes = PriceQuotes(self)
+        self.intervals = RentalIntervalIndex(self)
+        self.availability = AvailabilityService(self)
         self.connect()
+        if self.db is not None:
+            self.change_feed = ChangeFeed(self.db)
+            self.change_feed.subscribe(self._on_remote_change)
+            self.change_feed.subscribe_reset(self._on_change_feed_reset)
     
     def connect(self):
         """Подключение к MongoDB"""
@@ -45,16 +223,382 @@ class MongoDBManager:
             self.client.close()
             print("👋 Отключение от MongoDB")
     
+    # ===== ОБЩИЕ ЗАПРОСЫ =====
+    def _find_as_dict(self, collection_name, query=None, sort=None, limit=0, projection=None):
+        """Выборка по фильтру в виде словаря {id: документ}"""
+        try:
+            if collection_name in CACHED_COLLECTIONS and not projection:
+                key = ('find', repr(query), repr(sort), limit)
+                return self.cache.get(collection_name, key,
+                                      lambda: self._query_as_dict(collection_name, query, sort, limit))
+            return self._query_as_dict(collection_name, query, sort, limit, projection)
+        except Exception as e:
+            print(f"❌ Ошибка выборки из {collection_name}: {e}")
+            return {}
+    
+    def _query_as_dict(self, collection_name, query=None, sort=None, limit=0, projection=None):
+        """Выборка из MongoDB без кэша (ошибки пробрасываются)"""
+        cursor = self.db[collection_name].find(query or {}, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return {str(doc['_id']): doc for doc in cursor}
+    
+    def find_page(self, collection_name, query=None, sort_field='_id', descending=True,
+                  cursor=None, limit=50, projection=None):
+        """Страница выборки по ключу (sort_field, _id) без skip: (документы, следующий курсор)"""
+        try:
+            direction = DESCENDING if descending else ASCENDING
+            op = '$lt' if descending else '$gt'
+            conditions = [query] if query else []
+            
+            if cursor:
+                last_value, last_id = decode_page_cursor(cursor)
+                if sort_field == '_id':
+                    conditions.append({'_id': {op: last_id}})
+                else:
+                    # Документы без поля сортировки идут первыми по возрастанию
+                    # и последними по убыванию, $lt/$gt их не находят
+                    after = [{sort_field: last_value, '_id': {op: last_id}}]
+                    if last_value is None:
+                        if not descending:
+                            after.append({sort_field: {'$ne': None}})
+                    else:
+                        after.append({sort_field: {op: last_value}})
+                        if descending:
+                            after.append({sort_field: None})
+                    conditions.append({'$or': after})
+            
+            if len(conditions) > 1:
+                final_query = {'$and': conditions}
+            else:
+                final_query = conditions[0] if conditions else {}
+            
+            sort = [('_id', direction)]
+            if sort_field != '_id':
+                sort.insert(0, (sort_field, direction))
+            
+            # Берем на один документ больше, чтобы узнать, есть ли следующая страница
+            docs = list(self.db[collection_name].find(final_query, projection).sort(sort).limit(limit + 1))
+            next_cursor = None
+            if len(docs) > limit:
+                docs = docs[:limit]
+                next_cursor = encode_page_cursor(docs[-1].get(sort_field), docs[-1]['_id'])
+            return {str(doc['_id']): doc for doc in docs}, next_cursor
+        except Exception as e:
+            print(f"❌ Ошибка постраничной выборки из {collection_name}: {e}")
+            return {}, None
+    
+    def _iter(self, collection_name, query=None, projection=None, batch_size=500, sort=None):
+        """Потоковое чтение курсором: документы не собираются в память целиком"""
+        try:
+            with self.db[collection_name].find(query or {}, projection, batch_size=batch_size) as cursor:
+                if sort:
+                    cursor.sort(sort)
+                for doc in cursor:
+                    yield doc
+        except Exception as e:
+            print(f"❌ Ошибка чтения {collection_name}: {e}")
+    
+    def _invalidate(self, collection_name, doc_id=None):
+        """Сбросить кэш коллекции после записи и сообщить другим процессам"""
+        if collection_name in CACHED_COLLECTIONS:
+            self.cache.invalidate(collection_name)
+        if collection_name in PUBLISHED_COLLECTIONS and self.change_feed:
+            self.change_feed.publish(collection_name, doc_id)
+        self._notify_write(collection_name, doc_id)
+    
+    def _on_remote_change(self, collection_name, doc_id):
+        """Событие записи из другого процесса"""
+        if collection_name in CACHED_COLLECTIONS:
+            self.cache.invalidate(collection_name)
+        self._notify_write(collection_name, doc_id, remote=True)
+    
+    def _on_change_feed_reset(self):
+        """Переподключение к ленте: события других процессов могли быть пропущены - сбрасываем все"""
+        for collection_name in sorted(PUBLISHED_COLLECTIONS):
+            self._on_remote_change(collection_name, None)
+    
+    def add_write_listener(self, callback, local_only=False):
+        """
+        Подписаться на записи: callback(collection, doc_id)
+        
+        local_only=True - только записи этого процесса (для действий, которые достаточно выполнить один раз)
+        """
+        self._write_listeners.append((callback, local_only))
+    
+    def _notify_write(self, collection_name, doc_id, remote=False):
+        """Передать событие записи слушателям (кэши поверх менеджера)"""
+        for callback, local_only in list(self._write_listeners):
+            if remote and local_only:
+                continue
+            try:
+                callback(collection_name, doc_id)
+            except Exception as e:
+                print(f"❌ Ошибка обработки записи {collection_name}: {e}")
+    
+    def start_change_feed(self):
+        """Начать получать события записи других процессов"""
+        if self.change_feed:
+            return self.change_feed.start()
+        return False
+    
+    def subscribe_changes(self, callback):
+        """Подписаться на записи других процессов: callback(collection, doc_id)"""
+        if self.change_feed:
+            self.change_feed.subscribe(callback)
+    
+    def get_cache_stats(self):
+        """Статистика кэша чтения"""
+        return self.cache.stats()
+    
+    def _update_fields(self, collection_name, doc_id, fields, unset=None):
+        """Частичное обновление документа через $set (и $unset полей unset)"""
+        try:
+            update = {'$set': fields}
+            if unset:
+                update['$unset'] = {field: '' for field in unset}
+            if collection_name in DASHBOARD_COLLECTIONS:
+                # Прежний документ нужен для счетчиков панели
+                previous = self.db[collection_name].find_one_and_update({'_id': str(doc_id)}, update)
+                self._invalidate(collection_name, doc_id)
+                if previous:
+                    current = {field: value for field, value in previous.items() if field not in (unset or ())}
+                    self._apply_stats_change(collection_name, previous, dict(current, **fields))
+                return previous is not None
+            result = self.db[collection_name].update_one({'_id': str(doc_id)}, update)
+            self._invalidate(collection_name, doc_id)
+            return result.matched_count > 0
+        except Exception as e:
+            print(f"❌ Ошибка обновления {collection_name}/{doc_id}: {e}")
+            return False
+    
+    # ===== ОТСЛЕЖИВАНИЕ ИЗМЕНЕНИЙ =====
+    @staticmethod
+    def resolve_collection(name):
+        """Определить коллекцию документов по названию (как в load_json_file)"""
+        name = name.lower()
+        for marker, collection_name in TRACKED_COLLECTIONS:
+            if marker in name:
+                return collection_name
+        return None
+    
+    def load_tracked(self, collection_name):
+        """Загрузить коллекцию с отслеживанием изменений"""
+        return TrackedCollection(collection_name, self._find_as_dict(collection_name))
+    
+    def save_changes(self, collection_name, data):
+        """Сохранить только измененные документы одним bulk_write"""
+        try:
+            if isinstance(data, TrackedCollection):
+                inserted, modified, deleted = data.get_changes()
+            else:
+                # Обычный словарь: изменения неизвестны, сохраняем все документы
+                inserted, modified, deleted = [], list(data.keys()), []
+            
+            operations = []
+            for doc_id in inserted + modified:
+                doc = data[doc_id]
+                doc['_id'] = str(doc_id)
+                operations.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+            for doc_id in deleted:
+                operations.append(DeleteOne({'_id': str(doc_id)}))
+            
+            if operations:
+                self.db[collection_name].bulk_write(operations, ordered=False)
+                if isinstance(data, TrackedCollection):
+                    # Изменения известны - слушатели сбрасывают только затронутые документы
+                    for doc_id in inserted + modified + deleted:
+                        self._invalidate(collection_name, str(doc_id))
+                else:
+                    self._invalidate(collection_name)
+                if collection_name in DASHBOARD_COLLECTIONS:
+                    self._apply_saved_changes(collection_name, data, inserted + modified, deleted)
+            if isinstance(data, TrackedCollection):
+                data.mark_clean()
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка сохранения изменений в {collection_name}: {e}")
+            return False
+    
+    # ===== СЧЕТЧИКИ ПАНЕЛИ =====
+    @staticmethod
+    def _stats_contribution(collection_name, doc):
+        """Вклад документа в счетчики панели"""
+        if not doc:
+            return {}
+        if collection_name == 'users':
+            return {'users_count': 1}
+        if collection_name == 'consoles':
+            return {'consoles_count': 1, f"consoles_by_status.{doc.get('status', 'unknown')}": 1}
+        
+        contribution = {f"rentals_by_status.{doc.get('status', 'unknown')}": 1}
+        if doc.get('status') in REVENUE_STATUSES and doc.get('total_cost'):
+            contribution['revenue_total'] = doc['total_cost']
+            contribution['revenue_rentals'] = 1
+            if doc.get('end_time'):
+                contribution[f"revenue_by_day.{str(doc['end_time'])[:10]}"] = doc['total_cost']
+        return contribution
+    
+    def _stats_delta(self, collection_name, previous, current):
+        """Разница вкладов документа до и после записи"""
+        delta = dict(self._stats_contribution(collection_name, current))
+        for field, value in self._stats_contribution(collection_name, previous).items():
+            delta[field] = delta.get(field, 0) - value
+        return {field: value for field, value in delta.items() if value}
+    
+    def _apply_stats_delta(self, delta):
+        """Сдвинуть счетчики панели атомарным $inc (если их еще нет - их соберет reconcile)"""
+        if not delta:
+            return
+        try:
+            self.db['dashboard_stats'].update_one({'_id': 'dashboard'}, {
+                '$inc': delta,
+                '$set': {'updated_at': datetime.now().isoformat()}
+            })
+        except Exception as e:
+            print(f"❌ Ошибка обновления счетчиков панели: {e}")
+    
+    def _apply_stats_change(self, collection_name, previous, current):
+        """Учесть в счетчиках переход документа previous -> current (None - нет документа)"""
+        self._apply_stats_delta(self._stats_delta(collection_name, previous, current))
+        if collection_name == 'rentals':
+            self.rollups.apply_change(previous, current)
+            self._notify_rental_owners(previous, current)
+    
+    def _notify_rental_owners(self, previous, current):
+        """Сообщить о смене числа аренд пользователей (создание, удаление, смена владельца)"""
+        previous_user = (previous or {}).get('user_id')
+        current_user = (current or {}).get('user_id')
+        if previous_user == current_user:
+            return
+        for user_id in (previous_user, current_user):
+            if user_id is not None:
+                self._invalidate('user_rentals', str(user_id))
+    
+    def _apply_saved_changes(self, collection_name, data, changed, deleted):
+        """Учесть в счетчиках сохранение словаря документов"""
+        if not isinstance(data, TrackedCollection):
+            # Прежние документы неизвестны - счетчики пересчитаются при следующем чтении
+            self.db['dashboard_stats'].update_one({'_id': 'dashboard'}, {'$set': {'reconciled_at': None}})
+            if collection_name == 'rentals':
+                self._invalidate('user_rentals')
+            return
+        delta = {}
+        for doc_id in changed + deleted:
+            current = data.get(doc_id) if doc_id not in deleted else None
+            for field, value in self._stats_delta(collection_name, data.get_saved(doc_id), current).items():
+                delta[field] = delta.get(field, 0) + value
+            if collection_name == 'rentals':
+                self.rollups.apply_change(data.get_saved(doc_id), current)
+                self._notify_rental_owners(data.get_saved(doc_id), current)
+        self._apply_stats_delta({field: value for field, value in delta.items() if value})
+    
+    def reconcile_dashboard_stats(self):
+        """Пересчитать счетчики панели с нуля (исправляет расхождения)"""
+        try:
+            stats = {
+                'users_count': self.db['users'].count_documents({}),
+                'consoles_count': 0,
+                'consoles_by_status': {},
+                'rentals_by_status': {},
+                'revenue_total': 0,
+                'revenue_rentals': 0,
+                'revenue_by_day': {}
+            }
+            for group in self.db['consoles'].aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+                stats['consoles_by_status'][group['_id'] or 'unknown'] = group['count']
+                stats['consoles_count'] += group['count']
+            for group in self.db['rentals'].aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+                stats['rentals_by_status'][group['_id'] or 'unknown'] = group['count']
+            
+            # Выручка по дням завершения
+            for group in self.db['rentals'].aggregate([
+                {'$match': {'status': {'$in': list(REVENUE_STATUSES)}, 'total_cost': {'$gt': 0}}},
+                {'$group': {
+                    '_id': {'$substrCP': [{'$ifNull': ['$end_time', '']}, 0, 10]},
+                    'revenue': {'$sum': '$total_cost'},
+                    'count': {'$sum': 1}
+                }}
+            ]):
+                stats['revenue_total'] += group['revenue']
+                stats['revenue_rentals'] += group['count']
+                if group['_id']:
+                    stats['revenue_by_day'][group['_id']] = group['revenue']
+            
+            now = datetime.now().isoformat()
+            stats['updated_at'] = now
+            stats['reconciled_at'] = now
+            self.db['dashboard_stats'].replace_one({'_id': 'dashboard'}, stats, upsert=True)
+            return stats
+        except Exception as e:
+            print(f"❌ Ошибка пересчета счетчиков панели: {e}")
+            return None
+    
+    def get_dashboard_stats(self):
+        """Счетчики панели одним чтением (пересчет, если их нет или они давно не сверялись)"""
+        try:
+            stats = self.db['dashboard_stats'].find_one({'_id': 'dashboard'}, {'_id': 0})
+            reconciled_at = stats.get('reconciled_at') if stats else None
+            age = (datetime.now() - datetime.fromisoformat(reconciled_at)).total_seconds() if reconciled_at else None
+            if age is None or age > DASHBOARD_RECONCILE_SECONDS:
+                stats = self.reconcile_dashboard_stats() or stats
+            return stats or {}
+        except Exception as e:
+            print(f"❌ Ошибка получения счетчиков панели: {e}")
+            return {}
+    
+    # ===== ИНДЕКСЫ =====
+    def ensure_indexes(self):
+        """Создать недостающие индексы из INDEX_SPECS"""
+        created = {}
+        for collection_name, specs in INDEX_SPECS.items():
+            try:
+                models = [IndexModel(keys, name=name, **options) for name, keys, options in specs]
+                created[collection_name] = self.db[collection_name].create_indexes(models)
+            except Exception as e:
+                print(f"❌ Ошибка создания индексов {collection_name}: {e}")
+        return created
+    
+    def get_index_report(self):
+        """Отчет по индексам: размеры, использование, недостающие из INDEX_SPECS"""
+        report = {}
+        collection_names = set(INDEX_SPECS) | set(self.db.list_collection_names())
+        for collection_name in sorted(collection_names):
+            try:
+                collection = self.db[collection_name]
+                existing = collection.index_information()
+                sizes = self.db.command('collStats', collection_name).get('indexSizes', {})
+                usage = {}
+                for stat in collection.aggregate([{'$indexStats': {}}]):
+                    usage[stat['name']] = stat.get('accesses', {}).get('ops', 0)
+                
+                existing_keys = {tuple(info['key']) for info in existing.values()}
+                missing = [name for name, keys, options in INDEX_SPECS.get(collection_name, [])
+                           if tuple(keys) not in existing_keys]
+                
+                report[collection_name] = {
+                    'indexes': {
+                        name: {
+                            'keys': info['key'],
+                            'size': sizes.get(name, 0),
+                            'ops': usage.get(name, 0)
+                        }
+                        for name, info in existing.items()
+                    },
+                    'missing': missing,
+                    'unused': [name for name in existing if name != '_id_' and usage.get(name, 0) == 0]
+                }
+            except Exception as e:
+                print(f"❌ Ошибка получения индексов {collection_name}: {e}")
+        return report
+    
     # ===== КОНСОЛИ =====
     def get_consoles(self):
         """Получить все консоли"""
         try:
-            collection = self.db['consoles']
-            consoles = {}
-            for doc in collection.find():
-                console_id = str(doc['_id'])
-                consoles[console_id] = doc
-            return consoles
+            return self.cache.get('consoles', 'all', lambda: self._query_as_dict('consoles'))
         except Exception as e:
             print(f"❌ Ошибка получения консолей: {e}")
             return {}
@@ -63,19 +607,39 @@ class MongoDBManager:
         """Получить консоль по ID"""
         try:
             collection = self.db['consoles']
-            doc = collection.find_one({'_id': str(console_id)})
-            return doc
+            return self.cache.get('consoles', str(console_id),
+                                  lambda: collection.find_one({'_id': str(console_id)}))
         except Exception as e:
             print(f"❌ Ошибка получения консоли {console_id}: {e}")
             return None
     
+    def get_console_by_prefix(self, prefix):
+        """Найти консоль по началу ID (короткие ID в callback_data)"""
+        try:
+            collection = self.db['consoles']
+            return self.cache.get('consoles', ('prefix', str(prefix)),
+                                  lambda: collection.find_one({'_id': {'$regex': f'^{re.escape(str(prefix))}'}}))
+        except Exception as e:
+            print(f"❌ Ошибка поиска консоли по префиксу {prefix}: {e}")
+            return None
+    
+    def find_consoles(self, query=None):
+        """Получить консоли по фильтру"""
+        return self._find_as_dict('consoles', query)
+    
+    def update_console(self, console_id, fields, unset=None):
+        """Обновить отдельные поля консоли (статус, версию и аренду меняет только движок бронирования)"""
+        return self._update_fields('consoles', console_id, fields, unset)
+    
     def save_console(self, console_data):
         """Сохранить консоль"""
         try:
             collection = self.db['consoles']
             console_id = str(console_data.get('_id', console_data.get('id')))
             console_data['_id'] = console_id
-            collection.replace_one({'_id': console_id}, console_data, upsert=True)
+            previous = collection.find_one_and_replace({'_id': console_id}, console_data, upsert=True)
+            self._invalidate('consoles', console_id)
+            self._apply_stats_change('consoles', previous, console_data)
             return console_id
         except Exception as e:
             print(f"❌ Ошибка сохранения консоли: {e}")
@@ -85,8 +649,10 @@ class MongoDBManager:
         """Удалить консоль"""
         try:
             collection = self.db['consoles']
-            result = collection.delete_one({'_id': str(console_id)})
-            return result.deleted_count > 0
+            previous = collection.find_one_and_delete({'_id': str(console_id)})
+            self._invalidate('consoles', console_id)
+            self._apply_stats_change('consoles', previous, None)
+            return previous is not None
         except Exception as e:
             print(f"❌ Ошибка удаления консоли {console_id}: {e}")
             return False
@@ -115,13 +681,49 @@ class MongoDBManager:
             print(f"❌ Ошибка получения пользователя {user_id}: {e}")
             return None
     
+    def count_users(self, query=None):
+        """Количество пользователей"""
+        try:
+            return self.db['users'].count_documents(query or {})
+        except Exception as e:
+            print(f"❌ Ошибка подсчета пользователей: {e}")
+            return 0
+    
+    def find_users(self, query=None, projection=None):
+        """Получить пользователей по фильтру"""
+        return self._find_as_dict('users', query, projection=projection)
+    
+    def iter_users(self, query=None, projection=None, batch_size=500):
+        """Потоковый перебор пользователей"""
+        return self._iter('users', query, projection, batch_size)
+    
+    def get_recent_users(self, limit=10):
+        """Последние зарегистрированные пользователи"""
+        return self._find_as_dict('users', sort=[('joined_at', -1)], limit=limit)
+    
+    def update_user(self, user_id, fields):
+        """Обновить отдельные поля пользователя"""
+        return self._update_fields('users', user_id, fields)
+    
+    def add_user_spent(self, user_id, amount):
+        """Увеличить сумму трат пользователя"""
+        try:
+            result = self.db['users'].update_one({'_id': str(user_id)}, {'$inc': {'total_spent': amount}})
+            self._invalidate('users', user_id)
+            return result.matched_count > 0
+        except Exception as e:
+            print(f"❌ Ошибка обновления трат пользователя: {e}")
+            return False
+    
     def save_user(self, user_data):
         """Сохранить пользователя"""
         try:
             collection = self.db['users']
             user_id = str(user_data.get('_id', user_data.get('id')))
             user_data['_id'] = user_id
-            collection.replace_one({'_id': user_id}, user_data, upsert=True)
+            previous = collection.find_one_and_replace({'_id': user_id}, user_data, upsert=True)
+            self._invalidate('users', user_id)
+            self._apply_stats_change('users', previous, user_data)
             return user_id
         except Exception as e:
             print(f"❌ Ошибка сохранения пользователя: {e}")
@@ -131,8 +733,11 @@ class MongoDBManager:
         """Удалить пользователя"""
         try:
             collection = self.db['users']
-            result = collection.delete_one({'_id': str(user_id)})
-            return result.deleted_count > 0
+            previous = collection.find_one_and_delete({'_id': str(user_id)})
+            self._invalidate('users', user_id)
+            self._apply_stats_change('users', previous, None)
+            self.remove_leaderboard_entry(user_id)
+            return previous is not None
         except Exception as e:
             print(f"❌ Ошибка удаления пользователя {user_id}: {e}")
             return False
@@ -151,13 +756,83 @@ class MongoDBManager:
             print(f"❌ Ошибка получения аренд: {e}")
             return {}
     
+    def get_rental(self, rental_id):
+        """Получить аренду по ID"""
+        try:
+            collection = self.db['rentals']
+            return collection.find_one({'_id': str(rental_id)})
+        except Exception as e:
+            print(f"❌ Ошибка получения аренды {rental_id}: {e}")
+            return None
+    
+    def find_rentals(self, query=None, sort=None, limit=0, projection=None):
+        """Получить аренды по фильтру"""
+        return self._find_as_dict('rentals', query, sort=sort, limit=limit, projection=projection)
+    
+    def iter_rentals(self, query=None, projection=None, batch_size=500):
+        """Потоковый перебор аренд"""
+        return self._iter('rentals', query, projection, batch_size)
+    
+    def get_user_rentals(self, user_id, status=None, projection=None):
+        """Аренды пользователя (по индексу user_id)"""
+        query = {'user_id': str(user_id)}
+        if status:
+            query['status'] = status
+        return self.find_rentals(query, projection=projection)
+    
+    def get_console_rentals(self, console_id, status=None):
+        """Аренды консоли (по индексу console_id + status)"""
+        query = {'console_id': console_id}
+        if status:
+            query['status'] = status
+        return self.find_rentals(query)
+    
+    def get_active_rental_for_console(self, console_id):
+        """Активная аренда консоли"""
+        try:
+            collection = self.db['rentals']
+            return collection.find_one({'console_id': console_id, 'status': 'active'})
+        except Exception as e:
+            print(f"❌ Ошибка получения активной аренды консоли {console_id}: {e}")
+            return None
+    
+    def count_rentals(self, query=None):
+        """Количество аренд по фильтру"""
+        try:
+            return self.db['rentals'].count_documents(query or {})
+        except Exception as e:
+            print(f"❌ Ошибка подсчета аренд: {e}")
+            return 0
+    
+    def update_rental(self, rental_id, fields):
+        """Обновить отдельные поля аренды"""
+        return self._update_fields('rentals', rental_id, fields)
+    
+    def delete_user_rentals(self, user_id):
+        """Удалить все аренды пользователя"""
+        try:
+            query = {'user_id': str(user_id)}
+            rentals = list(self.db['rentals'].find(query, DASHBOARD_RENTAL_FIELDS))
+            result = self.db['rentals'].delete_many(query)
+            self._invalidate('rentals')
+            for rental in rentals:
+                self._apply_stats_change('rentals', rental, None)
+            if result.deleted_count:
+                self._invalidate('user_rentals', str(user_id))
+            return result.deleted_count
+        except Exception as e:
+            print(f"❌ Ошибка удаления аренд пользователя {user_id}: {e}")
+            return 0
+    
     def save_rental(self, rental_data):
         """Сохранить аренду"""
         try:
             collection = self.db['rentals']
             rental_id = str(rental_data.get('_id', rental_data.get('id')))
             rental_data['_id'] = rental_id
-            collection.replace_one({'_id': rental_id}, rental_data, upsert=True)
+            previous = collection.find_one_and_replace({'_id': rental_id}, rental_data, upsert=True)
+            self._invalidate('rentals', rental_id)
+            self._apply_stats_change('rentals', previous, rental_data)
             return rental_id
         except Exception as e:
             print(f"❌ Ошибка сохранения аренды: {e}")
@@ -167,8 +842,10 @@ class MongoDBManager:
         """Удалить аренду"""
         try:
             collection = self.db['rentals']
-            result = collection.delete_one({'_id': str(rental_id)})
-            return result.deleted_count > 0
+            previous = collection.find_one_and_delete({'_id': str(rental_id)})
+            self._invalidate('rentals', rental_id)
+            self._apply_stats_change('rentals', previous, None)
+            return previous is not None
         except Exception as e:
             print(f"❌ Ошибка удаления аренды {rental_id}: {e}")
             return False
@@ -178,7 +855,7 @@ class MongoDBManager:
         try:
             collection = self.db['rentals']
             # Добавляем информацию о возврате к существующей аренде
-            result = collection.update_one(
+            previous = collection.find_one_and_update(
                 {'_id': str(rental_id)},
                 {
                     '$set': {
@@ -190,13 +867,17 @@ class MongoDBManager:
                             'client_confirmed': return_data.get('client_confirmed', False),  # Подтверждение клиента
                             'client_signature': return_data.get('client_signature', ''),  # Подпись клиента
                             'recorded_by': return_data.get('recorded_by'),  # Кто записал информацию
+                            'recorded_by_id': return_data.get('recorded_by_id'),
                             'recorded_at': datetime.now().isoformat()  # Когда записано
                         },
                         'status': 'returned'
                     }
                 }
             )
-            return result.matched_count > 0
+            if previous:
+                self._invalidate('rentals', rental_id)
+                self._apply_stats_change('rentals', previous, dict(previous, status='returned'))
+            return previous is not None
         except Exception as e:
             print(f"❌ Ошибка сохранения информации о возврате {rental_id}: {e}")
             return False
@@ -227,6 +908,15 @@ class MongoDBManager:
             print(f"❌ Ошибка получения администраторов: {e}")
             return {}
     
+    def get_admin(self, admin_id):
+        """Получить администратора по логину"""
+        try:
+            collection = self.db['admins']
+            return collection.find_one({'_id': str(admin_id)})
+        except Exception as e:
+            print(f"❌ Ошибка получения администратора {admin_id}: {e}")
+            return None
+    
     def save_admin(self, admin_data):
         """Сохранить администратора"""
         try:
@@ -234,6 +924,7 @@ class MongoDBManager:
             admin_id = str(admin_data.get('_id', admin_data.get('username', 'admin')))
             admin_data['_id'] = admin_id
             collection.replace_one({'_id': admin_id}, admin_data, upsert=True)
+            self._invalidate('admins', admin_id)
             return admin_id
         except Exception as e:
             print(f"❌ Ошибка сохранения администратора: {e}")
@@ -244,6 +935,7 @@ class MongoDBManager:
         try:
             collection = self.db['admins']
             result = collection.delete_one({'_id': str(admin_id)})
+            self._invalidate('admins', admin_id)
             return result.deleted_count > 0
         except Exception as e:
             print(f"❌ Ошибка удаления администратора {admin_id}: {e}")
@@ -263,6 +955,51 @@ class MongoDBManager:
             print(f"❌ Ошибка получения заявок: {e}")
             return {}
     
+    def get_rental_request(self, request_id):
+        """Получить заявку по ID"""
+        try:
+            collection = self.db['rental_requests']
+            return collection.find_one({'_id': str(request_id)})
+        except Exception as e:
+            print(f"❌ Ошибка получения заявки {request_id}: {e}")
+            return None
+    
+    def find_rental_requests(self, query=None, sort=None, limit=0):
+        """Получить заявки по фильтру"""
+        return self._find_as_dict('rental_requests', query, sort=sort, limit=limit)
+    
+    def count_rental_requests(self, query=None):
+        """Количество заявок по фильтру"""
+        try:
+            return self.db['rental_requests'].count_documents(query or {})
+        except Exception as e:
+            print(f"❌ Ошибка подсчета заявок: {e}")
+            return 0
+    
+    def iter_rental_requests(self, query=None, projection=None, batch_size=500):
+        """Потоковый перебор заявок"""
+        return self._iter('rental_requests', query, projection, batch_size)
+    
+    def get_user_rental_requests(self, user_id, status=None):
+        """Заявки пользователя (по индексу user_id + status)"""
+        query = {'user_id': str(user_id)}
+        if status:
+            query['status'] = status
+        return self.find_rental_requests(query)
+    
+    def update_rental_request(self, request_id, fields):
+        """Обновить отдельные поля заявки"""
+        return self._update_fields('rental_requests', request_id, fields)
+    
+    def delete_user_rental_requests(self, user_id):
+        """Удалить все заявки пользователя"""
+        try:
+            result = self.db['rental_requests'].delete_many({'user_id': str(user_id)})
+            return result.deleted_count
+        except Exception as e:
+            print(f"❌ Ошибка удаления заявок пользователя {user_id}: {e}")
+            return 0
+    
     def save_rental_request(self, request_data):
         """Сохранить заявку на аренду"""
         try:
@@ -289,16 +1026,28 @@ class MongoDBManager:
     def get_discounts(self):
         """Получить все скидки"""
         try:
-            collection = self.db['discounts']
-            discounts = {}
-            for doc in collection.find():
-                discount_id = str(doc['_id'])
-                discounts[discount_id] = doc
-            return discounts
+            return self.cache.get('discounts', 'all', lambda: self._query_as_dict('discounts'))
         except Exception as e:
             print(f"❌ Ошибка получения скидок: {e}")
             return {}
     
+    def get_discount(self, discount_id):
+        """Получить скидку по ID"""
+        try:
+            collection = self.db['discounts']
+            return self.cache.get('discounts', str(discount_id),
+                                  lambda: collection.find_one({'_id': str(discount_id)}))
+        except Exception as e:
+            print(f"❌ Ошибка получения скидки {discount_id}: {e}")
+            return None
+    
+    def get_console_discounts(self, console_id, active_only=True):
+        """Скидки консоли (по индексу console_id + active)"""
+        query = {'console_id': console_id}
+        if active_only:
+            query['active'] = True
+        return self._find_as_dict('discounts', query)
+    
     def save_discount(self, discount_data):
         """Сохранить скидку"""
         try:
@@ -306,6 +1055,7 @@ class MongoDBManager:
             discount_id = str(discount_data.get('_id', discount_data.get('id')))
             discount_data['_id'] = discount_id
             collection.replace_one({'_id': discount_id}, discount_data, upsert=True)
+            self._invalidate('discounts', discount_id)
             return discount_id
         except Exception as e:
             print(f"❌ Ошибка сохранения скидки: {e}")
@@ -316,6 +1066,7 @@ class MongoDBManager:
         try:
             collection = self.db['discounts']
             result = collection.delete_one({'_id': str(discount_id)})
+            self._invalidate('discounts', discount_id)
             return result.deleted_count > 0
         except Exception as e:
             print(f"❌ Ошибка удаления скидки {discount_id}: {e}")
@@ -326,7 +1077,7 @@ class MongoDBManager:
         """Получить данные календаря"""
         try:
             collection = self.db['calendar']
-            doc = collection.find_one({'_id': 'calendar_data'})
+            doc = self.cache.get('calendar', 'calendar_data', lambda: collection.find_one({'_id': 'calendar_data'}))
             if doc:
                 doc.pop('_id', None)
             return doc or {}
@@ -340,11 +1091,215 @@ class MongoDBManager:
             collection = self.db['calendar']
             calendar_data['_id'] = 'calendar_data'
             result = collection.replace_one({'_id': 'calendar_data'}, calendar_data, upsert=True)
+            self._invalidate('calendar')
             return True
         except Exception as e:
             print(f"❌ Ошибка сохранения календаря: {e}")
             return False
     
+    @staticmethod
+    def _date_range(date_from=None, date_to=None):
+        """Условие на поле date (строки YYYY-MM-DD)"""
+        date_query = {}
+        if date_from:
+            date_query['$gte'] = date_from
+        if date_to:
+            date_query['$lte'] = date_to
+        return date_query
+    
+    def get_calendar_reservations(self, console_id=None, date_from=None, date_to=None):
+        """Резервации календаря по консоли и диапазону дат"""
+        try:
+            query = {}
+            if console_id:
+                query['console_id'] = console_id
+            date_query = self._date_range(date_from, date_to)
+            if date_query:
+                query['date'] = date_query
+            return list(self.db['calendar_reservations'].find(query).sort([('date', ASCENDING), ('time_slot', ASCENDING)]))
+        except Exception as e:
+            print(f"❌ Ошибка получения резерваций календаря: {e}")
+            return []
+    
+    def add_calendar_reservation(self, reservation):
+        """Добавить резервацию (False, если хотя бы один ее час уже занят)"""
+        try:
+            reservation['_id'] = str(reservation['id'])
+            # Сначала атомарно занимаем часы в масках дней, затем пишем саму резервацию
+            if reservation.get('time_slot') and not self.slots.claim(
+                    reservation['console_id'], reservation['date'], reservation['time_slot'],
+                    reservation.get('duration_hours', 1), reservation.get('status')):
+                return False
+            try:
+                self.db['calendar_reservations'].insert_one(reservation)
+            except DuplicateKeyError:
+                self.slots.release(reservation)
+                return False
+            self._invalidate('calendar_reservations', reservation['_id'])
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка сохранения резервации календаря: {e}")
+            return False
+    
+    def delete_calendar_reservation(self, reservation_id):
+        """Удалить резервацию календаря"""
+        try:
+            reservation = self.db['calendar_reservations'].find_one_and_delete({'_id': str(reservation_id)})
+            self.slots.release(reservation)
+            self._invalidate('calendar_reservations', reservation_id)
+            return reservation is not None
+        except Exception as e:
+            print(f"❌ Ошибка удаления резервации календаря {reservation_id}: {e}")
+            return False
+    
+    def get_blocked_dates(self, console_id=None, date_from=None, date_to=None, include_system=True):
+        """Заблокированные даты: системные (console_id = None) и консоли"""
+        try:
+            query = {}
+            if console_id:
+                query['console_id'] = {'$in': [None, console_id]} if include_system else console_id
+            elif not include_system:
+                query['console_id'] = {'$ne': None}
+            date_query = self._date_range(date_from, date_to)
+            if date_query:
+                query['date'] = date_query
+            
+            key = (console_id, date_from, date_to, include_system)
+            return self.cache.get('calendar_blocked_dates', key, lambda: list(
+                self.db['calendar_blocked_dates'].find(query, {'_id': 0}).sort('date', ASCENDING)
+            ))
+        except Exception as e:
+            print(f"❌ Ошибка получения заблокированных дат: {e}")
+            return []
+    
+    def add_blocked_date(self, date_str, console_id=None):
+        """Заблокировать дату (False, если уже заблокирована)"""
+        try:
+            doc_id = f"{console_id or 'system'}_{date_str}"
+            result = self.db['calendar_blocked_dates'].update_one(
+                {'_id': doc_id},
+                {'$setOnInsert': {'console_id': console_id, 'date': date_str,
+                                  'created_at': datetime.now().isoformat()}},
+                upsert=True
+            )
+            self._invalidate('calendar_blocked_dates', doc_id)
+            return result.upserted_id is not None
+        except Exception as e:
+            print(f"❌ Ошибка блокировки даты {date_str}: {e}")
+            return False
+    
+    def remove_blocked_date(self, date_str, console_id=None):
+        """Снять блокировку даты"""
+        try:
+            doc_id = f"{console_id or 'system'}_{date_str}"
+            result = self.db['calendar_blocked_dates'].delete_one({'_id': doc_id})
+            self._invalidate('calendar_blocked_dates', doc_id)
+            return result.deleted_count > 0
+        except Exception as e:
+            print(f"❌ Ошибка разблокировки даты {date_str}: {e}")
+            return False
+    
+    def get_holidays(self, date_from=None, date_to=None):
+        """Праздничные дни в диапазоне дат"""
+        try:
+            query = {}
+            date_query = self._date_range(date_from, date_to)
+            if date_query:
+                query['date'] = date_query
+            return self.cache.get('calendar_holidays', (date_from, date_to), lambda: list(
+                self.db['calendar_holidays'].find(query, {'_id': 0}).sort('date', ASCENDING)
+            ))
+        except Exception as e:
+            print(f"❌ Ошибка получения праздников: {e}")
+            return []
+    
+    def add_holiday(self, holiday):
+        """Добавить праздник (False, если на эту дату уже есть)"""
+        try:
+            self.db['calendar_holidays'].insert_one(dict(holiday, _id=holiday['date']))
+            self._invalidate('calendar_holidays', holiday['date'])
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            print(f"❌ Ошибка добавления праздника: {e}")
+            return False
+    
+    def delete_holiday(self, date_str):
+        """Удалить праздник"""
+        try:
+            result = self.db['calendar_holidays'].delete_one({'_id': date_str})
+            self._invalidate('calendar_holidays', date_str)
+            return result.deleted_count > 0
+        except Exception as e:
+            print(f"❌ Ошибка удаления праздника {date_str}: {e}")
+            return False
+    
+    def migrate_calendar_document(self):
+        """Перенести резервации, блокировки и праздники из calendar_data в отдельные коллекции"""
+        try:
+            collection = self.db['calendar']
+            doc = collection.find_one({'_id': 'calendar_data'}) or {}
+            legacy_fields = ['reservations', 'system_blocked_dates', 'console_blocked_dates', 'holidays']
+            if not any(field in doc for field in legacy_fields):
+                return 0
+            
+            operations = {'calendar_reservations': [], 'calendar_blocked_dates': [], 'calendar_holidays': []}
+            legacy_reservations = [reservation for reservations in doc.get('reservations', {}).values()
+                                   for reservation in reservations]
+            
+            # Слот (консоль, дата, время) уникален: повторы из старого документа не вставятся
+            slot_owners = {}
+            reservation_dates = list({reservation.get('date') for reservation in legacy_reservations})
+            for existing in self.db['calendar_reservations'].find({'date': {'$in': reservation_dates}},
+                                                                  {'console_id': 1, 'date': 1, 'time_slot': 1}):
+                slot_owners[(existing.get('console_id'), existing.get('date'), existing.get('time_slot'))] = existing['_id']
+            
+            skipped = []
+            for reservation in legacy_reservations:
+                reservation['_id'] = str(reservation['id'])
+                slot = (reservation.get('console_id'), reservation.get('date'), reservation.get('time_slot'))
+                owner = slot_owners.setdefault(slot, reservation['_id'])
+                if owner != reservation['_id']:
+                    print(f"⚠️ Резервация {reservation['_id']} пропущена: слот {slot} уже занят резервацией {owner}")
+                    skipped.append(reservation)
+                    continue
+                operations['calendar_reservations'].append(
+                    ReplaceOne({'_id': reservation['_id']}, reservation, upsert=True))
+            
+            blocked = [(None, date_str) for date_str in doc.get('system_blocked_dates', [])]
+            for console_id, dates in doc.get('console_blocked_dates', {}).items():
+                blocked.extend((console_id, date_str) for date_str in dates)
+            for console_id, date_str in blocked:
+                doc_id = f"{console_id or 'system'}_{date_str}"
+                operations['calendar_blocked_dates'].append(ReplaceOne(
+                    {'_id': doc_id}, {'_id': doc_id, 'console_id': console_id, 'date': date_str}, upsert=True))
+            
+            for holiday in doc.get('holidays', []):
+                operations['calendar_holidays'].append(
+                    ReplaceOne({'_id': holiday['date']}, dict(holiday, _id=holiday['date']), upsert=True))
+            
+            migrated = 0
+            for collection_name, requests in operations.items():
+                if requests:
+                    self.db[collection_name].bulk_write(requests, ordered=False)
+                    self._invalidate(collection_name)
+                    migrated += len(requests)
+            if operations['calendar_reservations']:
+                self.slots.rebuild()
+            
+            # Документ календаря оставляет только настройки (и пропущенные повторы для ручного разбора)
+            update = {'$unset': {field: '' for field in legacy_fields}}
+            if skipped:
+                update['$push'] = {'skipped_reservations': {'$each': skipped}}
+            collection.update_one({'_id': 'calendar_data'}, update)
+            self._invalidate('calendar')
+            print(f"📅 Календарь перенесен в отдельные коллекции: {migrated} записей, пропущено повторов: {len(skipped)}")
+            return migrated
+        except Exception as e:
+            print(f"❌ Ошибка миграции календаря: {e}")
+            return 0
+    
     # ===== РЕЙТИНГИ =====
     def get_ratings(self):
         """Получить все рейтинги"""
@@ -371,22 +1326,265 @@ class MongoDBManager:
             print(f"❌ Ошибка сохранения рейтинга: {e}")
             return None
     
+    def iter_ratings(self, query=None, projection=None, batch_size=500):
+        """Потоковый перебор рейтингов"""
+        return self._iter('ratings', query, projection, batch_size)
+    
     def delete_rating(self, rating_id):
         """Удалить рейтинг"""
         try:
             collection = self.db['ratings']
-            result = collection.delete_one({'_id': str(rating_id)})
-            return result.deleted_count > 0
+            doc = collection.find_one_and_delete({'_id': str(rating_id)})
+            if doc and doc.get('rental_id') and doc.get('user_id') is not None:
+                # Ручная оценка - вычитаем ее из сводки пользователя
+                self._apply_rating_to_summary(doc, sign=-1)
+            return doc is not None
         except Exception as e:
             print(f"❌ Ошибка удаления рейтинга {rating_id}: {e}")
             return False
     
+    # ===== ТРАНЗАКЦИИ РЕЙТИНГА (ДИСЦИПЛИНА И ЛОЯЛЬНОСТЬ) =====
+    def add_rating_transactions(self, transactions):
+        """Добавить транзакции рейтинга одной вставкой (журнал только дописывается)"""
+        try:
+            if not transactions:
+                return 0
+            now = datetime.now().isoformat()
+            for transaction in transactions:
+                transaction['user_id'] = str(transaction['user_id'])
+                transaction.setdefault('date', transaction.get('created_at') or now)
+            # Вставляем копии: ObjectId не должен попадать в документы вызывающего кода
+            result = self.db['rating_transactions'].insert_many([dict(t) for t in transactions], ordered=False)
+            for user_id in {transaction['user_id'] for transaction in transactions}:
+                self._invalidate('rating_transactions', user_id)
+            return len(result.inserted_ids)
+        except Exception as e:
+            print(f"❌ Ошибка добавления транзакций рейтинга: {e}")
+            return 0
+    
+    def add_rating_transaction(self, transaction):
+        """Добавить одну транзакцию рейтинга"""
+        return self.add_rating_transactions([transaction]) == 1
+    
+    def get_rating_transactions(self, user_id, limit=None):
+        """Транзакции пользователя в порядке добавления (limit - только последние N)"""
+        try:
+            collection = self.db['rating_transactions']
+            cursor = collection.find({'user_id': str(user_id)}, {'_id': 0}).sort([('date', DESCENDING), ('_id', DESCENDING)])
+            if limit:
+                cursor = cursor.limit(limit)
+            transactions = list(cursor)
+            transactions.reverse()
+            return transactions
+        except Exception as e:
+            print(f"❌ Ошибка получения транзакций рейтинга {user_id}: {e}")
+            return []
+    
+    def iter_rating_transactions(self, query=None, projection=None, batch_size=500):
+        """Потоковый перебор транзакций рейтинга по пользователю и дате"""
+        return self._iter('rating_transactions', query, projection, batch_size,
+                          sort=[('user_id', ASCENDING), ('date', ASCENDING), ('_id', ASCENDING)])
+    
+    def count_rating_transactions(self, user_id):
+        """Количество транзакций рейтинга пользователя"""
+        try:
+            return self.db['rating_transactions'].count_documents({'user_id': str(user_id)})
+        except Exception as e:
+            print(f"❌ Ошибка подсчета транзакций рейтинга {user_id}: {e}")
+            return 0
+    
+    def get_discipline_window(self, user_id):
+        """Окно последних событий дисциплины пользователя"""
+        try:
+            return self.db['discipline_windows'].find_one({'_id': str(user_id)})
+        except Exception as e:
+            print(f"❌ Ошибка получения окна дисциплины {user_id}: {e}")
+            return None
+    
+    def get_discipline_windows(self):
+        """Окна дисциплины всех пользователей: {user_id: документ}"""
+        return self._find_as_dict('discipline_windows', projection={'events': 0})
+    
+    def push_discipline_events(self, user_id, events, window_size, rules_key):
+        """
+        Дописать события в окно дисциплины и пересчитать сумму одним атомарным обновлением
+        
+        Возвращает False, если окна нет или оно построено для другого размера/правил
+        """
+        try:
+            result = self.db['discipline_windows'].update_one(
+                {'_id': str(user_id), 'window_size': window_size, 'rules_key': rules_key},
+                [
+                    {'$set': {
+                        'events': {'$slice': [{'$concatArrays': ['$events', events]}, -window_size]},
+                        'updated_at': datetime.now().isoformat()
+                    }},
+                    {'$set': {'score_sum': {'$sum': '$events.score'}, 'events_count': {'$size': '$events'}}}
+                ]
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            print(f"❌ Ошибка обновления окна дисциплины {user_id}: {e}")
+            return False
+    
+    def save_discipline_windows(self, windows, window_size, rules_key):
+        """Перезаписать окна дисциплины: {user_id: [события]}"""
+        try:
+            now = datetime.now().isoformat()
+            operations = []
+            for user_id, events in windows.items():
+                events = list(events)[-window_size:]
+                operations.append(ReplaceOne({'_id': str(user_id)}, {
+                    '_id': str(user_id),
+                    'events': events,
+                    'window_size': window_size,
+                    'rules_key': rules_key,
+                    'score_sum': sum(event['score'] for event in events),
+                    'events_count': len(events),
+                    'updated_at': now
+                }, upsert=True))
+            if operations:
+                self.db['discipline_windows'].bulk_write(operations, ordered=False)
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения окон дисциплины: {e}")
+            return 0
+    
+    def migrate_rating_transactions(self):
+        """Перенести вложенный словарь transactions из ratings в коллекцию rating_transactions"""
+        try:
+            legacy = self.db['ratings'].find_one({'_id': 'transactions'})
+            if not legacy:
+                return 0
+            
+            operations = []
+            for user_id, transactions in legacy.items():
+                if user_id == '_id' or not isinstance(transactions, list):
+                    continue
+                for index, transaction in enumerate(transactions):
+                    # Стабильный _id - повторный запуск не создает дубликатов
+                    doc = dict(transaction, _id=f"legacy_{user_id}_{index}", user_id=str(user_id))
+                    doc.setdefault('date', transaction.get('created_at', ''))
+                    operations.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+            
+            if operations:
+                self.db['rating_transactions'].bulk_write(operations, ordered=False)
+            self.db['ratings'].delete_one({'_id': 'transactions'})
+            self._invalidate('rating_transactions')
+            print(f"⭐ Транзакции рейтинга перенесены: {len(operations)}")
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка миграции транзакций рейтинга: {e}")
+            return 0
+    
+    # ===== ЛИДЕРБОРД РЕЙТИНГА =====
+    def _leaderboard_delta(self, delta, entry, sign):
+        """Добавить запись лидерборда к приращению счетчиков со знаком sign"""
+        status_field = f"counts.{entry['status']}"
+        delta[status_field] = delta.get(status_field, 0) + sign
+        delta['score_total'] = delta.get('score_total', 0) + sign * entry['final_score']
+        delta['users_count'] = delta.get('users_count', 0) + sign
+    
+    def _apply_leaderboard_delta(self, delta):
+        """Применить приращение к счетчикам (если их еще нет - их соберет reconcile)"""
+        delta = {field: value for field, value in delta.items() if value}
+        update = {'$set': {'updated_at': datetime.now().isoformat()}}
+        if delta:
+            update['$inc'] = delta
+        self.db['rating_stats'].update_one({'_id': 'leaderboard'}, update)
+    
+    def save_leaderboard_entries(self, entries):
+        """Записать рейтинги пользователей в лидерборд и сдвинуть счетчики статусов"""
+        try:
+            collection = self.db['rating_leaderboard']
+            delta = {}
+            for entry in entries:
+                entry = dict(entry, _id=str(entry['user_id']), user_id=str(entry['user_id']))
+                previous = collection.find_one_and_replace({'_id': entry['_id']}, entry, upsert=True)
+                if previous:
+                    self._leaderboard_delta(delta, previous, -1)
+                self._leaderboard_delta(delta, entry, 1)
+            self._apply_leaderboard_delta(delta)
+            return len(entries)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения лидерборда: {e}")
+            return 0
+    
+    def remove_leaderboard_entry(self, user_id):
+        """Убрать пользователя из лидерборда"""
+        try:
+            previous = self.db['rating_leaderboard'].find_one_and_delete({'_id': str(user_id)})
+            if not previous:
+                return False
+            delta = {}
+            self._leaderboard_delta(delta, previous, -1)
+            self._apply_leaderboard_delta(delta)
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка удаления из лидерборда {user_id}: {e}")
+            return False
+    
+    def get_leaderboard_entries(self, limit=None, status=None):
+        """Записи лидерборда по убыванию балла (по индексу final_score_id)"""
+        try:
+            query = {'status': status} if status else {}
+            cursor = self.db['rating_leaderboard'].find(query, {'_id': 0}).sort([('final_score', -1), ('_id', 1)])
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        except Exception as e:
+            print(f"❌ Ошибка получения лидерборда: {e}")
+            return []
+    
+    def get_leaderboard_stats(self):
+        """Счетчики статусов и сумма баллов лидерборда (None, если еще не собраны)"""
+        try:
+            return self.db['rating_stats'].find_one({'_id': 'leaderboard'}, {'_id': 0})
+        except Exception as e:
+            print(f"❌ Ошибка получения статистики рейтингов: {e}")
+            return None
+    
+    def reconcile_leaderboard_stats(self):
+        """Пересчитать счетчики по записям лидерборда (после пересборки, когда баллы свежие)"""
+        try:
+            stats = {'counts': {}, 'score_total': 0, 'users_count': 0}
+            for group in self.db['rating_leaderboard'].aggregate([
+                {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'score': {'$sum': '$final_score'}}}
+            ]):
+                stats['counts'][group['_id']] = group['count']
+                stats['score_total'] += group['score']
+                stats['users_count'] += group['count']
+            now = datetime.now().isoformat()
+            stats['updated_at'] = now
+            stats['reconciled_at'] = now
+            self.db['rating_stats'].replace_one({'_id': 'leaderboard'}, stats, upsert=True)
+            return stats
+        except Exception as e:
+            print(f"❌ Ошибка пересчета статистики рейтингов: {e}")
+            return None
+    
+    def rebuild_leaderboard(self, entries):
+        """Перезаписать лидерборд целиком и пересчитать счетчики"""
+        try:
+            collection = self.db['rating_leaderboard']
+            user_ids = [str(entry['user_id']) for entry in entries]
+            operations = [ReplaceOne({'_id': user_id}, dict(entry, _id=user_id, user_id=user_id), upsert=True)
+                          for user_id, entry in zip(user_ids, entries)]
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            collection.delete_many({'_id': {'$nin': user_ids}})
+            self.reconcile_leaderboard_stats()
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка пересборки лидерборда: {e}")
+            return 0
+    
     # ===== АДМИН НАСТРОЙКИ =====
     def get_admin_settings(self):
         """Получить настройки администратора"""
         try:
             collection = self.db['admin_settings']
-            doc = collection.find_one({'_id': 'admin_settings'})
+            doc = self.cache.get('admin_settings', 'admin_settings', lambda: collection.find_one({'_id': 'admin_settings'}))
             if doc:
                 doc.pop('_id', None)
             return doc or {}
@@ -400,6 +1598,7 @@ class MongoDBManager:
             collection = self.db['admin_settings']
             settings_data['_id'] = 'admin_settings'
             result = collection.replace_one({'_id': 'admin_settings'}, settings_data, upsert=True)
+            self._invalidate('admin_settings')
             return True
         except Exception as e:
             print(f"❌ Ошибка сохранения настроек: {e}")
@@ -448,20 +1647,130 @@ class MongoDBManager:
                 'timestamp': datetime.now().isoformat(),
                 'created_at': datetime.now()
             }
-            collection.insert_one(rating_doc)
+            try:
+                collection.insert_one(rating_doc)
+            except DuplicateKeyError:
+                # Аренда уже оценена: досчитываем сводку (повтор ничего не меняет) и не перезаписываем оценку
+                existing = collection.find_one({'_id': rental_id})
+                if existing and existing.get('user_id') is not None:
+                    self._apply_rating_to_summary(existing)
+                return False
+            self._apply_rating_to_summary(rating_doc)
             
             # Отмечаем аренду как имеющую рейтинг
-            rentals_collection = self.db['rentals']
-            rentals_collection.update_one(
-                {'_id': rental_id},
-                {'$set': {'rating_id': rental_id, 'rated_at': datetime.now().isoformat()}}
-            )
+            self._update_fields('rentals', rental_id, {'rating_id': rental_id, 'rated_at': datetime.now().isoformat()})
             
             return True
         except Exception as e:
             print(f"❌ Ошибка при добавлении рейтинга: {e}")
             return False
     
+    def _rating_transaction_score(self, transaction):
+        """Вклад одной оценки в рейтинг"""
+        trans_score = 0
+        for field, weight in RATING_WEIGHTS.items():
+            trans_score += RATING_SCORES[field].get(transaction.get(field, ''), 0) * weight
+        return trans_score
+    
+    def _apply_rating_to_summary(self, rating_doc, sign=1):
+        """
+        Атомарно учесть оценку (sign=1) или ее удаление (sign=-1) в сводке пользователя
+        
+        Сводка хранит rating_ids учтенных оценок, поэтому повтор с той же оценкой ничего не меняет
+        """
+        user_id = rating_doc['user_id']
+        rating_id = str(rating_doc['_id'])
+        inc = {
+            'score_total': sign * self._rating_transaction_score(rating_doc),
+            'transaction_count': sign
+        }
+        for field in RATING_WEIGHTS:
+            if rating_doc.get(field):
+                inc[f"counts.{field}.{rating_doc[field]}"] = sign
+        
+        update = {'$inc': inc, '$set': {'user_id': user_id, 'updated_at': datetime.now().isoformat()}}
+        collection = self.db['rating_summaries']
+        if sign < 0:
+            update['$pull'] = {'rating_ids': rating_id}
+            collection.update_one({'_id': str(user_id), 'rating_ids': rating_id}, update)
+            return
+        
+        update['$set']['last_rating_at'] = rating_doc.get('timestamp')
+        update['$push'] = {'rating_ids': rating_id}
+        try:
+            # Сводка, уже учитывающая оценку, под условие не попадает, а upsert упирается в _id
+            collection.update_one({'_id': str(user_id), 'rating_ids': {'$ne': rating_id}}, update, upsert=True)
+        except DuplicateKeyError:
+            pass
+    
+    def _summary_with_rating(self, summary):
+        """Добавить к сводке итоговый рейтинг (RATING_BASE + сумма вкладов, в пределах шкалы)"""
+        summary['rating'] = self._clamp_rating(RATING_BASE + summary.get('score_total', 0))
+        return summary
+    
+    def get_rating_summary(self, user_id):
+        """Сводка рейтинга пользователя: rating, transaction_count, counts, last_rating_at"""
+        try:
+            summary = self.db['rating_summaries'].find_one({'_id': str(user_id)}, {'_id': 0})
+            if not summary:
+                # Новый пользователь без оценок
+                summary = {'user_id': user_id, 'score_total': 0, 'transaction_count': 0,
+                           'counts': {}, 'last_rating_at': None}
+            return self._summary_with_rating(summary)
+        except Exception as e:
+            print(f"❌ Ошибка получения сводки рейтинга {user_id}: {e}")
+            return None
+    
+    def rebuild_rating_summaries(self):
+        """Пересобрать сводки рейтинга из коллекции ratings (для бэкфилла)"""
+        try:
+            group = {
+                '_id': '$user_id',
+                'score_total': {'$sum': self._rating_score_expression()},
+                'transaction_count': {'$sum': 1},
+                'last_rating_at': {'$max': '$timestamp'},
+                'rating_ids': {'$push': {'$toString': '$_id'}}
+            }
+            for field in RATING_WEIGHTS:
+                for value in RATING_SCORES[field]:
+                    group[f"{field}__{value}"] = {'$sum': {'$cond': [{'$eq': [f'${field}', value]}, 1, 0]}}
+            pipeline = [
+                {'$match': {'rental_id': {'$exists': True}, 'user_id': {'$ne': None}}},
+                {'$group': group}
+            ]
+            
+            now = datetime.now().isoformat()
+            operations = []
+            summary_ids = []
+            for doc in self.db['ratings'].aggregate(pipeline):
+                user_id = doc['_id']
+                counts = {}
+                for field in RATING_WEIGHTS:
+                    counts[field] = {value: doc[f"{field}__{value}"] for value in RATING_SCORES[field]
+                                     if doc[f"{field}__{value}"]}
+                summary = {
+                    '_id': str(user_id),
+                    'user_id': user_id,
+                    'score_total': doc['score_total'],
+                    'transaction_count': doc['transaction_count'],
+                    'counts': counts,
+                    'last_rating_at': doc['last_rating_at'],
+                    'rating_ids': doc['rating_ids'],
+                    'updated_at': now
+                }
+                operations.append(ReplaceOne({'_id': summary['_id']}, summary, upsert=True))
+                summary_ids.append(summary['_id'])
+            
+            collection = self.db['rating_summaries']
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            # Сводки пользователей, у которых не осталось оценок
+            collection.delete_many({'_id': {'$nin': summary_ids}})
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка пересборки сводок рейтинга: {e}")
+            return 0
+    
     def get_user_rating(self, user_id):
         """Получить рейтинг пользователя с историей транзакций"""
         try:
@@ -481,8 +1790,9 @@ class MongoDBManager:
                 }
                 transactions.append(transaction)
             
-            # Пересчитываем общий рейтинг на основе всех транзакций
-            rating = self._calculate_rating_from_transactions(transactions)
+            # Общий рейтинг берем из сводки, а не пересчитываем по всем транзакциям
+            summary = self.get_rating_summary(user_id)
+            rating = summary['rating'] if summary else self._calculate_rating_from_transactions(transactions)
             
             return {
                 'user_id': user_id,
@@ -493,53 +1803,51 @@ class MongoDBManager:
             print(f"❌ Ошибка получения рейтинга пользователя {user_id}: {e}")
             return None
     
+    @staticmethod
+    def _clamp_rating(score):
+        """Ограничить рейтинг диапазоном RATING_MIN..RATING_MAX"""
+        return round(max(RATING_MIN, min(RATING_MAX, score)), 2)
+    
     def _calculate_rating_from_transactions(self, transactions):
         """Вычислить рейтинг на основе всех транзакций"""
         if not transactions:
-            return 5.0  # Начальный рейтинг для новых пользователей
-        
-        score = 5.0
-        weight_condition = 0.4
-        weight_compliance = 0.3
-        weight_timing = 0.3
+            return RATING_BASE  # Начальный рейтинг для новых пользователей
         
+        score = RATING_BASE
         for transaction in transactions:
-            trans_score = 0
-            
-            # Оценка состояния консоли
-            condition = transaction.get('console_condition', '')
-            if condition == 'perfect':
-                trans_score += 1.0 * weight_condition
-            elif condition == 'minor_damage':
-                trans_score += 0.5 * weight_condition
-            elif condition == 'major_damage':
-                trans_score += -0.5 * weight_condition
-            elif condition == 'lost':
-                trans_score += -1.5 * weight_condition
-            
-            # Оценка соответствия правилам
-            compliance = transaction.get('rule_compliance', '')
-            if compliance == 'no_violations':
-                trans_score += 1.0 * weight_compliance
-            elif compliance == 'minor_violations':
-                trans_score += 0.3 * weight_compliance
-            elif compliance == 'major_violations':
-                trans_score += -0.7 * weight_compliance
-            
-            # Оценка времени возврата
-            timing = transaction.get('return_timing', '')
-            if timing == 'on_time':
-                trans_score += 1.0 * weight_timing
-            elif timing == 'late_hours':
-                trans_score += 0.3 * weight_timing
-            elif timing == 'late_days':
-                trans_score += -0.5 * weight_timing
-            
-            score += trans_score
+            # Состояние консоли, соблюдение правил и время возврата
+            score += self._rating_transaction_score(transaction)
         
-        # Ограничиваем рейтинг от 1.0 до 5.0
-        score = max(1.0, min(5.0, score))
-        return round(score, 2)
+        return self._clamp_rating(score)
+    
+    @staticmethod
+    def _rating_score_expression():
+        """Выражение агрегации: вклад одной оценки в рейтинг (как в _calculate_rating_from_transactions)"""
+        terms = []
+        for field, weight in RATING_WEIGHTS.items():
+            terms.append({'$switch': {
+                'branches': [
+                    {'case': {'$eq': [f'${field}', value]}, 'then': score * weight}
+                    for value, score in RATING_SCORES[field].items()
+                ],
+                'default': 0
+            }})
+        return {'$add': terms}
+    
+    def get_all_user_ratings(self):
+        """Рейтинги всех пользователей одним запросом: {user_id: {'rating', 'transaction_count'}}"""
+        try:
+            ratings = {}
+            projection = {'score_total': 1, 'transaction_count': 1}
+            for doc in self.db['rating_summaries'].find({}, projection):
+                ratings[str(doc['_id'])] = {
+                    'rating': self._summary_with_rating(doc)['rating'],
+                    'transaction_count': doc.get('transaction_count', 0)
+                }
+            return ratings
+        except Exception as e:
+            print(f"❌ Ошибка получения рейтингов: {e}")
+            return {}
     
     # ===== ВРЕМЕННЫЕ РЕЗЕРВАЦИИ =====
     def get_temp_reservations(self):
@@ -576,6 +1884,62 @@ class MongoDBManager:
         except Exception as e:
             print(f"❌ Ошибка удаления временной резервации {reservation_id}: {e}")
             return False
+    
+    def claim_temp_reservation(self, console_id, user_id, timeout_minutes=30):
+        """Атомарно занять консоль: успешно, если она свободна, истекла или уже наша"""
+        try:
+            collection = self.db['temp_reservations']
+            now = datetime.utcnow()
+            collection.find_one_and_update(
+                {
+                    '_id': str(console_id),
+                    '$or': [{'user_id': str(user_id)}, {'expires_at': {'$lte': now}}]
+                },
+                {'$set': {
+                    'console_id': str(console_id),
+                    'user_id': str(user_id),
+                    'created_at': datetime.now().isoformat(),
+                    'expires_at': now + timedelta(minutes=timeout_minutes)
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            # У пользователя может быть только одна резервация
+            collection.delete_many({'user_id': str(user_id), '_id': {'$ne': str(console_id)}})
+            return True
+        except DuplicateKeyError:
+            # Документ с этим console_id существует и принадлежит другому пользователю
+            return False
+        except Exception as e:
+            print(f"❌ Ошибка резервации консоли {console_id}: {e}")
+            return False
+    
+    def get_temp_reservation(self, console_id):
+        """Получить действующую резервацию консоли"""
+        try:
+            collection = self.db['temp_reservations']
+            return collection.find_one({'_id': str(console_id), 'expires_at': {'$gt': datetime.utcnow()}})
+        except Exception as e:
+            print(f"❌ Ошибка получения резервации консоли {console_id}: {e}")
+            return None
+    
+    def release_user_temp_reservations(self, user_id):
+        """Удалить резервации пользователя"""
+        try:
+            collection = self.db['temp_reservations']
+            return collection.delete_many({'user_id': str(user_id)}).deleted_count
+        except Exception as e:
+            print(f"❌ Ошибка удаления резерваций пользователя {user_id}: {e}")
+            return 0
+    
+    def cleanup_legacy_temp_reservations(self):
+        """Удалить резервации старого формата (expires_at строкой не истекает по TTL)"""
+        try:
+            collection = self.db['temp_reservations']
+            return collection.delete_many({'expires_at': {'$type': 'string'}}).deleted_count
+        except Exception as e:
+            print(f"❌ Ошибка очистки старых резерваций: {e}")
+            return 0
 
 
 # Глобальный экземпляр менеджера БД
@@ -591,7 +1955,23 @@ def get_db_manager():
 def init_db():
     """Инициализация БД при запуске"""
     manager = get_db_manager()
-    if manager.db:
+    if manager.db is not None:
+        manager.cleanup_legacy_temp_reservations()
+        # Удержания из бота больше не переводят консоль в reserved - снимаем оставшиеся истекшие
+        manager.booking.release_expired_reservations()
+        # Перенос календаря до уникального индекса слотов (повторы он пропускает сам)
+        manager.migrate_calendar_document()
+        manager.ensure_indexes()
+        manager.migrate_rating_transactions()
+        # Агрегаты аренд появились позже самих аренд - заполняем один раз
+        if manager.db['rental_rollups'].estimated_document_count() == 0:
+            manager.rollups.rebuild()
+        # Почасовые маски резерваций - тоже
+        if manager.db['calendar_slots'].estimated_document_count() == 0:
+            manager.slots.rebuild()
+        # Сводки рейтинга без rating_ids собраны до идемпотентного учета оценок - пересобираем
+        if manager.db['rating_summaries'].find_one({'rating_ids': {'$exists': False}}, {'_id': 1}):
+            manager.rebuild_rating_summaries()
         print("✅ База данных инициализирована")
         return True
     else:
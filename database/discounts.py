@@ -0,0 +1,118 @@
+"""
+Скомпилированный индекс скидок консолей
+Даты разбираются один раз при сборке, лучшая скидка на (консоль, время, часы) ищется двумя bisect
+"""
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import threading
+
+DISCOUNT_TYPES = ('percentage', 'fixed')
+
+def discount_amount(discount, price):
+    """Размер скидки для цены (фиксированная скидка не больше самой цены)"""
+    if discount['type'] == 'percentage':
+        return price * (discount['value'] / 100)
+    if discount['type'] == 'fixed':
+        return min(discount['value'], price)
+    return 0
+
+def parse_period(discount):
+    """Период скидки [start, end): дата окончания без времени действует до конца дня"""
+    try:
+        start = datetime.fromisoformat(str(discount['start_date'])).replace(tzinfo=None)
+        end_value = str(discount['end_date'])
+        end = datetime.fromisoformat(end_value).replace(tzinfo=None)
+    except (KeyError, TypeError, ValueError):
+        return None
+    end += timedelta(days=1) if len(end_value) == 10 else timedelta(microseconds=1)
+    return (start, end) if end > start else None
+
+class ConsoleDiscounts:
+    """Скидки одной консоли, разложенные по элементарным отрезкам времени"""
+    
+    def __init__(self, discounts):
+        periods = []
+        for discount in discounts:
+            period = parse_period(discount)
+            if period and discount.get('type') in DISCOUNT_TYPES:
+                periods.append((period[0], period[1], discount))
+        
+        self.discount_ids = {str(discount.get('_id')) for _, _, discount in periods}
+        self.bounds = sorted({point for start, end, _ in periods for point in (start, end)})
+        self.segments = []
+        for left, right in zip(self.bounds, self.bounds[1:]):
+            active = [(float(discount.get('min_hours') or 0), index, discount)
+                      for index, (start, end, discount) in enumerate(periods) if start <= left and right <= end]
+            self.segments.append(self._compile_segment(sorted(active, key=lambda item: item[:2])))
+    
+    @staticmethod
+    def _compile_segment(active):
+        """Префиксные лучшие скидки по возрастанию min_hours: (min_hours, лучшая %, лучшая фикс.)"""
+        min_hours, best_percentage, best_fixed = [], [], []
+        percentage = fixed = None
+        for hours, _, discount in active:
+            if discount['type'] == 'percentage':
+                if percentage is None or discount['value'] > percentage['value']:
+                    percentage = discount
+            elif fixed is None or discount['value'] > fixed['value']:
+                fixed = discount
+            if min_hours and min_hours[-1] == hours:
+                best_percentage[-1], best_fixed[-1] = percentage, fixed
+            else:
+                min_hours.append(hours)
+                best_percentage.append(percentage)
+                best_fixed.append(fixed)
+        return min_hours, best_percentage, best_fixed
+    
+    def best(self, at, hours, price):
+        """Скидка с наибольшей суммой для момента at и продолжительности hours (None, если нет)"""
+        index = bisect_right(self.bounds, at) - 1
+        if index < 0 or index >= len(self.segments):
+            return None
+        min_hours, best_percentage, best_fixed = self.segments[index]
+        position = bisect_right(min_hours, hours) - 1
+        if position < 0:
+            return None
+        candidates = [discount for discount in (best_percentage[position], best_fixed[position]) if discount]
+        return max(candidates, key=lambda discount: discount_amount(discount, price), default=None)
+    
+    def periods(self):
+        """Отрезки времени, на которых действует хотя бы одна скидка: [(start, end)]"""
+        return [(left, right) for left, right, (min_hours, _, _) in zip(self.bounds, self.bounds[1:], self.segments)
+                if min_hours]
+
+class DiscountIndex:
+    """Скомпилированные скидки консолей (пересобираются после записей в discounts)"""
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self._consoles = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        manager.add_write_listener(self._on_write)
+    
+    def _on_write(self, collection_name, doc_id):
+        """Любая запись в скидки сбрасывает скомпилированный индекс"""
+        if collection_name == 'discounts':
+            with self._lock:
+                self._consoles.clear()
+                self._generation += 1
+    
+    def get(self, console_id):
+        """Скомпилированные скидки консоли (активные, по индексу console_active_start)"""
+        console_id = str(console_id)
+        with self._lock:
+            compiled = self._consoles.get(console_id)
+            generation = self._generation
+        if compiled is None:
+            compiled = ConsoleDiscounts(self.manager.get_console_discounts(console_id).values())
+            with self._lock:
+                # Скидки успели измениться во время сборки - не кэшируем устаревший индекс
+                if generation == self._generation:
+                    self._consoles[console_id] = compiled
+        return compiled
+    
+    def best(self, console_id, at, hours, price):
+        """Лучшая скидка консоли для момента at, hours часов аренды и цены price"""
+        return self.get(console_id).best(at, hours, price)
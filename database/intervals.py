@@ -0,0 +1,253 @@
+"""
+Индекс интервалов активных аренд по консолям
+Декартово дерево по началу с максимумом концов в поддеревьях: обновления и поиск за O(log n)
+"""
+
+from datetime import datetime
+import random
+import threading
+
+# Поля аренды, из которых строится интервал
+# (аренды из бота пишут estimated_end_time, одобренные в панели - expected_end_time)
+INTERVAL_RENTAL_FIELDS = {'console_id': 1, 'status': 1, 'start_time': 1, 'estimated_end_time': 1,
+                          'expected_end_time': 1, 'end_time': 1}
+
+class _Node:
+    """Узел дерева: интервал, приоритет и максимум концов в поддереве"""
+    
+    __slots__ = ('key', 'priority', 'left', 'right', 'max_end')
+    
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_end = key[1]
+    
+    def update(self):
+        """Пересчитать максимум концов по детям (O(1))"""
+        self.max_end = self.key[1]
+        for child in (self.left, self.right):
+            if child is not None and child.max_end > self.max_end:
+                self.max_end = child.max_end
+
+def _split(node, key):
+    """Разделить дерево на ключи < key и >= key"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        node.update()
+        return node, right
+    left, node.left = _split(node.left, key)
+    node.update()
+    return left, node
+
+def _merge(left, right):
+    """Склеить деревья (все ключи left меньше ключей right)"""
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+def _delete(node, key):
+    """Удалить ключ из дерева"""
+    if node is None:
+        return None
+    if node.key == key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    else:
+        node.right = _delete(node.right, key)
+    node.update()
+    return node
+
+class ConsoleIntervals:
+    """
+    Интервалы [start, end) одной консоли: декартово дерево по началу с максимумом концов в узлах
+    
+    Добавление и удаление - O(log n), поиск пересечений - O(log n + k)
+    """
+    
+    def __init__(self, entries=None):
+        self.root = None
+        self._keys = {}
+        for start, end, rental_id in entries or []:
+            self.add(start, end, rental_id)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def add(self, start, end, rental_id):
+        """Добавить интервал аренды"""
+        self.remove(rental_id)
+        key = (start, end, rental_id)
+        self._keys[rental_id] = key
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key)), right)
+    
+    def remove(self, rental_id):
+        """Убрать интервал аренды"""
+        key = self._keys.pop(rental_id, None)
+        if key is None:
+            return
+        self.root = _delete(self.root, key)
+    
+    def _max_end_before(self, bound):
+        """Максимум концов интервалов, начинающихся раньше bound (None, если таких нет)"""
+        node, max_end = self.root, None
+        while node is not None:
+            if node.key[0] < bound:
+                # Узел и все левое поддерево начинаются раньше bound
+                for candidate in (node.key[1], node.left.max_end if node.left else None):
+                    if candidate is not None and (max_end is None or candidate > max_end):
+                        max_end = candidate
+                node = node.right
+            else:
+                node = node.left
+        return max_end
+    
+    def overlaps(self, start, end):
+        """Есть ли интервал, пересекающий [start, end)"""
+        max_end = self._max_end_before(end)
+        return max_end is not None and max_end > start
+    
+    def overlapping(self, start, end):
+        """Интервалы, пересекающие [start, end), по возрастанию начала"""
+        result = []
+        
+        def collect(node):
+            # Поддеревья, где все концы <= start, пересечений не содержат
+            if node is None or node.max_end <= start:
+                return
+            collect(node.left)
+            if node.key[0] < end:
+                if node.key[1] > start:
+                    result.append(node.key)
+                collect(node.right)
+        
+        collect(self.root)
+        return result
+    
+    def covering(self, instant):
+        """Интервал, содержащий момент instant (None, если момент свободен)"""
+        
+        def find(node):
+            # Ищем начинающийся позже всех: сначала правое поддерево
+            if node is None or node.max_end <= instant:
+                return None
+            if node.key[0] <= instant:
+                found = find(node.right)
+                if found:
+                    return found
+                if node.key[1] > instant:
+                    return node.key
+            return find(node.left)
+        
+        return find(self.root)
+    
+    def next_free(self, after, duration):
+        """Ближайшее начало >= after, с которого свободен промежуток duration"""
+        start = after
+        while True:
+            max_end = self._max_end_before(start + duration)
+            if max_end is None or max_end <= start:
+                return start
+            # Сдвигаемся за конец самого длинного мешающего интервала
+            start = max_end
+
+class RentalIntervalIndex:
+    """Интервалы активных аренд всех консолей (строятся лениво, обновляются по событиям записи)"""
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self._consoles = {}
+        self._rental_consoles = {}
+        self._lock = threading.Lock()
+        manager.add_write_listener(self._on_write)
+    
+    @staticmethod
+    def _parse_time(value):
+        """ISO-строка аренды в datetime (None, если не разобрать)"""
+        try:
+            return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return None
+    
+    def _interval(self, rental):
+        """Интервал [start, end) активной аренды или None"""
+        if not rental or rental.get('status') != 'active':
+            return None
+        start = self._parse_time(rental.get('start_time'))
+        end = self._parse_time(rental.get('estimated_end_time') or rental.get('expected_end_time') or
+                               rental.get('end_time'))
+        if not start:
+            return None
+        # Без времени окончания аренда занимает консоль бессрочно
+        return start, end if end and end > start else datetime.max
+    
+    def _load(self, console_id):
+        """Построить интервалы консоли одним запросом (индекс console_status)"""
+        rentals = self.manager.find_rentals({'console_id': console_id, 'status': 'active'},
+                                            projection=INTERVAL_RENTAL_FIELDS)
+        entries = []
+        for rental_id, rental in rentals.items():
+            interval = self._interval(rental)
+            if interval:
+                entries.append((interval[0], interval[1], rental_id))
+                self._rental_consoles[rental_id] = console_id
+        return ConsoleIntervals(entries)
+    
+    def get(self, console_id):
+        """Интервалы консоли"""
+        console_id = str(console_id)
+        with self._lock:
+            intervals = self._consoles.get(console_id)
+            if intervals is None:
+                intervals = self._consoles[console_id] = self._load(console_id)
+            return intervals
+    
+    def _on_write(self, collection_name, doc_id):
+        """Обновить интервалы одной аренды или сбросить индекс"""
+        if collection_name != 'rentals':
+            return
+        if doc_id is None:
+            with self._lock:
+                self._consoles.clear()
+                self._rental_consoles.clear()
+            return
+        
+        rental_id = str(doc_id)
+        rental = self.manager.db['rentals'].find_one({'_id': rental_id}, INTERVAL_RENTAL_FIELDS)
+        with self._lock:
+            previous_console = self._rental_consoles.pop(rental_id, None)
+            if previous_console in self._consoles:
+                self._consoles[previous_console].remove(rental_id)
+            
+            interval = self._interval(rental)
+            console_id = str(rental.get('console_id')) if rental else None
+            if interval and console_id in self._consoles:
+                self._consoles[console_id].add(interval[0], interval[1], rental_id)
+                self._rental_consoles[rental_id] = console_id
+    
+    def is_free(self, console_id, start, end):
+        """Свободна ли консоль в промежутке [start, end)"""
+        return not self.get(console_id).overlaps(start, end)
+    
+    def find_overlapping(self, console_id, start, end):
+        """Аренды консоли, пересекающие [start, end): [(start, end, rental_id)]"""
+        return self.get(console_id).overlapping(start, end)
+    
+    def find_covering(self, console_id, instant):
+        """Аренда консоли, идущая в момент instant: (start, end, rental_id) или None"""
+        return self.get(console_id).covering(instant)
+    
+    def next_free_slot(self, console_id, after, duration):
+        """Ближайшее время начала, с которого консоль свободна на duration"""
+        return self.get(console_id).next_free(after, duration)
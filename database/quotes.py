@@ -0,0 +1,101 @@
+"""
+Ценовые предложения для диалога аренды
+Матрица цен (часы x скидка консоли x льгота статуса) считается один раз и закрепляется по id
+"""
+
+from datetime import datetime, timedelta
+import uuid
+from pymongo.errors import DuplicateKeyError
+from .discounts import discount_amount
+
+# Предложение живет столько же, сколько временная резервация консоли
+QUOTE_TTL_MINUTES = 30
+
+class PriceQuotes:
+    """Закрепленные цены в коллекции price_quotes (истекшие удаляет TTL-индекс)"""
+    
+    def __init__(self, manager, ttl_minutes=QUOTE_TTL_MINUTES):
+        self.manager = manager
+        self.ttl_minutes = ttl_minutes
+    
+    @property
+    def collection(self):
+        """Коллекция предложений"""
+        return self.manager.db['price_quotes']
+    
+    def price_matrix(self, console, hours_options, start_time, status_discount_percent=0):
+        """Цены всех вариантов продолжительности: {часы: строка цены}"""
+        options = {}
+        for hours in hours_options:
+            original_cost = hours * console['rental_price']
+            discount = self.manager.discount_index.best(console['_id'], start_time, hours, original_cost)
+            console_discount = discount_amount(discount, original_cost) if discount else 0
+            
+            # Льгота статуса применяется к цене после скидки консоли
+            status_discount = (original_cost - console_discount) * status_discount_percent / 100
+            total_cost = max(0, round(original_cost - console_discount - status_discount))
+            options[str(hours)] = {
+                'hours': hours,
+                'original_cost': original_cost,
+                'discount_amount': round(console_discount),
+                'discount_id': discount.get('id') if discount else None,
+                'status_discount_amount': round(status_discount),
+                'total_cost': total_cost
+            }
+        return options
+    
+    def create(self, user_id, console, hours_options, start_date=None, benefits=None):
+        """
+        Посчитать и закрепить цены для консоли и даты начала
+        
+        Args:
+            start_date: Дата начала YYYY-MM-DD (None - аренда с текущего момента)
+            benefits: Льготы статуса пользователя (get_user_status_benefits)
+        
+        Returns:
+            dict: Предложение с _id для callback_data или None при ошибке
+        """
+        try:
+            now = datetime.now()
+            start_time = datetime.fromisoformat(start_date) if start_date else now
+            status_discount_percent = (benefits or {}).get('discount_percent', 0)
+            quote = {
+                'user_id': str(user_id),
+                'console_id': console['_id'],
+                'start_date': start_date,
+                'price_per_hour': console['rental_price'],
+                'status_discount_percent': status_discount_percent,
+                'options': self.price_matrix(console, hours_options, start_time, status_discount_percent),
+                'created_at': now.isoformat(),
+                'expires_at': datetime.utcnow() + timedelta(minutes=self.ttl_minutes)
+            }
+            # Короткий id помещается в 64 байта callback_data вместе с часами
+            for _ in range(3):
+                quote['_id'] = uuid.uuid4().hex[:12]
+                try:
+                    self.collection.insert_one(quote)
+                    return quote
+                except DuplicateKeyError:
+                    continue
+            return None
+        except Exception as e:
+            print(f"❌ Ошибка расчета цен для консоли {console.get('_id')}: {e}")
+            return None
+    
+    def get(self, quote_id, user_id):
+        """Действующее предложение пользователя (None, если истекло или чужое)"""
+        try:
+            return self.collection.find_one({
+                '_id': str(quote_id),
+                'user_id': str(user_id),
+                'expires_at': {'$gt': datetime.utcnow()}
+            })
+        except Exception as e:
+            print(f"❌ Ошибка получения предложения {quote_id}: {e}")
+            return None
+    
+    def get_option(self, quote_id, user_id, hours):
+        """Предложение и строка цены выбранной продолжительности: (quote, option) или (None, None)"""
+        quote = self.get(quote_id, user_id)
+        option = quote['options'].get(str(hours)) if quote else None
+        return (quote, option) if option else (None, None)
@@ -0,0 +1,144 @@
+"""
+Агрегаты выручки и загрузки консолей по часам и дням
+Обновляются $inc при каждом изменении завершенной аренды, графики читают готовые корзины
+"""
+
+from pymongo import UpdateOne, ASCENDING
+from datetime import datetime, timedelta
+
+# Гранулярность -> длина ключа корзины в ISO-строке (YYYY-MM-DDTHH / YYYY-MM-DD)
+GRANULARITIES = {'hour': 13, 'day': 10}
+
+# Аренды, которые попадают в агрегаты (как и выручка в счетчиках панели)
+ROLLUP_STATUSES = ('completed', 'returned')
+
+# Поля аренды, от которых зависят агрегаты
+ROLLUP_RENTAL_FIELDS = {'status': 1, 'total_cost': 1, 'start_time': 1, 'end_time': 1, 'console_id': 1}
+
+class RentalRollups:
+    """Часовые и дневные корзины по консолям: rented_hours, revenue, rentals"""
+    
+    def __init__(self, manager, collection_name='rental_rollups'):
+        self.manager = manager
+        self.collection_name = collection_name
+    
+    @property
+    def collection(self):
+        """Коллекция корзин"""
+        return self.manager.db[self.collection_name]
+    
+    @staticmethod
+    def _parse_time(value):
+        """ISO-строка аренды в datetime (None, если не разобрать)"""
+        try:
+            return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return None
+    
+    def contribution(self, rental):
+        """Вклад аренды в корзины: {(гранулярность, консоль, корзина): {поле: значение}}"""
+        if not rental or rental.get('status') not in ROLLUP_STATUSES:
+            return {}
+        start = self._parse_time(rental.get('start_time'))
+        end = self._parse_time(rental.get('end_time'))
+        if not start or not end or end < start:
+            return {}
+        
+        console_id = str(rental.get('console_id'))
+        buckets = {}
+        
+        def add(bucket_time, field, value):
+            for granularity, length in GRANULARITIES.items():
+                key = (granularity, console_id, bucket_time.isoformat()[:length])
+                bucket = buckets.setdefault(key, {})
+                bucket[field] = bucket.get(field, 0) + value
+        
+        # Часы аренды раскладываем по часовым корзинам пропорционально пересечению
+        hour = start.replace(minute=0, second=0, microsecond=0)
+        while hour < end:
+            next_hour = hour + timedelta(hours=1)
+            overlap = (min(end, next_hour) - max(start, hour)).total_seconds() / 3600
+            if overlap > 0:
+                add(hour, 'rented_hours', overlap)
+            hour = next_hour
+        
+        # Выручка и число аренд - в корзину завершения
+        add(end, 'rentals', 1)
+        if rental.get('total_cost'):
+            add(end, 'revenue', rental['total_cost'])
+        return buckets
+    
+    def apply_change(self, previous, current):
+        """Сдвинуть корзины на разницу вкладов аренды до и после записи"""
+        try:
+            delta = self.contribution(current)
+            for key, fields in self.contribution(previous).items():
+                bucket = delta.setdefault(key, {})
+                for field, value in fields.items():
+                    bucket[field] = bucket.get(field, 0) - value
+            
+            operations = []
+            for (granularity, console_id, bucket), fields in delta.items():
+                fields = {field: value for field, value in fields.items() if value}
+                if fields:
+                    operations.append(self._inc_operation(granularity, console_id, bucket, fields))
+            if operations:
+                self.collection.bulk_write(operations, ordered=False)
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка обновления агрегатов аренд: {e}")
+            return 0
+    
+    @staticmethod
+    def _inc_operation(granularity, console_id, bucket, fields):
+        """$inc корзины с созданием при первом обращении"""
+        return UpdateOne(
+            {'_id': f"{granularity}:{console_id}:{bucket}"},
+            {
+                '$inc': fields,
+                '$setOnInsert': {'granularity': granularity, 'console_id': console_id, 'bucket': bucket}
+            },
+            upsert=True
+        )
+    
+    def rebuild(self, batch_size=500):
+        """Пересобрать все корзины одним проходом по завершенным арендам"""
+        try:
+            totals = {}
+            rentals = self.manager.iter_rentals({'status': {'$in': list(ROLLUP_STATUSES)}},
+                                                projection=ROLLUP_RENTAL_FIELDS, batch_size=batch_size)
+            for rental in rentals:
+                for key, fields in self.contribution(rental).items():
+                    bucket = totals.setdefault(key, {})
+                    for field, value in fields.items():
+                        bucket[field] = bucket.get(field, 0) + value
+            
+            self.collection.delete_many({})
+            operations = [self._inc_operation(granularity, console_id, bucket, fields)
+                          for (granularity, console_id, bucket), fields in totals.items()]
+            for start in range(0, len(operations), batch_size):
+                self.collection.bulk_write(operations[start:start + batch_size], ordered=False)
+            return len(operations)
+        except Exception as e:
+            print(f"❌ Ошибка пересборки агрегатов аренд: {e}")
+            return 0
+    
+    def query(self, granularity='day', date_from=None, date_to=None, console_id=None):
+        """Корзины за период по возрастанию времени (индекс granularity_bucket)"""
+        try:
+            query = {'granularity': granularity}
+            if date_from or date_to:
+                query['bucket'] = {}
+                if date_from:
+                    query['bucket']['$gte'] = date_from[:GRANULARITIES[granularity]]
+                if date_to:
+                    # День для часовых корзин: '~' больше любого символа часа 'THH'
+                    length = GRANULARITIES[granularity]
+                    query['bucket']['$lte'] = date_to[:length] if len(date_to) >= length else f"{date_to}~"
+            if console_id:
+                query['console_id'] = str(console_id)
+            cursor = self.collection.find(query, {'_id': 0}).sort([('bucket', ASCENDING), ('console_id', ASCENDING)])
+            return list(cursor)
+        except Exception as e:
+            print(f"❌ Ошибка чтения агрегатов аренд: {e}")
+            return []
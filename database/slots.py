@@ -0,0 +1,157 @@
+"""
+Почасовая занятость консолей для резерваций календаря
+Каждый день консоли хранится одной 24-битной маской: пересечения и свободные слоты - битовые операции
+"""
+
+from datetime import date, timedelta
+from pymongo.errors import DuplicateKeyError
+
+HOURS_PER_DAY = 24
+FULL_DAY = (1 << HOURS_PER_DAY) - 1
+
+# Резервации, занимающие часы консоли
+SLOT_STATUSES = ('reserved',)
+
+def slot_hour(time_slot):
+    """Час начала слота 'HH:MM' (минуты отбрасываются - занятость почасовая)"""
+    return int(str(time_slot).split(':')[0])
+
+def hours_mask(start_hour, duration_hours):
+    """Маска duration_hours часов начиная с start_hour (может выходить за сутки)"""
+    return ((1 << max(1, int(duration_hours))) - 1) << start_hour
+
+def longest_free_run(mask):
+    """Самый длинный свободный промежуток дня: (часов, час начала)"""
+    free = ~mask & FULL_DAY
+    length, starts = 0, 0
+    # После k шагов free & (free >> 1) остаются начала свободных отрезков длиной > k
+    while free:
+        starts = free
+        free &= free >> 1
+        length += 1
+    if not length:
+        return 0, None
+    return length, (starts & -starts).bit_length() - 1
+
+class ReservationSlots:
+    """Маски занятых часов по (консоль, дата) в коллекции calendar_slots"""
+    
+    def __init__(self, manager, collection_name='calendar_slots'):
+        self.manager = manager
+        self.collection_name = collection_name
+    
+    @property
+    def collection(self):
+        """Коллекция масок"""
+        return self.manager.db[self.collection_name]
+    
+    @staticmethod
+    def _key(console_id, date_str):
+        """_id маски дня консоли"""
+        return f"{console_id}_{date_str}"
+    
+    @staticmethod
+    def day_masks(date_str, time_slot, duration_hours):
+        """Часы резервации по дням: {YYYY-MM-DD: маска} (переход через полночь - на следующие дни)"""
+        mask = hours_mask(slot_hour(time_slot), duration_hours)
+        day = date.fromisoformat(date_str)
+        masks = {}
+        while mask:
+            if mask & FULL_DAY:
+                masks[day.isoformat()] = mask & FULL_DAY
+            mask >>= HOURS_PER_DAY
+            day += timedelta(days=1)
+        return masks
+    
+    def get_masks(self, console_id, date_str, days=1):
+        """Маски days дней начиная с date_str, склеенные в одно число (день i - биты 24*i..24*i+23)"""
+        start = date.fromisoformat(date_str)
+        keys = [self._key(console_id, (start + timedelta(days=i)).isoformat()) for i in range(days)]
+        masks = {doc['_id']: doc.get('mask', 0) for doc in self.collection.find({'_id': {'$in': keys}}, {'mask': 1})}
+        combined = 0
+        for i, key in enumerate(keys):
+            combined |= masks.get(key, 0) << (HOURS_PER_DAY * i)
+        return combined
+    
+    def get_mask(self, console_id, date_str):
+        """Маска занятых часов дня"""
+        return self.get_masks(console_id, date_str)
+    
+    def is_free(self, console_id, date_str, time_slot, duration_hours=1):
+        """Свободны ли все часы резервации"""
+        start_hour = slot_hour(time_slot)
+        mask = hours_mask(start_hour, duration_hours)
+        days = (start_hour + max(1, int(duration_hours)) - 1) // HOURS_PER_DAY + 1
+        return not self.get_masks(console_id, date_str, days) & mask
+    
+    def free_slots(self, console_id, date_str, time_slots, duration_hours=1):
+        """Слоты дня, с которых можно занять duration_hours часов подряд"""
+        duration = max(1, int(duration_hours))
+        days = (HOURS_PER_DAY - 1 + duration - 1) // HOURS_PER_DAY + 1
+        occupied = self.get_masks(console_id, date_str, days)
+        
+        # Бит h в blocked - с часа h хотя бы один из duration часов занят
+        blocked = 0
+        for shift in range(duration):
+            blocked |= occupied >> shift
+        return [slot for slot in time_slots if not (blocked >> slot_hour(slot)) & 1]
+    
+    def longest_free(self, console_id, date_str):
+        """Самый длинный свободный промежуток дня консоли: (часов, час начала)"""
+        return longest_free_run(self.get_mask(console_id, date_str))
+    
+    def claim(self, console_id, date_str, time_slot, duration_hours=1, status='reserved'):
+        """Атомарно занять часы резервации (False, если хотя бы один час уже занят)"""
+        # Резервации других статусов часы не занимают - как в release и rebuild
+        if status not in SLOT_STATUSES:
+            return True
+        claimed = []
+        for day_str, mask in self.day_masks(date_str, time_slot, duration_hours).items():
+            key = self._key(console_id, day_str)
+            try:
+                # Документ обновляется, только если все биты свободны, иначе upsert упирается в _id
+                self.collection.update_one(
+                    {'_id': key, 'mask': {'$bitsAllClear': mask}},
+                    {'$bit': {'mask': {'or': mask}},
+                     '$setOnInsert': {'console_id': console_id, 'date': day_str}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                for claimed_key, claimed_mask in claimed:
+                    self._clear(claimed_key, claimed_mask)
+                return False
+            claimed.append((key, mask))
+        return True
+    
+    def release(self, reservation):
+        """Освободить часы резервации"""
+        if not reservation or reservation.get('status') not in SLOT_STATUSES or not reservation.get('time_slot'):
+            return
+        for day_str, mask in self.day_masks(reservation['date'], reservation['time_slot'],
+                                            reservation.get('duration_hours', 1)).items():
+            self._clear(self._key(reservation['console_id'], day_str), mask)
+    
+    def _clear(self, key, mask):
+        """Снять биты маски дня"""
+        self.collection.update_one({'_id': key}, {'$bit': {'mask': {'and': ~mask & FULL_DAY}}})
+    
+    def rebuild(self):
+        """Пересобрать маски из всех резерваций"""
+        try:
+            masks = {}
+            query = {'status': {'$in': list(SLOT_STATUSES)}, 'time_slot': {'$ne': None}}
+            for reservation in self.manager.db['calendar_reservations'].find(query):
+                for day_str, mask in self.day_masks(reservation['date'], reservation['time_slot'],
+                                                    reservation.get('duration_hours', 1)).items():
+                    key = (reservation['console_id'], day_str)
+                    masks[key] = masks.get(key, 0) | mask
+            
+            self.collection.delete_many({})
+            documents = [{'_id': self._key(console_id, day_str), 'console_id': console_id, 'date': day_str, 'mask': mask}
+                         for (console_id, day_str), mask in masks.items()]
+            if documents:
+                self.collection.insert_many(documents, ordered=False)
+            return len(documents)
+        except Exception as e:
+            print(f"❌ Ошибка пересборки почасовой занятости: {e}")
+            return 0
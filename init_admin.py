@@ -67,6 +67,13 @@ def init_data_files():
                 print(f"✓ Коллекция {collection_name} уже содержит данные")
         except Exception as e:
             print(f"⚠️ Ошибка инициализации коллекции {collection_name}: {e}")
+    
+    # Создаем индексы для фильтров по консоли, пользователю и статусу
+    db.cleanup_legacy_temp_reservations()
+    db.ensure_indexes()
+    db.migrate_calendar_document()
+    db.migrate_rating_transactions()
+    print("📇 Индексы проверены")
 
 def init_passport_dir():
     """Создает папку для документов"""
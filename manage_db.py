@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Служебные команды для обслуживания базы данных
+
+Примеры:
+    python manage_db.py indexes report
+    python manage_db.py indexes apply
+    python manage_db.py calendar migrate
+    python manage_db.py calendar rebuild-slots
+    python manage_db.py ratings rebuild
+    python manage_db.py ratings migrate-transactions
+    python manage_db.py ratings rebuild-windows
+    python manage_db.py ratings rebuild-leaderboard
+    python manage_db.py stats reconcile
+    python manage_db.py stats rebuild-rollups
+"""
+
+import argparse
+import sys
+from database import get_db_manager
+
+def format_size(size):
+    """Размер в читаемом виде"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def cmd_indexes_report(db, args):
+    """Показать индексы, их размеры и использование"""
+    report = db.get_index_report()
+    
+    for collection_name, info in report.items():
+        print(f"📦 {collection_name}")
+        for name, index in info['indexes'].items():
+            keys = ', '.join(f"{field}:{direction}" for field, direction in index['keys'])
+            print(f"   • {name} ({keys}) — {format_size(index['size'])}, обращений: {index['ops']}")
+        for name in info['missing']:
+            print(f"   ❌ Отсутствует индекс: {name}")
+        for name in info['unused']:
+            print(f"   ⚠️ Не используется: {name}")
+    
+    return 0
+
+def cmd_indexes_apply(db, args):
+    """Создать недостающие индексы"""
+    created = db.ensure_indexes()
+    for collection_name, names in created.items():
+        print(f"✅ {collection_name}: {', '.join(names)}")
+    return 0
+
+def cmd_calendar_migrate(db, args):
+    """Перенести резервации, блокировки и праздники в отдельные коллекции"""
+    migrated = db.migrate_calendar_document()
+    db.ensure_indexes()
+    print(f"✅ Перенесено записей: {migrated}")
+    return 0
+
+def cmd_calendar_rebuild_slots(db, args):
+    """Пересобрать почасовые маски занятости из резерваций"""
+    rebuilt = db.slots.rebuild()
+    print(f"✅ Дней с резервациями: {rebuilt}")
+    return 0
+
+def cmd_ratings_rebuild(db, args):
+    """Пересобрать сводки рейтинга пользователей"""
+    rebuilt = db.rebuild_rating_summaries()
+    print(f"✅ Сводок рейтинга: {rebuilt}")
+    return 0
+
+def cmd_ratings_migrate_transactions(db, args):
+    """Перенести транзакции рейтинга в журнал rating_transactions"""
+    db.ensure_indexes()
+    migrated = db.migrate_rating_transactions()
+    print(f"✅ Перенесено транзакций: {migrated}")
+    return 0
+
+def cmd_ratings_rebuild_windows(db, args):
+    """Пересобрать окна дисциплины по журналу транзакций"""
+    from rating_system import get_rating_engine
+    rebuilt = get_rating_engine().rebuild_windows()
+    print(f"✅ Окон дисциплины: {rebuilt}")
+    return 0
+
+def cmd_ratings_rebuild_leaderboard(db, args):
+    """Пересобрать лидерборд и счетчики статусов"""
+    from rating_system import get_rating_engine
+    rebuilt = get_rating_engine().rebuild_leaderboard()
+    print(f"✅ Записей лидерборда: {rebuilt}")
+    return 0
+
+def cmd_stats_reconcile(db, args):
+    """Пересчитать счетчики панели (для запуска по расписанию)"""
+    stats = db.reconcile_dashboard_stats()
+    if stats is None:
+        return 1
+    print(f"✅ Пользователей: {stats['users_count']}, консолей: {stats['consoles_count']}, "
+          f"выручка: {stats['revenue_total']} лей")
+    return 0
+
+def cmd_stats_rebuild_rollups(db, args):
+    """Пересобрать часовые и дневные агрегаты аренд"""
+    rebuilt = db.rollups.rebuild()
+    print(f"✅ Корзин агрегатов: {rebuilt}")
+    return 0
+
+def build_parser():
+    """Парсер аргументов командной строки"""
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных системы аренды')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    indexes_parser = subparsers.add_parser('indexes', help='Управление индексами')
+    indexes_subparsers = indexes_parser.add_subparsers(dest='action', required=True)
+    indexes_subparsers.add_parser('report', help='Отчет по индексам').set_defaults(handler=cmd_indexes_report)
+    indexes_subparsers.add_parser('apply', help='Создать недостающие индексы').set_defaults(handler=cmd_indexes_apply)
+    
+    calendar_parser = subparsers.add_parser('calendar', help='Данные календаря')
+    calendar_subparsers = calendar_parser.add_subparsers(dest='action', required=True)
+    calendar_subparsers.add_parser('migrate', help='Разделить документ календаря на коллекции').set_defaults(handler=cmd_calendar_migrate)
+    calendar_subparsers.add_parser('rebuild-slots',
+                                   help='Пересобрать почасовую занятость').set_defaults(handler=cmd_calendar_rebuild_slots)
+    
+    ratings_parser = subparsers.add_parser('ratings', help='Рейтинги пользователей')
+    ratings_subparsers = ratings_parser.add_subparsers(dest='action', required=True)
+    ratings_subparsers.add_parser('rebuild', help='Пересобрать сводки рейтинга').set_defaults(handler=cmd_ratings_rebuild)
+    ratings_subparsers.add_parser('migrate-transactions',
+                                  help='Перенести транзакции в журнал').set_defaults(handler=cmd_ratings_migrate_transactions)
+    ratings_subparsers.add_parser('rebuild-windows',
+                                  help='Пересобрать окна дисциплины').set_defaults(handler=cmd_ratings_rebuild_windows)
+    ratings_subparsers.add_parser('rebuild-leaderboard',
+                                  help='Пересобрать лидерборд').set_defaults(handler=cmd_ratings_rebuild_leaderboard)
+    
+    stats_parser = subparsers.add_parser('stats', help='Счетчики панели')
+    stats_subparsers = stats_parser.add_subparsers(dest='action', required=True)
+    stats_subparsers.add_parser('reconcile', help='Пересчитать счетчики с нуля').set_defaults(handler=cmd_stats_reconcile)
+    stats_subparsers.add_parser('rebuild-rollups',
+                                help='Пересобрать агрегаты аренд').set_defaults(handler=cmd_stats_rebuild_rollups)
+    
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    
+    db = get_db_manager()
+    if db.db is None:
+        print("❌ Нет подключения к MongoDB")
+        return 1
+    
+    return args.handler(db, args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Симулятор настроек рейтинга ("что если")
+Все транзакции загружаются в массивы NumPy один раз, кандидатные настройки считаются векторно
+"""
+
+from datetime import datetime
+import threading
+import time
+import numpy as np
+from rating_system import (
+    get_rating_engine, calculate_transaction_discipline, calculate_loyalty_score, LOYALTY_USER_FIELDS
+)
+
+# Снимок данных пересобирается не чаще раза в минуту (и сразу после смены настроек или новых транзакций;
+# новые пользователи и аренды попадают в снимок по истечении TTL)
+SNAPSHOT_TTL_SECONDS = 60
+
+STATUSES = ['premium', 'regular', 'risk']
+
+# Корзины гистограммы итогового балла: 0-9, 10-19, ..., 90-100
+SCORE_BINS = list(range(0, 100, 10)) + [101]
+
+rating_simulator = None
+
+
+class RatingSimulator:
+    """Векторный пересчет рейтингов всех пользователей для кандидатных настроек"""
+    
+    def __init__(self, engine, ttl_seconds=SNAPSHOT_TTL_SECONDS):
+        self.engine = engine
+        self.ttl_seconds = ttl_seconds
+        self._snapshot = None
+        self._lock = threading.Lock()
+        engine.db.add_write_listener(self._on_write)
+    
+    def _on_write(self, collection_name, doc_id):
+        """Снимок устаревает при записи настроек рейтинга и транзакций"""
+        if collection_name == 'rating_transactions' or (collection_name == 'ratings' and doc_id in (None, 'settings')):
+            self._snapshot = None
+    
+    def _load_snapshot(self):
+        """Загрузить пользователей и транзакции в массивы"""
+        settings = self.engine.get_settings()
+        transactions = self.engine.get_all_transactions()
+        rental_counts = self.engine.get_rental_counts()
+        
+        users = list(self.engine.db.iter_users(projection=LOYALTY_USER_FIELDS))
+        user_transactions = [transactions.get(str(user['_id']), []) for user in users]
+        max_length = max([len(items) for items in user_transactions] + [1])
+        
+        # Транзакции выравниваются вправо: последний столбец - самая свежая транзакция
+        mask = np.zeros((len(users), max_length), dtype=bool)
+        for row, items in enumerate(user_transactions):
+            mask[row, max_length - len(items):] = len(items) > 0
+        
+        return {
+            'settings': settings,
+            'users': users,
+            'transactions': user_transactions,
+            'rental_counts': rental_counts,
+            'mask': mask,
+            'discipline_scores': self._transaction_scores(user_transactions, max_length, settings),
+            'loyalty': self._loyalty_scores(users, rental_counts, settings),
+            'loaded_at': time.monotonic()
+        }
+    
+    @staticmethod
+    def _transaction_scores(user_transactions, max_length, settings):
+        """Матрица баллов дисциплины транзакций (пользователи x транзакции)"""
+        scores = np.zeros((len(user_transactions), max_length), dtype=np.float64)
+        for row, items in enumerate(user_transactions):
+            offset = max_length - len(items)
+            for column, transaction in enumerate(items):
+                scores[row, offset + column] = calculate_transaction_discipline(transaction, settings)
+        return scores
+    
+    @staticmethod
+    def _loyalty_scores(users, rental_counts, settings):
+        """Вектор лояльности пользователей"""
+        return np.array([
+            calculate_loyalty_score(user, rental_counts.get(str(user['_id']), 0), settings)
+            for user in users
+        ], dtype=np.float64)
+    
+    def get_snapshot(self):
+        """Актуальный снимок данных (пересобирается по TTL или после записей)"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - snapshot['loaded_at'] > self.ttl_seconds:
+                snapshot = self._load_snapshot()
+                self._snapshot = snapshot
+            return snapshot
+    
+    @staticmethod
+    def _final_scores(discipline_scores, mask, loyalty, settings):
+        """Итоговые баллы всех пользователей для набора настроек"""
+        window = max(1, int(settings.get('transactions_window', 5)))
+        
+        # Последние N транзакций - последние N столбцов
+        window_scores = discipline_scores[:, -window:]
+        window_mask = mask[:, -window:]
+        counts = window_mask.sum(axis=1)
+        sums = np.where(window_mask, window_scores, 0).sum(axis=1)
+        discipline = np.where(counts > 0, np.round(sums / np.maximum(counts, 1)), 50)
+        
+        final = np.round(discipline * settings.get('discipline_weight', 0.6) +
+                         loyalty * settings.get('loyalty_weight', 0.4))
+        return np.clip(final, 0, 100)
+    
+    @staticmethod
+    def _statuses(final_scores, settings):
+        """Индексы статусов в STATUSES для каждого пользователя"""
+        thresholds = settings.get('status_thresholds', {})
+        return np.where(final_scores >= thresholds.get('premium', 80), 0,
+                        np.where(final_scores >= thresholds.get('regular', 50), 1, 2))
+    
+    def simulate(self, candidate):
+        """
+        Сравнить текущие настройки с кандидатными
+        
+        Args:
+            candidate: Изменяемые настройки (discipline_weight, loyalty_weight,
+                transactions_window, status_thresholds, discipline_rules, loyalty_rules)
+        
+        Returns:
+            dict: Распределение баллов, количество по статусам и переходы между статусами
+        """
+        started = time.perf_counter()
+        snapshot = self.get_snapshot()
+        current = snapshot['settings']
+        proposed = dict(current)
+        proposed.update(candidate or {})
+        
+        # Правила меняют баллы отдельных транзакций - их пересчитываем без векторизации
+        discipline_scores = snapshot['discipline_scores']
+        if proposed.get('discipline_rules') != current.get('discipline_rules'):
+            discipline_scores = self._transaction_scores(snapshot['transactions'], snapshot['mask'].shape[1], proposed)
+        loyalty = snapshot['loyalty']
+        if proposed.get('loyalty_rules') != current.get('loyalty_rules'):
+            loyalty = self._loyalty_scores(snapshot['users'], snapshot['rental_counts'], proposed)
+        
+        current_scores = self._final_scores(snapshot['discipline_scores'], snapshot['mask'], snapshot['loyalty'], current)
+        proposed_scores = self._final_scores(discipline_scores, snapshot['mask'], loyalty, proposed)
+        current_statuses = self._statuses(current_scores, current)
+        proposed_statuses = self._statuses(proposed_scores, proposed)
+        
+        # Матрица переходов статусов: строки - текущий статус, столбцы - новый
+        migration = np.zeros((len(STATUSES), len(STATUSES)), dtype=np.int64)
+        np.add.at(migration, (current_statuses, proposed_statuses), 1)
+        
+        return {
+            'users_count': len(snapshot['users']),
+            'current': self._summary(current_scores, current_statuses),
+            'proposed': self._summary(proposed_scores, proposed_statuses),
+            'migration': {
+                STATUSES[i]: {STATUSES[j]: int(migration[i, j]) for j in range(len(STATUSES))}
+                for i in range(len(STATUSES))
+            },
+            'changed_users': int((current_statuses != proposed_statuses).sum()),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+            'calculated_at': datetime.now().isoformat()
+        }
+    
+    @staticmethod
+    def _summary(final_scores, statuses):
+        """Статистика распределения баллов"""
+        histogram, _ = np.histogram(final_scores, bins=SCORE_BINS)
+        return {
+            'statuses': {status: int((statuses == i).sum()) for i, status in enumerate(STATUSES)},
+            'histogram': {f"{SCORE_BINS[i]}-{min(SCORE_BINS[i + 1] - 1, 100)}": int(count)
+                          for i, count in enumerate(histogram)},
+            'average': round(float(final_scores.mean()), 1) if final_scores.size else 0,
+            'median': float(np.median(final_scores)) if final_scores.size else 0
+        }
+
+
+def get_rating_simulator():
+    """Получить общий экземпляр симулятора"""
+    global rating_simulator
+    if rating_simulator is None:
+        rating_simulator = RatingSimulator(get_rating_engine())
+    return rating_simulator
@@ -3,8 +3,439 @@
 Работает с MongoDB
 """
 
+from collections import deque
 from datetime import datetime
-from database import get_db_manager
+import json
+import threading
+from database import get_db_manager, ReadThroughCache
+
+# Итоговый рейтинг (дисциплина + лояльность) пересчитывается не чаще раза в минуту,
+# а при новых транзакциях или изменении пользователя сбрасывается сразу
+RATING_CACHE_TTL_SECONDS = 60
+RATING_CACHE_MAX_ENTRIES = 2048
+
+# Лояльность зависит от стажа, поэтому фоновая сверка пересчитывает лидерборд с нуля не реже раза в час
+# (переход через пороги 180 и 365 дней не сопровождается никакой записью)
+LEADERBOARD_RECONCILE_SECONDS = 3600
+# Как часто фоновая сверка проверяет возраст лидерборда (одно чтение счетчиков)
+LEADERBOARD_CHECK_SECONDS = 60
+
+STATUS_NAMES = {
+    'premium': 'Premium ⭐',
+    'regular': 'Обычный 👤',
+    'risk': 'Риск ⚠️'
+}
+
+STATUS_BENEFITS = {
+    'premium': {
+        'discount_percent': 10,
+        'deposit_multiplier': 0.8,
+        'priority_support': True,
+        'advance_booking_days': 45
+    },
+    'regular': {
+        'discount_percent': 0,
+        'deposit_multiplier': 1.0,
+        'priority_support': False,
+        'advance_booking_days': 30
+    },
+    'risk': {
+        'discount_percent': 0,
+        'deposit_multiplier': 1.5,
+        'priority_support': False,
+        'advance_booking_days': 7
+    }
+}
+
+# Поля пользователя, от которых зависит лояльность
+LOYALTY_USER_FIELDS = {'joined_at': 1, 'loyalty_bonus': 1, 'promotion_participation': 1}
+
+# Поля пользователя, которые хранятся в лидерборде для вывода
+LEADERBOARD_USER_FIELDS = {'first_name': 1, 'username': 1, 'full_name': 1}
+
+rating_engine = None
+
+
+def calculate_discipline_score(transactions, settings):
+    """
+    Рассчитать дисциплину на основе последних транзакций
+    
+    Args:
+        transactions: Транзакции пользователя (в порядке добавления)
+        settings: Настройки рейтинговой системы
+    
+    Returns:
+        int: Дисциплина от 0 до 100
+    """
+    if not transactions:
+        return 50  # Базовый рейтинг для новых клиентов
+    
+    window = settings.get('transactions_window', 5)
+    
+    # Берем последние N транзакций
+    scores = [calculate_transaction_discipline(transaction, settings) for transaction in transactions[-window:]]
+    
+    # Возвращаем среднее значение
+    return round(sum(scores) / len(scores))
+
+
+def calculate_transaction_discipline(transaction, settings):
+    """Балл дисциплины одной транзакции (0-100)"""
+    discipline_rules = settings.get('discipline_rules', {})
+    score = 100  # Базовый балл
+    score += discipline_rules.get('return_timing', {}).get(transaction.get('return_timing', 'on_time'), 0)
+    score += discipline_rules.get('item_condition', {}).get(transaction.get('item_condition', 'perfect'), 0)
+    score += discipline_rules.get('rule_compliance', {}).get(transaction.get('rule_compliance', 'no_violations'), 0)
+    
+    # Ограничиваем диапазон 0-100
+    return max(0, min(100, score))
+
+
+def calculate_loyalty_score(user_data, rental_count, settings):
+    """
+    Рассчитать лояльность клиента
+    
+    Args:
+        user_data: Документ пользователя
+        rental_count: Количество аренд пользователя
+        settings: Настройки рейтинговой системы
+    
+    Returns:
+        int: Лояльность от 0 до 100
+    """
+    loyalty_rules = settings.get('loyalty_rules', {})
+    score = 0
+    
+    # Повторные аренды
+    repeat_rules = loyalty_rules.get('repeat_rentals', {})
+    score += min(rental_count * repeat_rules.get('bonus_per_rental', 5), repeat_rules.get('max_bonus', 30))
+    
+    # Участие в акциях (из профиля пользователя)
+    if user_data.get('promotion_participation', False):
+        score += loyalty_rules.get('promotion_participation', 10)
+    
+    # Срок сотрудничества
+    if user_data.get('joined_at'):
+        tenure_days = (datetime.now() - datetime.fromisoformat(user_data['joined_at'])).days
+        if tenure_days >= 365:  # 12+ месяцев
+            score += loyalty_rules.get('tenure_bonus', {}).get('12_months', 20)
+        elif tenure_days >= 180:  # 6+ месяцев
+            score += loyalty_rules.get('tenure_bonus', {}).get('6_months', 10)
+    
+    # Дополнительные бонусы из профиля
+    score += user_data.get('loyalty_bonus', 0)
+    
+    # Ограничиваем диапазон 0-100
+    return max(0, min(100, score))
+
+
+def calculate_final_rating(user_id, user_data, discipline, rental_count, settings):
+    """
+    Итоговый рейтинг клиента из дисциплины и лояльности
+    
+    Args:
+        discipline: Дисциплина (calculate_discipline_score или окно дисциплины)
+    
+    Returns:
+        dict: final_score, discipline, loyalty, status, status_name
+    """
+    loyalty = calculate_loyalty_score(user_data, rental_count, settings)
+    
+    final_score = round(discipline * settings.get('discipline_weight', 0.6) +
+                        loyalty * settings.get('loyalty_weight', 0.4))
+    final_score = max(0, min(100, final_score))
+    
+    # Определяем статус
+    thresholds = settings.get('status_thresholds', {})
+    if final_score >= thresholds.get('premium', 80):
+        status = 'premium'
+    elif final_score >= thresholds.get('regular', 50):
+        status = 'regular'
+    else:
+        status = 'risk'
+    
+    return {
+        'user_id': user_id,
+        'final_score': final_score,
+        'discipline': discipline,
+        'loyalty': loyalty,
+        'status': status,
+        'status_name': STATUS_NAMES[status],
+        'calculated_at': datetime.now().isoformat()
+    }
+
+
+def get_status_benefits(status):
+    """Получить льготы по статусу"""
+    return dict(STATUS_BENEFITS.get(status, STATUS_BENEFITS['regular']))
+
+
+class RatingEngine:
+    """Расчет итогового рейтинга с кэшем настроек и результатов по пользователям"""
+    
+    def __init__(self, db, ttl_seconds=RATING_CACHE_TTL_SECONDS, max_entries=RATING_CACHE_MAX_ENTRIES):
+        self.db = db
+        self.cache = ReadThroughCache(ttl_seconds, max_entries)
+        self._reconcile_thread = None
+        self._stop = threading.Event()
+        db.add_write_listener(self._on_write)
+        # Лидерборд обновляет процесс, который записал аренду, остальные только сбрасывают кэш
+        db.add_write_listener(self._on_local_write, local_only=True)
+    
+    def _load_ratings_document(self, doc_id, projection=None):
+        """Служебный документ коллекции ratings (settings, transactions, user_ratings)"""
+        doc = self.db.db['ratings'].find_one({'_id': doc_id}, projection) or {}
+        doc.pop('_id', None)
+        return doc
+    
+    def get_settings(self):
+        """Настройки рейтинговой системы (кэшируются)"""
+        return self.cache.get('settings', 'settings', lambda: self._load_ratings_document('settings'))
+    
+    def get_transactions(self, user_id, limit=None):
+        """Транзакции рейтинга одного пользователя (limit - только последние N)"""
+        return self.db.get_rating_transactions(user_id, limit)
+    
+    def record_transactions(self, transactions):
+        """Дописать транзакции в журнал и сдвинуть окна дисциплины пользователей"""
+        inserted = self.db.add_rating_transactions(transactions)
+        if not inserted:
+            return 0
+        
+        settings = self.get_settings()
+        window_size, rules_key = self._window_params(settings)
+        events = {}
+        for transaction in transactions:
+            events.setdefault(transaction['user_id'], []).append(self._discipline_event(transaction, settings))
+        
+        for user_id, user_events in events.items():
+            # Окна нет или оно для других настроек - строим по последним транзакциям журнала
+            if not self.db.push_discipline_events(user_id, user_events, window_size, rules_key):
+                self._rebuild_window(user_id, settings)
+        
+        self.refresh_ratings(events.keys())
+        return inserted
+    
+    def record_transaction(self, transaction):
+        """Дописать одну транзакцию"""
+        return self.record_transactions([transaction]) == 1
+    
+    @staticmethod
+    def _window_params(settings):
+        """Размер окна и ключ правил, для которых посчитаны баллы событий"""
+        return settings.get('transactions_window', 5), json.dumps(settings.get('discipline_rules', {}), sort_keys=True)
+    
+    @staticmethod
+    def _discipline_event(transaction, settings):
+        """Событие окна дисциплины"""
+        return {'score': calculate_transaction_discipline(transaction, settings), 'date': transaction.get('date')}
+    
+    def _rebuild_window(self, user_id, settings):
+        """Построить окно пользователя по последним transactions_window транзакциям"""
+        window_size, rules_key = self._window_params(settings)
+        events = [self._discipline_event(transaction, settings)
+                  for transaction in self.db.get_rating_transactions(user_id, limit=window_size)]
+        self.db.save_discipline_windows({user_id: events}, window_size, rules_key)
+        return events
+    
+    def rebuild_windows(self):
+        """Пересобрать окна дисциплины всех пользователей одним проходом по журналу"""
+        settings = self.get_settings()
+        window_size, rules_key = self._window_params(settings)
+        windows = {}
+        for transaction in self.db.iter_rating_transactions(projection={'_id': 0}):
+            window = windows.setdefault(transaction['user_id'], deque(maxlen=window_size))
+            window.append(self._discipline_event(transaction, settings))
+        return self.db.save_discipline_windows(windows, window_size, rules_key)
+    
+    def get_discipline(self, user_id, settings=None, window=None):
+        """Дисциплина из окна последних событий (без чтения всей истории)"""
+        settings = settings or self.get_settings()
+        window_size, rules_key = self._window_params(settings)
+        if window is None:
+            window = self.db.get_discipline_window(user_id)
+        
+        if window and window.get('window_size') == window_size and window.get('rules_key') == rules_key:
+            count, total = window.get('events_count', 0), window.get('score_sum', 0)
+        else:
+            events = self._rebuild_window(user_id, settings)
+            count, total = len(events), sum(event['score'] for event in events)
+        
+        if not count:
+            return 50  # Базовый рейтинг для новых клиентов
+        return round(total / count)
+    
+    def get_all_transactions(self):
+        """Транзакции рейтинга всех пользователей: {user_id: [транзакции]}"""
+        transactions = {}
+        for transaction in self.db.iter_rating_transactions(projection={'_id': 0}):
+            transactions.setdefault(transaction['user_id'], []).append(transaction)
+        return transactions
+    
+    def get_rental_counts(self):
+        """Количество аренд по пользователям одной агрегацией"""
+        rental_counts = {}
+        for doc in self.db.db['rentals'].aggregate([{'$group': {'_id': '$user_id', 'count': {'$sum': 1}}}]):
+            rental_counts[str(doc['_id'])] = doc['count']
+        return rental_counts
+    
+    def get_rating(self, user_id):
+        """Итоговый рейтинг пользователя или None, если пользователя нет"""
+        user_id = str(user_id)
+        return self.cache.get(('user', user_id), 'rating', lambda: self._compute(user_id))
+    
+    def _compute(self, user_id):
+        """Расчет рейтинга одного пользователя"""
+        user_data = self.db.get_user(user_id)
+        if not user_data:
+            return None
+        rental_count = self.db.count_rentals({'user_id': user_id})
+        settings = self.get_settings()
+        return calculate_final_rating(user_id, user_data, self.get_discipline(user_id, settings),
+                                      rental_count, settings)
+    
+    def get_leaderboard(self, projection=None):
+        """
+        Рейтинги всех пользователей за один проход (по убыванию балла)
+        
+        Настройки и окна дисциплины читаются один раз, количество аренд - одной агрегацией
+        """
+        settings = self.get_settings()
+        windows = self.db.get_discipline_windows()
+        rental_counts = self.get_rental_counts()
+        
+        fields = dict(LOYALTY_USER_FIELDS)
+        fields.update(projection or {})
+        
+        ratings = []
+        for user in self.db.iter_users(projection=fields):
+            user_id = str(user['_id'])
+            # Окна еще нет (старые данные) - get_discipline построит его один раз
+            discipline = self.get_discipline(user_id, settings, windows.get(user_id, {}))
+            rating = calculate_final_rating(user_id, user, discipline, rental_counts.get(user_id, 0), settings)
+            self.cache.get(('user', user_id), 'rating', lambda: rating)
+            for field in (projection or {}):
+                rating[field] = user.get(field)
+            ratings.append(rating)
+        
+        ratings.sort(key=lambda x: x['final_score'], reverse=True)
+        return ratings
+    
+    @staticmethod
+    def _leaderboard_entry(rating, user):
+        """Запись лидерборда: рейтинг и поля пользователя для вывода"""
+        entry = dict(rating)
+        for field in LEADERBOARD_USER_FIELDS:
+            entry[field] = user.get(field)
+        return entry
+    
+    def refresh_ratings(self, user_ids):
+        """Пересчитать рейтинги пользователей и обновить их записи в лидерборде"""
+        entries = []
+        for user_id in user_ids:
+            user_id = str(user_id)
+            self.invalidate(user_id)
+            user = self.db.get_user(user_id)
+            rating = self.get_rating(user_id) if user else None
+            if rating:
+                entries.append(self._leaderboard_entry(rating, user))
+            else:
+                self.db.remove_leaderboard_entry(user_id)
+        return self.db.save_leaderboard_entries(entries) if entries else 0
+    
+    def rebuild_leaderboard(self):
+        """Пересобрать лидерборд и счетчики статусов по всем пользователям"""
+        ratings = self.get_leaderboard(projection=LEADERBOARD_USER_FIELDS)
+        return self.db.rebuild_leaderboard(ratings)
+    
+    def reconcile_leaderboard(self, max_age_seconds=LEADERBOARD_RECONCILE_SECONDS):
+        """Пересобрать лидерборд, если его нет или он давно не пересчитывался (True - пересобран)"""
+        stats = self.db.get_leaderboard_stats()
+        reconciled_at = stats.get('reconciled_at') if stats else None
+        age = (datetime.now() - datetime.fromisoformat(reconciled_at)).total_seconds() if reconciled_at else None
+        if age is not None and age <= max_age_seconds:
+            return False
+        # Пересчитываем баллы, а не только счетчики: записи могли устареть по стажу
+        self.rebuild_leaderboard()
+        return True
+    
+    def start_reconcile(self, check_seconds=LEADERBOARD_CHECK_SECONDS):
+        """Запустить фоновую сверку лидерборда (чтения лидерборда ее не ждут)"""
+        if self._reconcile_thread and self._reconcile_thread.is_alive():
+            return False
+        self._stop.clear()
+        self._reconcile_thread = threading.Thread(target=self._reconcile_loop, args=(check_seconds,),
+                                                  name='leaderboard-reconcile', daemon=True)
+        self._reconcile_thread.start()
+        return True
+    
+    def stop_reconcile(self):
+        """Остановить фоновую сверку"""
+        self._stop.set()
+    
+    def _reconcile_loop(self, check_seconds):
+        """Цикл сверки: процессы видят общий reconciled_at, поэтому пересобирает только первый"""
+        while not self._stop.is_set():
+            try:
+                self.reconcile_leaderboard()
+            except Exception as e:
+                print(f"❌ Ошибка сверки лидерборда: {e}")
+            self._stop.wait(check_seconds)
+    
+    def get_stats(self):
+        """Количество по статусам, число пользователей и средний балл (из счетчиков)"""
+        # До первой сверки лидерборд пуст - его соберет фоновая сверка или manage_db.py
+        stats = self.db.get_leaderboard_stats() or {}
+        
+        users_count = stats.get('users_count', 0)
+        counts = stats.get('counts', {})
+        return {
+            'users_count': users_count,
+            'counts': {status: counts.get(status, 0) for status in STATUS_NAMES},
+            'average_score': stats.get('score_total', 0) / users_count if users_count else 0,
+            'updated_at': stats.get('updated_at')
+        }
+    
+    def get_top(self, limit=None, status=None):
+        """Лучшие пользователи из лидерборда (limit=None - все по убыванию балла)"""
+        return self.db.get_leaderboard_entries(limit, status)
+    
+    def count_rated_users(self):
+        """Количество пользователей с сохраненным рейтингом"""
+        return len(self._load_ratings_document('user_ratings'))
+    
+    def get_user_benefits(self, user_id):
+        """Льготы пользователя по его статусу"""
+        rating = self.get_rating(user_id)
+        return get_status_benefits(rating['status'] if rating else 'regular')
+    
+    def invalidate(self, user_id=None):
+        """Сбросить рейтинг пользователя (или все рейтинги и настройки)"""
+        if user_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(('user', str(user_id)))
+    
+    def _on_write(self, collection_name, doc_id):
+        """Сброс рейтинга пользователя при его записях, всего кэша - при записи настроек"""
+        if collection_name in ('users', 'rating_transactions', 'user_rentals'):
+            # Запись без id (миграция, сохранение словаря целиком) может затронуть любого пользователя
+            self.invalidate(doc_id)
+        elif collection_name == 'ratings' and doc_id in (None, 'settings'):
+            self.invalidate()
+    
+    def _on_local_write(self, collection_name, doc_id):
+        """Обновить запись лидерборда, когда у пользователя изменилось число аренд"""
+        if collection_name == 'user_rentals' and doc_id is not None:
+            self.refresh_ratings([doc_id])
+
+
+def get_rating_engine():
+    """Получить общий экземпляр движка рейтинга"""
+    global rating_engine
+    if rating_engine is None:
+        rating_engine = RatingEngine(get_db_manager())
+    return rating_engine
 
 
 def calculate_user_rating_manual(user_id):
@@ -18,10 +449,10 @@ def calculate_user_rating_manual(user_id):
         float: Актуальный рейтинг пользователя (от 1.0 до 5.0)
     """
     db = get_db_manager()
-    rating_data = db.get_user_rating(user_id)
+    summary = db.get_rating_summary(user_id)
     
-    if rating_data:
-        return rating_data.get('rating', 5.0)
+    if summary:
+        return summary.get('rating', 5.0)
     else:
         return 5.0  # Начальный рейтинг для новых пользователей
 
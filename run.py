@@ -8,6 +8,8 @@ import time
 from app import app
 from bot import bot
 from init_admin import init_admin, init_data_files, init_passport_dir
+from database import get_db_manager
+from rating_system import get_rating_engine
 
 def run_flask():
     """Запуск Flask приложения"""
@@ -34,6 +36,11 @@ if __name__ == '__main__':
     init_passport_dir()
     init_admin()
     print("✅ Инициализация завершена")
+    
+    # Flask и бот делят один менеджер БД, лента нужна для других процессов
+    get_db_manager().start_change_feed()
+    # Пересчет лидерборда по стажу - фоновой сверкой
+    get_rating_engine().start_reconcile()
     print()
     
     try:
@@ -0,0 +1,130 @@
+"""
+Тесты сброса месячных масок доступности по консоли и месяцу
+"""
+
+from datetime import datetime
+import unittest
+from database.availability import AvailabilityService, OCCUPIED, RESERVED, SYSTEM_BLOCKED
+from database.discounts import ConsoleDiscounts
+
+class FakeCollection:
+    """Коллекция документов по _id"""
+    
+    def __init__(self):
+        self.docs = {}
+    
+    def find_one(self, query, projection=None):
+        return self.docs.get(query['_id'])
+
+class FakeIntervals:
+    """Индекс интервалов: активные аренды из коллекции rentals"""
+    
+    def __init__(self, rentals):
+        self.rentals = rentals
+    
+    def _interval(self, rental):
+        if not rental or rental.get('status') != 'active':
+            return None
+        return rental['start'], rental['end']
+    
+    def find_overlapping(self, console_id, start, end):
+        return [(rental['start'], rental['end'], rental_id) for rental_id, rental in self.rentals.docs.items()
+                if rental['console_id'] == console_id and self._interval(rental)
+                and rental['start'] < end and rental['end'] > start]
+
+class FakeDiscountIndex:
+    def get(self, console_id):
+        return ConsoleDiscounts([])
+
+class FakeManager:
+    """Минимальный менеджер БД: аренды, резервации и блокировки с подсчетом расчетов месяцев"""
+    
+    def __init__(self):
+        self.db = {'rentals': FakeCollection(), 'calendar_reservations': FakeCollection()}
+        self.intervals = FakeIntervals(self.db['rentals'])
+        self.discount_index = FakeDiscountIndex()
+        self.blocked = []
+        self.listeners = []
+        self.loads = []
+    
+    def add_write_listener(self, callback, local_only=False):
+        self.listeners.append(callback)
+    
+    def emit(self, collection_name, doc_id):
+        for callback in self.listeners:
+            callback(collection_name, doc_id)
+    
+    def get_calendar(self):
+        return {}
+    
+    def get_holidays(self, date_from, date_to):
+        return []
+    
+    def get_blocked_dates(self, console_id, date_from, date_to):
+        self.loads.append(console_id)
+        return [blocked for blocked in self.blocked if blocked['console_id'] in (None, console_id)]
+    
+    def get_calendar_reservations(self, console_id, date_from, date_to):
+        return [reservation for reservation in self.db['calendar_reservations'].docs.values()
+                if reservation['console_id'] == console_id and date_from <= reservation['date'] <= date_to]
+
+class AvailabilityInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager()
+        self.service = AvailabilityService(self.manager)
+        self.rentals = self.manager.db['rentals'].docs
+        self.reservations = self.manager.db['calendar_reservations'].docs
+    
+    def flags(self, console_id, day, month=5):
+        return self.service.get_month(console_id, 2030, month)['days'][f'2030-{month:02d}-{day:02d}']
+    
+    def test_reservation_write_resets_only_its_console_month(self):
+        for console_id, month in (('c1', 5), ('c1', 6), ('c2', 5)):
+            self.service.get_month(console_id, 2030, month)
+        self.manager.loads.clear()
+        
+        self.reservations['r1'] = {'_id': 'r1', 'console_id': 'c1', 'date': '2030-05-10'}
+        self.manager.emit('calendar_reservations', 'r1')
+        self.assertTrue(self.flags('c1', 10) & RESERVED)
+        self.assertFalse(self.flags('c1', 10, month=6) & RESERVED)
+        self.assertFalse(self.flags('c2', 10) & RESERVED)
+        self.assertEqual(self.manager.loads, ['c1'])
+        
+        # Удаленная резервация находится по месяцу, в который она попала при расчете
+        del self.reservations['r1']
+        self.manager.emit('calendar_reservations', 'r1')
+        self.assertFalse(self.flags('c1', 10) & RESERVED)
+    
+    def test_finished_rental_resets_months_it_occupied(self):
+        self.rentals['a1'] = {'_id': 'a1', 'console_id': 'c1', 'status': 'active',
+                              'start': datetime(2030, 5, 30), 'end': datetime(2030, 6, 2)}
+        self.assertTrue(self.flags('c1', 31) & OCCUPIED)
+        self.assertTrue(self.flags('c1', 1, month=6) & OCCUPIED)
+        self.service.get_month('c2', 2030, 5)
+        self.manager.loads.clear()
+        
+        self.rentals['a1']['status'] = 'completed'
+        self.manager.emit('rentals', 'a1')
+        self.assertFalse(self.flags('c1', 31) & OCCUPIED)
+        self.assertFalse(self.flags('c1', 1, month=6) & OCCUPIED)
+        self.service.get_month('c2', 2030, 5)
+        self.assertEqual(sorted(self.manager.loads), ['c1', 'c1'])
+    
+    def test_console_status_write_keeps_cache(self):
+        self.service.get_month('c1', 2030, 5)
+        self.manager.emit('consoles', 'c1')
+        self.manager.emit('consoles', None)
+        self.service.get_month('c1', 2030, 5)
+        self.assertEqual(self.manager.loads, ['c1'])
+    
+    def test_system_block_resets_all_consoles(self):
+        self.service.get_month('c1', 2030, 5)
+        self.service.get_month('c2', 2030, 5)
+        
+        self.manager.blocked.append({'console_id': None, 'date': '2030-05-03'})
+        self.manager.emit('calendar_blocked_dates', 'system_2030-05-03')
+        self.assertTrue(self.flags('c1', 3) & SYSTEM_BLOCKED)
+        self.assertTrue(self.flags('c2', 3) & SYSTEM_BLOCKED)
+
+if __name__ == '__main__':
+    unittest.main()
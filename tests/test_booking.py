@@ -0,0 +1,121 @@
+"""
+Тесты переходов состояний консоли через compare-and-set
+"""
+
+import copy
+from datetime import datetime, timedelta
+import unittest
+from pymongo import ReturnDocument
+from database.booking import BookingEngine
+
+def matches(doc, query):
+    """Проверка документа фильтром MongoDB (только операторы, которые использует движок)"""
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(doc, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator == '$lte' and not (field in doc and doc[field] <= value):
+                    return False
+                if operator == '$exists' and (field in doc) != value:
+                    return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+class FakeCollection:
+    """Коллекция с атомарным find_one_and_update"""
+    
+    def __init__(self, docs=None):
+        self.docs = {doc['_id']: doc for doc in docs or []}
+    
+    def find_one(self, query, projection=None):
+        return next((copy.deepcopy(doc) for doc in self.docs.values() if matches(doc, query)), None)
+    
+    def find_one_and_update(self, query, update, return_document=ReturnDocument.BEFORE):
+        doc = next((doc for doc in self.docs.values() if matches(doc, query)), None)
+        if doc is None:
+            return None
+        previous = copy.deepcopy(doc)
+        doc.update(update.get('$set', {}))
+        for field, amount in update.get('$inc', {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        for field in update.get('$unset', {}):
+            doc.pop(field, None)
+        return previous if return_document == ReturnDocument.BEFORE else copy.deepcopy(doc)
+
+class FakeManager:
+    """Минимальный менеджер БД: консоли, аренды и журнал событий записи"""
+    
+    def __init__(self, consoles):
+        self.db = {'consoles': FakeCollection(consoles), 'rentals': FakeCollection()}
+        self.save_fails = False
+        self.events = []
+    
+    def _invalidate(self, collection_name, doc_id=None):
+        self.events.append((collection_name, doc_id))
+    
+    def _apply_stats_change(self, collection_name, previous, current):
+        pass
+    
+    def save_rental(self, rental_data):
+        if self.save_fails:
+            return None
+        rental_id = str(rental_data['id'])
+        self.db['rentals'].docs[rental_id] = dict(rental_data, _id=rental_id)
+        return rental_id
+
+class BookingEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager([{'_id': 'c1', 'status': 'available', 'version': 0}])
+        self.booking = BookingEngine(self.manager)
+        self.consoles = self.manager.db['consoles'].docs
+    
+    def rental(self, rental_id, user_id):
+        return {'id': rental_id, 'console_id': 'c1', 'user_id': user_id, 'status': 'active'}
+    
+    def test_second_rental_of_same_console_is_rejected(self):
+        self.assertTrue(self.booking.start_rental(self.rental('r1', 'u1')))
+        self.assertFalse(self.booking.start_rental(self.rental('r2', 'u2')))
+        
+        self.assertEqual(self.consoles['c1']['status'], 'rented')
+        self.assertEqual(self.consoles['c1']['current_rental_id'], 'r1')
+        self.assertEqual(self.consoles['c1']['version'], 1)
+        self.assertNotIn('r2', self.manager.db['rentals'].docs)
+    
+    def test_stale_version_does_not_overwrite_state(self):
+        self.assertIsNotNone(self.booking.reserve_console('c1', 'u1', expected_version=0))
+        self.assertIsNone(self.booking.reserve_console('c1', 'u1', expected_version=0))
+        self.assertEqual(self.consoles['c1']['version'], 1)
+    
+    def test_reservation_blocks_other_users_until_it_expires(self):
+        self.booking.reserve_console('c1', 'u1')
+        self.assertFalse(self.booking.start_rental(self.rental('r1', 'u2')))
+        
+        self.consoles['c1']['reserved_until'] = (datetime.now() - timedelta(minutes=1)).isoformat()
+        self.assertTrue(self.booking.start_rental(self.rental('r1', 'u2')))
+        self.assertNotIn('reserved_by', self.consoles['c1'])
+    
+    def test_owner_starts_rental_from_own_reservation(self):
+        self.booking.reserve_console('c1', 'u1')
+        self.assertTrue(self.booking.start_rental(self.rental('r1', 'u1')))
+        self.assertEqual(self.consoles['c1']['status'], 'rented')
+    
+    def test_failed_rental_write_returns_console(self):
+        self.manager.save_fails = True
+        self.assertFalse(self.booking.start_rental(self.rental('r1', 'u1')))
+        self.assertEqual(self.consoles['c1']['status'], 'available')
+        self.assertNotIn('current_rental_id', self.consoles['c1'])
+    
+    def test_rental_ends_once(self):
+        self.booking.start_rental(self.rental('r1', 'u1'))
+        self.assertIsNotNone(self.booking.end_rental('r1', {'end_time': datetime.now().isoformat()}))
+        self.assertIsNone(self.booking.end_rental('r1', {'end_time': datetime.now().isoformat()}))
+        
+        self.assertEqual(self.manager.db['rentals'].docs['r1']['status'], 'completed')
+        self.assertEqual(self.consoles['c1']['status'], 'available')
+        self.assertEqual(self.consoles['c1']['version'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
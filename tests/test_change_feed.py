@@ -0,0 +1,70 @@
+"""
+Тесты чтения ленты изменений после переподключения
+"""
+
+import unittest
+from database.change_feed import ChangeFeed
+
+class FakeCursor:
+    """Tailable cursor: отдает события один раз и закрывается"""
+    
+    def __init__(self, events):
+        self.events = events
+        self.alive = True
+    
+    def __iter__(self):
+        self.alive = False
+        return iter(self.events)
+
+class FakeEvents:
+    """Capped-коллекция событий в порядке вставки"""
+    
+    def __init__(self, events):
+        self.events = events
+        self.on_find = None
+    
+    def estimated_document_count(self):
+        return len(self.events)
+    
+    def count_documents(self, query):
+        return len(self.events)
+    
+    def find(self, query, cursor_type=None, max_await_time_ms=None, skip=0):
+        if self.on_find:
+            self.on_find()
+        return FakeCursor(self.events[skip:])
+
+class FakeDatabase:
+    def __init__(self, collection):
+        self.collection = collection
+    
+    def create_collection(self, name, capped=False, size=None):
+        pass
+    
+    def __getitem__(self, name):
+        return self.collection
+
+class ChangeFeedReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.events = FakeEvents([{'_id': 5, 'collection': 'users', 'doc_id': 'old', 'origin': 'other'}])
+        self.feed = ChangeFeed(FakeDatabase(self.events))
+        self.received = []
+        self.resets = []
+        self.feed.subscribe(lambda collection, doc_id: self.received.append((collection, doc_id)))
+        self.feed.subscribe_reset(lambda: self.resets.append(len(self.received)))
+    
+    def test_reconnect_reads_by_insertion_order_and_resets_caches(self):
+        # После подключения другой процесс пишет событие с меньшим _id
+        def write_lower_id():
+            self.events.events.append({'_id': 3, 'collection': 'rentals', 'doc_id': 'r1', 'origin': 'other'})
+            self.events.events.append({'_id': 4, 'collection': 'users', 'doc_id': 'own', 'origin': self.feed.origin})
+            self.events.on_find = self.feed.stop
+        self.events.on_find = write_lower_id
+        
+        self.feed._run()
+        self.assertEqual(self.received, [('rentals', 'r1')])
+        # Сброс при каждом подключении: первом и после закрытия курсора
+        self.assertEqual(self.resets, [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
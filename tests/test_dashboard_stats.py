@@ -0,0 +1,73 @@
+"""
+Тесты сдвига счетчиков панели по переходам документов
+"""
+
+import unittest
+from database.db import MongoDBManager
+
+class FakeStats:
+    """Документ dashboard_stats: $inc по точечным путям"""
+    
+    def __init__(self):
+        self.doc = {}
+        self.writes = 0
+    
+    def update_one(self, query, update):
+        self.writes += 1
+        for path, value in update['$inc'].items():
+            *parents, field = path.split('.')
+            target = self.doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = target.get(field, 0) + value
+
+class FakeRollups:
+    def apply_change(self, previous, current):
+        pass
+
+class DashboardStatsTest(unittest.TestCase):
+    def setUp(self):
+        # Менеджер без подключения: счетчики пишутся только в dashboard_stats
+        self.manager = MongoDBManager.__new__(MongoDBManager)
+        self.stats = FakeStats()
+        self.manager.db = {'dashboard_stats': self.stats}
+        self.manager.rollups = FakeRollups()
+        self.events = []
+        self.manager._invalidate = lambda collection_name, doc_id=None: self.events.append((collection_name, doc_id))
+    
+    def test_rental_lifecycle_moves_counters(self):
+        rental = {'user_id': 'u1', 'status': 'active', 'total_cost': 0}
+        self.manager._apply_stats_change('rentals', None, rental)
+        self.assertEqual(self.stats.doc, {'rentals_by_status': {'active': 1}})
+        
+        completed = dict(rental, status='completed', total_cost=300, end_time='2030-05-10T12:00:00')
+        self.manager._apply_stats_change('rentals', rental, completed)
+        self.assertEqual(self.stats.doc['rentals_by_status'], {'active': 0, 'completed': 1})
+        self.assertEqual(self.stats.doc['revenue_total'], 300)
+        self.assertEqual(self.stats.doc['revenue_rentals'], 1)
+        self.assertEqual(self.stats.doc['revenue_by_day'], {'2030-05-10': 300})
+        
+        corrected = dict(completed, total_cost=350)
+        self.manager._apply_stats_change('rentals', completed, corrected)
+        self.assertEqual(self.stats.doc['revenue_total'], 350)
+        self.assertEqual(self.stats.doc['revenue_rentals'], 1)
+        
+        self.manager._apply_stats_change('rentals', corrected, None)
+        self.assertEqual(self.stats.doc['rentals_by_status'], {'active': 0, 'completed': 0})
+        self.assertEqual((self.stats.doc['revenue_total'], self.stats.doc['revenue_rentals']), (0, 0))
+        
+        # Число аренд владельца меняется только при создании и удалении
+        self.assertEqual(self.events, [('user_rentals', 'u1'), ('user_rentals', 'u1')])
+    
+    def test_console_status_change(self):
+        self.manager._apply_stats_change('consoles', None, {'status': 'available'})
+        self.manager._apply_stats_change('consoles', {'status': 'available'}, {'status': 'rented'})
+        self.assertEqual(self.stats.doc, {'consoles_count': 1, 'consoles_by_status': {'available': 0, 'rented': 1}})
+    
+    def test_write_without_counter_changes_skips_update(self):
+        console = {'status': 'available', 'name': 'PS5'}
+        self.manager._apply_stats_change('consoles', console, dict(console, name='PS5 Pro'))
+        self.assertEqual(self.stats.writes, 0)
+
+if __name__ == '__main__':
+    unittest.main()
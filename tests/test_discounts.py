@@ -0,0 +1,54 @@
+"""
+Тесты выбора лучшей скидки консоли
+"""
+
+from datetime import datetime
+import unittest
+from database.discounts import ConsoleDiscounts, discount_amount
+
+def discount(discount_id, discount_type, value, start_date='2030-05-01', end_date='2030-05-31', min_hours=0):
+    return {'_id': discount_id, 'id': discount_id, 'type': discount_type, 'value': value,
+            'start_date': start_date, 'end_date': end_date, 'min_hours': min_hours}
+
+class ConsoleDiscountsTest(unittest.TestCase):
+    def best_id(self, discounts, at, hours, price):
+        best = discounts.best(at, hours, price)
+        return best['id'] if best else None
+    
+    def test_best_discount_depends_on_price(self):
+        discounts = ConsoleDiscounts([discount('p10', 'percentage', 10), discount('f50', 'fixed', 50)])
+        at = datetime(2030, 5, 10, 12)
+        # 10% от 300 = 30 < 50, 10% от 1000 = 100 > 50
+        self.assertEqual(self.best_id(discounts, at, 3, 300), 'f50')
+        self.assertEqual(self.best_id(discounts, at, 10, 1000), 'p10')
+        self.assertEqual(discount_amount(discount('f50', 'fixed', 50), 30), 30)
+    
+    def test_min_hours_threshold(self):
+        discounts = ConsoleDiscounts([discount('p10', 'percentage', 10),
+                                      discount('p30', 'percentage', 30, min_hours=5)])
+        at = datetime(2030, 5, 10, 12)
+        self.assertEqual(self.best_id(discounts, at, 4, 400), 'p10')
+        self.assertEqual(self.best_id(discounts, at, 5, 500), 'p30')
+    
+    def test_period_bounds(self):
+        discounts = ConsoleDiscounts([discount('p10', 'percentage', 10, '2030-05-01', '2030-05-10'),
+                                      discount('p20', 'percentage', 20, '2030-05-05T12:00', '2030-05-06T12:00')])
+        # Дата окончания без времени действует до конца дня
+        self.assertEqual(self.best_id(discounts, datetime(2030, 5, 10, 23, 59), 1, 100), 'p10')
+        self.assertIsNone(self.best_id(discounts, datetime(2030, 5, 11), 1, 100))
+        self.assertIsNone(self.best_id(discounts, datetime(2030, 4, 30, 23), 1, 100))
+        self.assertEqual(self.best_id(discounts, datetime(2030, 5, 6), 1, 100), 'p20')
+        self.assertEqual(self.best_id(discounts, datetime(2030, 5, 6, 13), 1, 100), 'p10')
+        
+        self.assertEqual(discounts.periods(), [(datetime(2030, 5, 1), datetime(2030, 5, 5, 12)),
+                                               (datetime(2030, 5, 5, 12), datetime(2030, 5, 6, 12, 0, 0, 1)),
+                                               (datetime(2030, 5, 6, 12, 0, 0, 1), datetime(2030, 5, 11))])
+    
+    def test_invalid_discounts_are_ignored(self):
+        discounts = ConsoleDiscounts([discount('bad', 'bonus', 90), discount('empty', 'fixed', 10, end_date=None),
+                                      discount('back', 'fixed', 10, '2030-05-10', '2030-05-01')])
+        self.assertIsNone(discounts.best(datetime(2030, 5, 5), 1, 100))
+        self.assertEqual(discounts.periods(), [])
+
+if __name__ == '__main__':
+    unittest.main()
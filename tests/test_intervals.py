@@ -0,0 +1,92 @@
+"""
+Тесты индекса интервалов активных аренд
+"""
+
+from datetime import datetime, timedelta
+import random
+import unittest
+from database.intervals import ConsoleIntervals, RentalIntervalIndex
+
+class FakeManager:
+    """Минимальный менеджер БД: аренды в памяти и слушатели записей"""
+    
+    def __init__(self, rentals):
+        self.rentals = rentals
+        self.listeners = []
+    
+    def add_write_listener(self, callback):
+        self.listeners.append(callback)
+    
+    def find_rentals(self, query=None, sort=None, limit=0, projection=None):
+        query = query or {}
+        return {rental_id: rental for rental_id, rental in self.rentals.items()
+                if all(rental.get(field) == value for field, value in query.items())}
+
+class RentalIntervalIndexTest(unittest.TestCase):
+    def test_admin_approved_rental_uses_expected_end_time(self):
+        # Одобренная в панели аренда хранит окончание в expected_end_time
+        manager = FakeManager({
+            'r1': {'console_id': 'c1', 'status': 'active', 'start_time': '2030-05-01T10:00:00',
+                   'expected_end_time': '2030-05-03T10:00:00', 'end_time': None}
+        })
+        intervals = RentalIntervalIndex(manager)
+        
+        self.assertFalse(intervals.is_free('c1', datetime(2030, 5, 2), datetime(2030, 5, 2, 1)))
+        self.assertTrue(intervals.is_free('c1', datetime(2030, 5, 3, 10), datetime(2030, 5, 4)))
+        self.assertEqual(intervals.find_covering('c1', datetime(2030, 5, 2))[1], datetime(2030, 5, 3, 10))
+        self.assertEqual(intervals.next_free_slot('c1', datetime(2030, 5, 1, 9), timedelta(hours=2)),
+                         datetime(2030, 5, 3, 10))
+    
+    def test_bot_rental_uses_estimated_end_time(self):
+        manager = FakeManager({
+            'r1': {'console_id': 'c1', 'status': 'active', 'start_time': '2030-05-01T00:00:00',
+                   'estimated_end_time': '2030-05-02T00:00:00'}
+        })
+        intervals = RentalIntervalIndex(manager)
+        
+        self.assertFalse(intervals.is_free('c1', datetime(2030, 5, 1, 12), datetime(2030, 5, 1, 13)))
+        self.assertTrue(intervals.is_free('c1', datetime(2030, 5, 2), datetime(2030, 5, 3)))
+    
+    def test_rental_without_end_occupies_console_indefinitely(self):
+        manager = FakeManager({
+            'r1': {'console_id': 'c1', 'status': 'active', 'start_time': '2030-05-01T00:00:00'}
+        })
+        intervals = RentalIntervalIndex(manager)
+        
+        self.assertFalse(intervals.is_free('c1', datetime(2031, 1, 1), datetime(2031, 1, 2)))
+
+class ConsoleIntervalsTest(unittest.TestCase):
+    def test_incremental_updates_match_full_scan(self):
+        # Дерево после случайных добавлений и удалений отвечает так же, как перебор всех интервалов
+        rng = random.Random(7)
+        base = datetime(2030, 1, 1)
+        intervals = ConsoleIntervals()
+        expected = {}
+        for step in range(400):
+            rental_id = f"r{rng.randrange(60)}"
+            if rental_id in expected and rng.random() < 0.4:
+                intervals.remove(rental_id)
+                del expected[rental_id]
+            else:
+                start = base + timedelta(hours=rng.randrange(500))
+                end = start + timedelta(hours=rng.randrange(1, 48))
+                intervals.add(start, end, rental_id)
+                expected[rental_id] = (start, end, rental_id)
+            
+            query_start = base + timedelta(hours=rng.randrange(520))
+            query_end = query_start + timedelta(hours=rng.randrange(1, 24))
+            overlapping = sorted(entry for entry in expected.values()
+                                 if entry[0] < query_end and entry[1] > query_start)
+            self.assertEqual(len(intervals), len(expected))
+            self.assertEqual(intervals.overlapping(query_start, query_end), overlapping)
+            self.assertEqual(intervals.overlaps(query_start, query_end), bool(overlapping))
+            
+            covering = [entry for entry in expected.values() if entry[0] <= query_start < entry[1]]
+            self.assertEqual(intervals.covering(query_start), max(covering) if covering else None)
+            
+            free = intervals.next_free(query_start, timedelta(hours=3))
+            self.assertGreaterEqual(free, query_start)
+            self.assertFalse(intervals.overlaps(free, free + timedelta(hours=3)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Тесты постраничной выборки по ключу (sort_field, _id)
+"""
+
+import unittest
+from database.db import MongoDBManager
+
+def value_key(value):
+    """Порядок MongoDB для используемых типов: null/отсутствие раньше значений"""
+    return (0, 0) if value is None else (1, value)
+
+def matches(doc, query):
+    """Проверка документа фильтром MongoDB (только операторы, которые строит find_page)"""
+    for field, condition in query.items():
+        if field == '$and':
+            if not all(matches(doc, option) for option in condition):
+                return False
+        elif field == '$or':
+            if not any(matches(doc, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            for operator, bound in condition.items():
+                # $lt/$gt не сравнивают null со значениями
+                if operator == '$lt' and (value is None or not value_key(value) < value_key(bound)):
+                    return False
+                if operator == '$gt' and (value is None or not value_key(value) > value_key(bound)):
+                    return False
+                if operator == '$ne' and value == bound:
+                    return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+    
+    def sort(self, sort):
+        for field, direction in reversed(sort):
+            self.docs.sort(key=lambda doc: value_key(doc.get(field)), reverse=direction < 0)
+        return self
+    
+    def limit(self, limit):
+        self.docs = self.docs[:limit]
+        return self
+    
+    def __iter__(self):
+        return iter(self.docs)
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+    
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs if matches(doc, query)])
+
+class FindPageTest(unittest.TestCase):
+    def setUp(self):
+        # Повторы значений сортировки и документы без поля
+        docs = [{'_id': f'r{index:02d}', 'created_at': [None, '2030-05-01', '2030-05-02'][index % 3],
+                 'status': 'active' if index % 2 else 'completed'} for index in range(20)]
+        docs.append({'_id': 'r20', 'status': 'active'})
+        self.manager = MongoDBManager.__new__(MongoDBManager)
+        self.manager.db = {'rentals': FakeCollection(docs)}
+    
+    def walk(self, limit=3, **kwargs):
+        """Пройти все страницы: (id по порядку, число страниц)"""
+        ids, pages, cursor = [], 0, None
+        while True:
+            page, cursor = self.manager.find_page('rentals', limit=limit, cursor=cursor, **kwargs)
+            self.assertLessEqual(len(page), limit)
+            ids.extend(page)
+            pages += 1
+            if not cursor:
+                return ids, pages
+    
+    def expected(self, sort_field, descending, query=None):
+        docs = self.manager.db['rentals'].find(query or {})
+        return [doc['_id'] for doc in docs.sort([(sort_field, -1 if descending else 1),
+                                                 ('_id', -1 if descending else 1)])]
+    
+    def test_pages_cover_collection_once_in_both_directions(self):
+        for descending in (True, False):
+            ids, pages = self.walk(sort_field='created_at', descending=descending)
+            self.assertEqual(ids, self.expected('created_at', descending))
+            self.assertEqual(pages, 7)
+    
+    def test_pages_by_id_with_filter(self):
+        query = {'status': 'active'}
+        ids, _ = self.walk(limit=4, query=query, descending=False)
+        self.assertEqual(ids, self.expected('_id', False, query))
+        self.assertEqual(len(ids), 11)
+    
+    def test_last_full_page_has_no_cursor(self):
+        page, cursor = self.manager.find_page('rentals', limit=21)
+        self.assertEqual(len(page), 21)
+        self.assertIsNone(cursor)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Тесты закрепления цен предложения аренды
+"""
+
+import copy
+from datetime import datetime, timedelta
+import unittest
+from database.discounts import ConsoleDiscounts
+from database.quotes import PriceQuotes
+
+class FakeQuotes:
+    """Коллекция price_quotes"""
+    
+    def __init__(self):
+        self.docs = {}
+    
+    def insert_one(self, doc):
+        self.docs[doc['_id']] = copy.deepcopy(doc)
+    
+    def find_one(self, query):
+        doc = self.docs.get(query['_id'])
+        if doc and doc['user_id'] == query['user_id'] and doc['expires_at'] > query['expires_at']['$gt']:
+            return copy.deepcopy(doc)
+        return None
+
+class FakeDiscountIndex:
+    """Скидки консолей, которые тест меняет после расчета предложения"""
+    
+    def __init__(self):
+        self.discounts = {}
+    
+    def best(self, console_id, at, hours, price):
+        return ConsoleDiscounts(self.discounts.get(console_id, [])).best(at, hours, price)
+
+class FakeManager:
+    def __init__(self):
+        self.db = {'price_quotes': FakeQuotes()}
+        self.discount_index = FakeDiscountIndex()
+
+class PriceQuotesTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager()
+        self.quotes = PriceQuotes(self.manager)
+        self.console = {'_id': 'c1', 'rental_price': 100}
+        self.manager.discount_index.discounts['c1'] = [
+            {'id': 'd1', 'type': 'percentage', 'value': 20, 'min_hours': 3,
+             'start_date': '2030-05-01', 'end_date': '2030-05-31'}
+        ]
+    
+    def test_quote_prices_all_options_once(self):
+        quote = self.quotes.create('u1', self.console, [1, 3], '2030-05-10', {'discount_percent': 10})
+        one, three = quote['options']['1'], quote['options']['3']
+        self.assertEqual((one['discount_id'], one['total_cost']), (None, 90))
+        # 300 - 20% = 240, льгота статуса 10% от 240
+        self.assertEqual((three['discount_id'], three['discount_amount']), ('d1', 60))
+        self.assertEqual((three['status_discount_amount'], three['total_cost']), (24, 216))
+    
+    def test_selected_option_keeps_pinned_price(self):
+        quote = self.quotes.create('u1', self.console, [3], '2030-05-10')
+        
+        # Скидку сняли и цену подняли после того, как пользователь увидел предложение
+        self.manager.discount_index.discounts['c1'] = []
+        self.console['rental_price'] = 500
+        pinned, option = self.quotes.get_option(quote['_id'], 'u1', 3)
+        self.assertEqual(pinned['price_per_hour'], 100)
+        self.assertEqual(option['total_cost'], 240)
+    
+    def test_quote_is_private_and_expires(self):
+        quote = self.quotes.create('u1', self.console, [3], '2030-05-10')
+        self.assertEqual(self.quotes.get_option(quote['_id'], 'u2', 3), (None, None))
+        self.assertEqual(self.quotes.get_option(quote['_id'], 'u1', 5), (None, None))
+        
+        self.manager.db['price_quotes'].docs[quote['_id']]['expires_at'] = datetime.utcnow() - timedelta(seconds=1)
+        self.assertEqual(self.quotes.get_option(quote['_id'], 'u1', 3), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
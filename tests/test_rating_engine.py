@@ -0,0 +1,140 @@
+"""
+Тесты обновления рейтингов и лидерборда по событиям записи
+"""
+
+from datetime import datetime, timedelta
+import unittest
+from rating_system import RatingEngine, LEADERBOARD_RECONCILE_SECONDS
+
+class FakeRatings:
+    """Коллекция ratings без документов (настройки по умолчанию)"""
+    
+    def find_one(self, query, projection=None):
+        return None
+
+class FakeManager:
+    """Минимальный менеджер БД: пользователи, число аренд, лидерборд и слушатели записей"""
+    
+    def __init__(self, users, rental_counts=None):
+        self.users = users
+        self.rental_counts = rental_counts or {}
+        self.db = {'ratings': FakeRatings()}
+        self.listeners = []
+        self.leaderboard = {}
+        self.stats = None
+        self.rebuilds = 0
+    
+    def add_write_listener(self, callback, local_only=False):
+        self.listeners.append((callback, local_only))
+    
+    def emit(self, collection_name, doc_id, remote=False):
+        for callback, local_only in self.listeners:
+            if not (remote and local_only):
+                callback(collection_name, doc_id)
+    
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+    
+    def iter_users(self, projection=None):
+        return (dict(user, _id=user_id) for user_id, user in self.users.items())
+    
+    def count_rentals(self, query):
+        return self.rental_counts.get(query['user_id'], 0)
+    
+    def get_discipline_window(self, user_id):
+        return {'window_size': 5, 'rules_key': '{}', 'events_count': 0, 'score_sum': 0}
+    
+    def get_discipline_windows(self):
+        return {user_id: self.get_discipline_window(user_id) for user_id in self.users}
+    
+    def save_leaderboard_entries(self, entries):
+        for entry in entries:
+            self.leaderboard[entry['user_id']] = entry
+        return len(entries)
+    
+    def remove_leaderboard_entry(self, user_id):
+        return self.leaderboard.pop(user_id, None) is not None
+    
+    def get_leaderboard_stats(self):
+        return self.stats
+    
+    def get_leaderboard_entries(self, limit=None, status=None):
+        return sorted(self.leaderboard.values(), key=lambda entry: -entry['final_score'])
+    
+    def rebuild_leaderboard(self, entries):
+        self.rebuilds += 1
+        self.leaderboard = {entry['user_id']: entry for entry in entries}
+        self.stats = {'counts': {}, 'score_total': 0, 'users_count': len(entries),
+                      'reconciled_at': datetime.now().isoformat()}
+        return len(entries)
+
+class RatingEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager({'u1': {'first_name': 'Ann'}})
+        self.engine = RatingEngine(self.manager)
+        # Число аренд всех пользователей считается агрегацией - подменяем ее
+        self.engine.get_rental_counts = lambda: dict(self.manager.rental_counts)
+    
+    def test_rental_write_refreshes_leaderboard_entry(self):
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 0)
+        
+        self.manager.rental_counts['u1'] = 2
+        self.manager.emit('user_rentals', 'u1')
+        
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 10)
+        self.assertEqual(self.manager.leaderboard['u1']['loyalty'], 10)
+    
+    def test_remote_rental_write_only_invalidates_cache(self):
+        self.engine.get_rating('u1')
+        self.manager.rental_counts['u1'] = 1
+        self.manager.emit('user_rentals', 'u1', remote=True)
+        
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 5)
+        self.assertNotIn('u1', self.manager.leaderboard)
+    
+    def test_rental_write_keeps_other_users_cached(self):
+        self.manager.users['u2'] = {'first_name': 'Bob'}
+        self.engine.get_rating('u1')
+        self.engine.get_rating('u2')
+        self.manager.rental_counts.update({'u1': 1, 'u2': 1})
+        
+        # Запись аренды u1: событие самой аренды и событие о числе аренд ее владельца
+        self.manager.emit('rentals', 'r1', remote=True)
+        self.manager.emit('user_rentals', 'u1', remote=True)
+        
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 5)
+        self.assertEqual(self.engine.get_rating('u2')['loyalty'], 0)
+    
+    def test_settings_write_invalidates_all_ratings(self):
+        self.engine.get_rating('u1')
+        self.manager.rental_counts['u1'] = 1
+        
+        self.manager.emit('ratings', 'user_ratings', remote=True)
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 0)
+        
+        self.manager.emit('ratings', 'settings', remote=True)
+        self.assertEqual(self.engine.get_rating('u1')['loyalty'], 5)
+    
+    def test_reads_do_not_rebuild_leaderboard(self):
+        self.assertEqual(self.engine.get_stats()['users_count'], 0)
+        self.assertEqual(self.engine.get_top(), [])
+        self.assertEqual(self.manager.rebuilds, 0)
+    
+    def test_reconcile_recomputes_stale_leaderboard(self):
+        self.assertTrue(self.engine.reconcile_leaderboard())
+        self.assertEqual(self.manager.rebuilds, 1)
+        
+        # Стаж перешел порог без единой записи - пересчет только по возрасту лидерборда
+        self.manager.users['u1']['joined_at'] = (datetime.now() - timedelta(days=200)).isoformat()
+        self.assertFalse(self.engine.reconcile_leaderboard())
+        self.assertEqual(self.engine.get_top()[0]['loyalty'], 0)
+        
+        reconciled_at = datetime.now() - timedelta(seconds=LEADERBOARD_RECONCILE_SECONDS + 1)
+        self.manager.stats['reconciled_at'] = reconciled_at.isoformat()
+        self.engine.invalidate()
+        self.assertTrue(self.engine.reconcile_leaderboard())
+        self.assertEqual(self.manager.rebuilds, 2)
+        self.assertEqual(self.engine.get_top()[0]['loyalty'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
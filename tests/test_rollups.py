@@ -0,0 +1,88 @@
+"""
+Тесты часовых и дневных агрегатов аренд
+"""
+
+import unittest
+from database.rollups import RentalRollups
+
+class FakeBuckets:
+    """Коллекция корзин: bulk_write из UpdateOne с $inc и upsert"""
+    
+    def __init__(self):
+        self.docs = {}
+    
+    def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            doc = self.docs.setdefault(operation._filter['_id'], dict(operation._doc['$setOnInsert']))
+            for field, value in operation._doc['$inc'].items():
+                doc[field] = doc.get(field, 0) + value
+    
+    def delete_many(self, query):
+        self.docs.clear()
+    
+    def totals(self):
+        """Ненулевые значения корзин: {_id: {поле: значение}}"""
+        totals = {}
+        for doc_id, doc in self.docs.items():
+            fields = {field: round(value, 6) for field, value in doc.items()
+                      if field in ('rented_hours', 'revenue', 'rentals') and round(value, 6)}
+            if fields:
+                totals[doc_id] = fields
+        return totals
+
+class FakeManager:
+    def __init__(self):
+        self.db = {'rental_rollups': FakeBuckets()}
+        self.rentals = {}
+    
+    def iter_rentals(self, query, projection=None, batch_size=None):
+        return (rental for rental in self.rentals.values() if rental['status'] in query['status']['$in'])
+
+class RentalRollupsTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = FakeManager()
+        self.rollups = RentalRollups(self.manager)
+        self.buckets = self.manager.db['rental_rollups']
+    
+    def save(self, rental_id, rental):
+        """Запись аренды со сдвигом корзин, как в save_rental"""
+        self.rollups.apply_change(self.manager.rentals.get(rental_id), rental)
+        if rental:
+            self.manager.rentals[rental_id] = rental
+        else:
+            self.manager.rentals.pop(rental_id, None)
+    
+    def test_completed_rental_fills_hour_and_day_buckets(self):
+        rental = {'console_id': 'c1', 'status': 'active', 'total_cost': 150,
+                  'start_time': '2030-05-10T10:30:00', 'end_time': '2030-05-10T12:00:00'}
+        self.save('r1', rental)
+        self.assertEqual(self.buckets.totals(), {})
+        
+        self.save('r1', dict(rental, status='completed'))
+        self.assertEqual(self.buckets.totals(), {
+            'hour:c1:2030-05-10T10': {'rented_hours': 0.5},
+            'hour:c1:2030-05-10T11': {'rented_hours': 1},
+            'hour:c1:2030-05-10T12': {'rentals': 1, 'revenue': 150},
+            'day:c1:2030-05-10': {'rented_hours': 1.5, 'rentals': 1, 'revenue': 150}
+        })
+        
+        self.save('r1', None)
+        self.assertEqual(self.buckets.totals(), {})
+    
+    def test_incremental_buckets_match_rebuild(self):
+        self.save('r1', {'console_id': 'c1', 'status': 'completed', 'total_cost': 200,
+                         'start_time': '2030-05-10T23:15:00', 'end_time': '2030-05-11T01:00:00'})
+        self.save('r2', {'console_id': 'c2', 'status': 'returned', 'total_cost': 100,
+                         'start_time': '2030-05-11T09:00:00', 'end_time': '2030-05-11T10:00:00'})
+        # Исправили стоимость и перенесли аренду на другую консоль
+        self.save('r1', dict(self.manager.rentals['r1'], console_id='c2', total_cost=250))
+        self.save('r2', dict(self.manager.rentals['r2'], status='cancelled'))
+        incremental = self.buckets.totals()
+        
+        self.rollups.rebuild()
+        self.assertEqual(self.buckets.totals(), incremental)
+        self.assertEqual(incremental['day:c2:2030-05-11'], {'rented_hours': 1, 'rentals': 1, 'revenue': 250})
+        self.assertNotIn('day:c1:2030-05-11', incremental)
+
+if __name__ == '__main__':
+    unittest.main()
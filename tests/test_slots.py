@@ -0,0 +1,54 @@
+"""
+Тесты почасовой занятости резерваций календаря
+"""
+
+import unittest
+from pymongo.errors import DuplicateKeyError
+from database.slots import ReservationSlots
+
+class FakeMasks:
+    """Коллекция масок: условное обновление $bitsAllClear + $bit, как в MongoDB"""
+    
+    def __init__(self):
+        self.masks = {}
+    
+    def update_one(self, query, update, upsert=False):
+        key = query['_id']
+        current = self.masks.get(key)
+        bit = update['$bit']['mask']
+        if 'or' in bit:
+            if current is not None and current & query['mask']['$bitsAllClear']:
+                # Условие не выполнено, upsert упирается в существующий _id
+                raise DuplicateKeyError('duplicate key')
+            self.masks[key] = (current or 0) | bit['or']
+        elif current is not None:
+            self.masks[key] = current & bit['and']
+
+class FakeManager:
+    """Минимальный менеджер БД с коллекцией масок"""
+    
+    def __init__(self):
+        self.db = {'calendar_slots': FakeMasks()}
+
+class ReservationSlotsTest(unittest.TestCase):
+    def setUp(self):
+        self.slots = ReservationSlots(FakeManager())
+        self.masks = self.slots.collection.masks
+    
+    def test_reserved_claim_and_release_use_same_hours(self):
+        self.assertTrue(self.slots.claim('c1', '2030-05-01', '10:00', 2, 'reserved'))
+        self.assertEqual(self.masks['c1_2030-05-01'], 0b11 << 10)
+        self.assertFalse(self.slots.claim('c1', '2030-05-01', '11:00', 1, 'reserved'))
+        
+        self.slots.release({'console_id': 'c1', 'date': '2030-05-01', 'time_slot': '10:00',
+                            'duration_hours': 2, 'status': 'reserved'})
+        self.assertEqual(self.masks['c1_2030-05-01'], 0)
+    
+    def test_claim_skips_statuses_that_do_not_occupy_hours(self):
+        # release и rebuild не учитывают такие резервации - claim тоже не должен
+        self.assertTrue(self.slots.claim('c1', '2030-05-01', '10:00', 2, 'confirmed'))
+        self.assertTrue(self.slots.claim('c1', '2030-05-01', '10:00', 2, None))
+        self.assertEqual(self.masks, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Тесты временной резервации консоли (TTL-захват в temp_reservations)
+"""
+
+import copy
+from datetime import datetime, timedelta
+import unittest
+from pymongo.errors import DuplicateKeyError
+from database.db import MongoDBManager
+
+def matches(doc, query):
+    """Проверка документа фильтром MongoDB (только операторы, которые использует захват)"""
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(doc, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator == '$lte' and not (field in doc and doc[field] <= value):
+                    return False
+                if operator == '$gt' and not (field in doc and doc[field] > value):
+                    return False
+                if operator == '$ne' and doc.get(field) == value:
+                    return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+class FakeReservations:
+    """Коллекция temp_reservations: upsert по занятому _id падает с DuplicateKeyError, как в MongoDB"""
+    
+    def __init__(self):
+        self.docs = {}
+    
+    def find_one(self, query):
+        return next((copy.deepcopy(doc) for doc in self.docs.values() if matches(doc, query)), None)
+    
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = next((doc for doc in self.docs.values() if matches(doc, query)), None)
+        if doc is None:
+            if not upsert:
+                return None
+            if query['_id'] in self.docs:
+                raise DuplicateKeyError('duplicate key')
+            doc = self.docs[query['_id']] = {'_id': query['_id']}
+        doc.update(update['$set'])
+        return copy.deepcopy(doc)
+    
+    def delete_many(self, query):
+        for doc_id in [doc_id for doc_id, doc in self.docs.items() if matches(doc, query)]:
+            del self.docs[doc_id]
+
+class TempReservationClaimTest(unittest.TestCase):
+    def setUp(self):
+        # Менеджер без подключения: захват работает только с коллекцией temp_reservations
+        self.manager = MongoDBManager.__new__(MongoDBManager)
+        self.reservations = FakeReservations()
+        self.manager.db = {'temp_reservations': self.reservations}
+    
+    def test_claim_is_exclusive_until_it_expires(self):
+        self.assertTrue(self.manager.claim_temp_reservation('c1', 'u1'))
+        self.assertFalse(self.manager.claim_temp_reservation('c1', 'u2'))
+        self.assertEqual(self.manager.get_temp_reservation('c1')['user_id'], 'u1')
+        
+        # Истекшая резервация не действует, даже пока TTL-индекс ее не удалил
+        self.reservations.docs['c1']['expires_at'] = datetime.utcnow() - timedelta(seconds=1)
+        self.assertIsNone(self.manager.get_temp_reservation('c1'))
+        self.assertTrue(self.manager.claim_temp_reservation('c1', 'u2'))
+        self.assertEqual(self.manager.get_temp_reservation('c1')['user_id'], 'u2')
+    
+    def test_owner_renews_claim(self):
+        self.manager.claim_temp_reservation('c1', 'u1', timeout_minutes=1)
+        self.assertTrue(self.manager.claim_temp_reservation('c1', 'u1', timeout_minutes=30))
+        self.assertGreater(self.reservations.docs['c1']['expires_at'], datetime.utcnow() + timedelta(minutes=20))
+    
+    def test_user_holds_one_console(self):
+        self.manager.claim_temp_reservation('c1', 'u1')
+        self.manager.claim_temp_reservation('c2', 'u1')
+        self.assertEqual(list(self.reservations.docs), ['c2'])
+        self.assertTrue(self.manager.claim_temp_reservation('c1', 'u2'))
+
+if __name__ == '__main__':
+    unittest.main()